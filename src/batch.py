@@ -0,0 +1,244 @@
+import argparse
+import glob
+import json
+import os
+import re
+import sys
+import time
+from collections import deque
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, wait
+from concurrent.futures.process import BrokenProcessPool
+
+import cv2
+from PIL import Image
+
+from libs.basic_operations import apply_chain_array, to_array, to_pil
+from libs.edit_graph import steps_from_json
+
+# Headless batch mode: applies a recipe saved from the photo editor (or written
+# by hand, see libs.edit_graph.steps_to_json) to every image in a directory or
+# glob. Images are decoded, processed and written inside the worker processes,
+# so only paths and small result records cross the process boundary. At most
+# --max-in-flight images are queued at once, which bounds memory on large
+# inputs. Every finished file is appended to a JSONL manifest; a restarted run
+# skips files the manifest records as done.
+#
+# Run from src/:
+#   python batch.py recipe.json "photos/*.jpg" -o out/
+
+IMAGE_EXTENSIONS = (".png", ".jpg", ".jpeg", ".bmp", ".tif", ".tiff", ".webp")
+MANIFEST_NAME = "manifest.jsonl"
+REPORT_EVERY = 50
+GLOB_MAGIC = re.compile(r"[*?[]")
+
+def glob_root(pattern):
+    # The leading directories of a glob pattern that hold no wildcards
+    parts = []
+    for part in os.path.dirname(pattern).split(os.sep):
+        if GLOB_MAGIC.search(part):
+            break
+        parts.append(part)
+    return os.sep.join(parts) or (os.sep if pattern.startswith(os.sep) else ".")
+
+def is_inside(path, directory):
+    # directory must be absolute
+    return os.path.commonpath([os.path.abspath(path), directory]) == directory
+
+def collect_inputs(patterns, output_dir=None):
+    # (input path, output path relative to the output directory) pairs. Files
+    # keep their path relative to the directory given, or to the part of a
+    # glob before its first wildcard, so "in/**/*.png" keeps the subdirectories.
+    # Anything under output_dir is skipped, so a rerun with the output inside
+    # an input directory does not pick up its own results
+    exclude = os.path.abspath(output_dir) if output_dir else None
+    inputs = []
+    for pattern in patterns:
+        if os.path.isdir(pattern):
+            for root, dirs, files in os.walk(pattern):
+                if exclude:
+                    dirs[:] = [d for d in dirs if not is_inside(os.path.join(root, d), exclude)]
+                    if is_inside(root, exclude):
+                        continue
+                for name in sorted(files):
+                    if name.lower().endswith(IMAGE_EXTENSIONS):
+                        path = os.path.join(root, name)
+                        inputs.append((path, os.path.relpath(path, pattern)))
+        else:
+            root = glob_root(pattern)
+            for path in sorted(glob.glob(pattern, recursive=True)):
+                if exclude and is_inside(path, exclude):
+                    continue
+                if os.path.isfile(path) and path.lower().endswith(IMAGE_EXTENSIONS):
+                    inputs.append((path, os.path.relpath(path, root)))
+    return inputs
+
+def output_path(output_dir, relative, fmt):
+    if fmt:
+        relative = os.path.splitext(relative)[0] + "." + fmt.lstrip(".")
+    return os.path.join(output_dir, relative)
+
+def plan_outputs(inputs, output_dir, fmt):
+    # (input, output) pairs, refusing inputs that would overwrite each other's
+    # result, e.g. a.png and a.jpg with --format png; a file matched twice is
+    # kept once
+    outputs = {}
+    for src, relative in inputs:
+        dst = output_path(output_dir, relative, fmt)
+        if outputs.setdefault(dst, src) != src:
+            raise ValueError(f"{outputs[dst]} and {src} would both be written to {dst}")
+    return [(src, dst) for dst, src in outputs.items()]
+
+def read_manifest(path):
+    # Input paths that already have a result
+    done = set()
+    if not os.path.exists(path):
+        return done
+    with open(path) as f:
+        for line in f:
+            try:
+                record = json.loads(line)
+            except ValueError:
+                # A line cut short by an interrupted run
+                continue
+            if record.get("status") == "ok" and os.path.exists(record["output"]):
+                done.add(record["input"])
+    return done
+
+def init_worker():
+    # One image per process; OpenCV's own threads would only oversubscribe
+    cv2.setNumThreads(1)
+
+def make_pool(workers):
+    return ProcessPoolExecutor(max_workers=workers, initializer=init_worker)
+
+def process_file(src, dst, steps):
+    start = time.perf_counter()
+    try:
+        image = to_array(Image.open(src))
+        megapixels = image.shape[0] * image.shape[1] / 1e6
+        result = apply_chain_array(image, steps)
+        os.makedirs(os.path.dirname(dst) or ".", exist_ok=True)
+        to_pil(result).save(dst)
+    except Exception as e:
+        return {"input": src, "output": dst, "status": "error", "error": f"{type(e).__name__}: {e}",
+                "seconds": round(time.perf_counter() - start, 4)}
+    return {"input": src, "output": dst, "status": "ok", "megapixels": round(megapixels, 3),
+            "seconds": round(time.perf_counter() - start, 4)}
+
+def report(done, failed, total, megapixels, elapsed):
+    elapsed = max(elapsed, 1e-9)
+    print(f"{done + failed}/{total} images, {failed} failed, "
+          f"{done / elapsed:.2f} images/s, {megapixels / elapsed:.2f} MP/s", flush=True)
+
+def error_record(src, dst, e):
+    return {"input": src, "output": dst, "status": "error", "error": f"{type(e).__name__}: {e}"}
+
+def run_batch(steps, inputs, output_dir, fmt=None, workers=None, max_in_flight=None, manifest=None):
+    workers = workers or os.cpu_count() or 1
+    max_in_flight = max_in_flight or 2 * workers
+    manifest = manifest or os.path.join(output_dir, MANIFEST_NAME)
+    planned = plan_outputs(inputs, output_dir, fmt)
+    os.makedirs(output_dir, exist_ok=True)
+
+    finished = read_manifest(manifest)
+    pending = [(src, dst) for src, dst in planned if src not in finished]
+    if finished:
+        print(f"Skipping {len(planned) - len(pending)} images already in {manifest}")
+
+    done = failed = 0
+    megapixels = 0.0
+    start = time.perf_counter()
+    queue = deque(pending)
+    # A worker that dies (e.g. killed for memory) breaks the whole pool, and
+    # every file in flight with it fails. Those files are rerun one at a time
+    # on a fresh pool, so only a file that kills its worker on its own fails
+    suspects = deque()
+    running = {}
+    broken = False
+    pool = make_pool(workers)
+    try:
+        with open(manifest, "a") as log:
+            while queue or suspects or running:
+                # Keep the pool fed without queueing the whole directory
+                while not broken:
+                    if suspects:
+                        if running:
+                            break
+                        paths, alone = suspects.popleft(), True
+                    elif queue and len(running) < max_in_flight:
+                        paths, alone = queue.popleft(), False
+                    else:
+                        break
+                    try:
+                        future = pool.submit(process_file, *paths, steps)
+                    except BrokenProcessPool:
+                        (suspects if alone else queue).appendleft(paths)
+                        broken = True
+                        break
+                    running[future] = paths, alone
+
+                completed = wait(running, return_when=FIRST_COMPLETED)[0] if running else ()
+                for future in completed:
+                    (src, dst), alone = running.pop(future)
+                    try:
+                        record = future.result()
+                    except BrokenProcessPool as e:
+                        broken = True
+                        if not alone:
+                            suspects.append((src, dst))
+                            continue
+                        record = error_record(src, dst, e)
+                    except Exception as e:
+                        record = error_record(src, dst, e)
+
+                    if record["status"] == "ok":
+                        done += 1
+                        megapixels += record["megapixels"]
+                    else:
+                        failed += 1
+                        print(f"Failed {record['input']}: {record['error']}", file=sys.stderr)
+                    log.write(json.dumps(record) + "\n")
+                    log.flush()
+
+                    if (done + failed) % REPORT_EVERY == 0:
+                        report(done, failed, len(pending), megapixels, time.perf_counter() - start)
+
+                if broken and not running:
+                    pool.shutdown(cancel_futures=True)
+                    pool = make_pool(workers)
+                    broken = False
+    finally:
+        pool.shutdown(cancel_futures=True)
+
+    report(done, failed, len(pending), megapixels, time.perf_counter() - start)
+    return done, failed
+
+def main():
+    parser = argparse.ArgumentParser(description="Apply an editor recipe to a batch of images")
+    parser.add_argument("recipe", help="JSON recipe saved from the photo editor")
+    parser.add_argument("inputs", nargs="+", help="Directories or glob patterns")
+    parser.add_argument("-o", "--output", required=True, help="Output directory")
+    parser.add_argument("--format", help="Output file extension, e.g. png (default: keep the input's)")
+    parser.add_argument("--workers", type=int, help="Worker processes (default: CPU count)")
+    parser.add_argument("--max-in-flight", type=int, help="Images queued at once (default: 2 per worker)")
+    parser.add_argument("--manifest", help=f"Progress manifest (default: OUTPUT/{MANIFEST_NAME})")
+    args = parser.parse_args()
+
+    with open(args.recipe) as f:
+        try:
+            steps = steps_from_json(f.read())
+        except (ValueError, KeyError, TypeError) as e:
+            parser.error(f"invalid recipe {args.recipe}: {e}")
+    inputs = collect_inputs(args.inputs, args.output)
+    if not inputs:
+        parser.error("no images found")
+
+    try:
+        _, failed = run_batch(steps, inputs, args.output, args.format, args.workers, args.max_in_flight,
+                              args.manifest)
+    except ValueError as e:
+        parser.error(str(e))
+    sys.exit(1 if failed else 0)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,109 @@
+# Compares the PIL wrappers in libs.basic_operations (what PhotoEditorPage used
+# to call on every button press) with the ndarray core it now uses.
+#
+# Run from src/:
+#   python -m benchmarks.bench_basic_operations --width 6000 --height 4000
+import argparse
+import time
+
+import numpy as np
+from PIL import Image as PILImage
+
+from libs import basic_operations as ops
+
+CASES = [
+    ("apply_grayscale", ()),
+    ("apply_negative", ()),
+    ("apply_color_manipulation", (1, 2, 1)),
+    ("apply_crop_image", (100, 100, 1000, 1000)),
+    ("apply_flip", ("Horizontal",)),
+    ("apply_scaling", (1920, 1080)),
+    ("apply_translation", (40, 40)),
+    ("apply_rotation", (30,)),
+    ("apply_brightness", (1.2,)),
+    ("apply_contrast", (1.2,)),
+    ("apply_border", (5, "Black")),
+    ("apply_color_filter", ("Sepia",)),
+    ("apply_mean_filter", ()),
+    ("apply_gaussian_filter", ()),
+    ("apply_median_filter", ()),
+    ("apply_sobel_filter", ()),
+    ("apply_canny_filter", ()),
+    ("apply_laplacian_filter", ()),
+    ("apply_histogram_equalization", ()),
+    ("apply_contrast_stretching", ()),
+    ("apply_gamma_correction", (2.2,)),
+    ("apply_morphological_operation", ("dilation",)),
+]
+
+class ConversionCounter:
+    # Counts full-frame copies between PIL and numpy: np.asarray(pil_image)
+    # goes through Image.__array_interface__ and the way back through
+    # Image.fromarray
+    def __enter__(self):
+        self.count = 0
+        self._array_interface = PILImage.Image.__array_interface__
+        self._fromarray = PILImage.fromarray
+        counter = self
+
+        def array_interface(image):
+            counter.count += 1
+            return counter._array_interface.fget(image)
+
+        def fromarray(*args, **kwargs):
+            counter.count += 1
+            return counter._fromarray(*args, **kwargs)
+
+        PILImage.Image.__array_interface__ = property(array_interface)
+        PILImage.fromarray = fromarray
+        return self
+
+    def __exit__(self, *exc):
+        PILImage.Image.__array_interface__ = self._array_interface
+        PILImage.fromarray = self._fromarray
+
+def best_time(func, repeat):
+    best = float("inf")
+    for _ in range(repeat):
+        start = time.perf_counter()
+        func()
+        best = min(best, time.perf_counter() - start)
+    return best
+
+def main():
+    parser = argparse.ArgumentParser(description="PIL wrapper vs ndarray core for basic_operations")
+    parser.add_argument("--width", type=int, default=6000)
+    parser.add_argument("--height", type=int, default=4000)
+    parser.add_argument("--repeat", type=int, default=3)
+    args = parser.parse_args()
+
+    rng = np.random.default_rng(0)
+    array = rng.integers(0, 256, (args.height, args.width, 3), dtype=np.uint8)
+    pil_image = PILImage.fromarray(array)
+    megapixels = args.width * args.height / 1e6
+
+    print(f"{args.width}x{args.height} RGB ({megapixels:.1f} MP), best of {args.repeat}")
+    print(f"{'operation':32} {'copies':>6} {'removed':>7} {'PIL ms':>9} {'array ms':>9} {'speed-up':>8}")
+    total_removed = 0
+    for name, params in CASES:
+        pil_op = getattr(ops, name)
+        array_op = getattr(ops, name + "_array")
+
+        # Warm up first so one-off table setup is not counted
+        array_op(array, *params)
+        with ConversionCounter() as pil_copies:
+            pil_op(pil_image, *params)
+        with ConversionCounter() as array_copies:
+            array_op(array, *params)
+        removed = pil_copies.count - array_copies.count
+        total_removed += removed
+
+        pil_time = best_time(lambda: pil_op(pil_image, *params), args.repeat)
+        array_time = best_time(lambda: array_op(array, *params), args.repeat)
+        print(f"{name:32} {array_copies.count:>6} {removed:>7} {pil_time * 1e3:>9.1f} "
+              f"{array_time * 1e3:>9.1f} {pil_time / array_time:>7.2f}x")
+
+    print(f"Frame copies removed across {len(CASES)} operations: {total_removed}")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,77 @@
+# Sizes and throughput of the Huffman coder in libs.entropy_coding against
+# zlib on the streams the file formats produce: DCT end-of-block positions and
+# coefficient codes, RLE run values and varint run lengths, and raw pixels.
+# MB/s is measured on the uncompressed stream.
+#
+# Run from src/:
+#   python -m benchmarks.bench_entropy --image ../stitched_image.png --size 4000x3000
+import argparse
+import time
+import zlib
+
+import cv2
+import numpy as np
+
+from libs import dct_codec
+from libs.compression_ops import run_length_encoding
+from libs.entropy_coding import huffman_decode, huffman_encode
+from libs.rle_format import encode_varints
+
+def timed(func, repeat):
+    best = float("inf")
+    for _ in range(repeat):
+        start = time.perf_counter()
+        result = func()
+        best = min(best, time.perf_counter() - start)
+    return best, result
+
+def dct_streams(image, quality):
+    # The end-of-block bytes and 16-bit codes of every component, as encode_dct
+    # builds them before entropy coding
+    tables = [dct_codec.quantization_table(quality), dct_codec.quantization_table(quality, chroma=True)]
+    streams = [dct_codec.coefficient_codes(dct_codec.quantize(dct_codec.forward_dct(dct_codec.to_blocks(plane)),
+                                                              tables[min(i, 1)]))
+               for i, plane in enumerate(dct_codec.to_components(image))]
+    return np.concatenate([eob for eob, _ in streams]), np.concatenate([codes for _, codes in streams])
+
+def main():
+    parser = argparse.ArgumentParser(description="Huffman coding vs zlib on codec streams")
+    parser.add_argument("--image", default="../stitched_image.png")
+    parser.add_argument("--size", default="4000x3000", help="Resize the image to WxH first")
+    parser.add_argument("--quality", type=int, default=75)
+    parser.add_argument("--level", type=int, default=6, help="zlib level")
+    parser.add_argument("--repeat", type=int, default=3)
+    args = parser.parse_args()
+
+    image = cv2.imread(args.image, cv2.IMREAD_COLOR)
+    if image is None:
+        parser.error(f"cannot read {args.image}")
+    width, height = (int(v) for v in args.size.split("x"))
+    image = cv2.resize(cv2.cvtColor(image, cv2.COLOR_BGR2RGB), (width, height), interpolation=cv2.INTER_AREA)
+
+    eob, codes = dct_streams(image, args.quality)
+    runs = run_length_encoding(image)
+    streams = [
+        ("dct eob", eob),
+        ("dct codes", codes),
+        ("rle values", np.concatenate([values for values, _ in runs])),
+        ("rle lengths", np.frombuffer(b"".join(encode_varints(lengths) for _, lengths in runs), dtype=np.uint8)),
+        ("raw pixels", image.ravel()),
+    ]
+
+    print(f"{'stream':>12} {'bytes':>11} {'zlib':>11} {'huffman':>11} "
+          f"{'zlib enc':>9} {'huff enc':>9} {'zlib dec':>9} {'huff dec':>9}  (MB/s)")
+    for name, symbols in streams:
+        raw = symbols.tobytes()
+        megabytes = len(raw) / 1e6
+        zlib_enc, packed = timed(lambda: zlib.compress(raw, args.level), args.repeat)
+        zlib_dec, unpacked = timed(lambda: zlib.decompress(packed), args.repeat)
+        huff_enc, coded = timed(lambda: huffman_encode(symbols), args.repeat)
+        huff_dec, (decoded, _) = timed(lambda: huffman_decode(coded), args.repeat)
+        assert unpacked == raw and np.array_equal(decoded, symbols)
+        print(f"{name:>12} {len(raw):11,} {len(packed):11,} {len(coded):11,} "
+              f"{megabytes / zlib_enc:9.1f} {megabytes / huff_enc:9.1f} "
+              f"{megabytes / zlib_dec:9.1f} {megabytes / huff_dec:9.1f}")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,104 @@
+# Compares the vectorized run-length coder in libs.compression_ops with the
+# previous per-pixel Python loops (copied below) and checks that both decode
+# to the same image, in both directions between the two formats. Every size
+# is timed on a posterized image and on a photo in colour and grayscale; the
+# speed-up depends on how long the runs are, so flat content gains the most.
+#
+# Run from src/:
+#   python -m benchmarks.bench_rle --sizes 1000x750 2000x1500
+import argparse
+import time
+
+import cv2
+import numpy as np
+
+from libs.compression_ops import run_length_decoding, run_length_encoding
+
+def legacy_run_length_encoding(image):
+    encoded_channels = []
+    for channel in cv2.split(image):
+        flattened = channel.flatten()
+        encoded = []
+        prev_pixel = flattened[0]
+        count = 1
+        for pixel in flattened[1:]:
+            if pixel == prev_pixel:
+                count += 1
+            else:
+                encoded.append((prev_pixel, count))
+                prev_pixel = pixel
+                count = 1
+        encoded.append((prev_pixel, count))
+        encoded_channels.append(encoded)
+    return encoded_channels
+
+def legacy_run_length_decoding(encoded_channels, shape):
+    decoded_channels = []
+    for encoded in encoded_channels:
+        decoded = []
+        for pixel, count in encoded:
+            decoded.extend([pixel] * count)
+        decoded_array = np.array(decoded, dtype=np.uint8)
+        decoded_channels.append(decoded_array.reshape(shape[:2]))
+    return cv2.merge(decoded_channels)
+
+def posterized_image(height, width, noise, rng):
+    # Flat regions with sharp edges, with a fraction of noisy pixels that
+    # break runs up
+    small = rng.integers(0, 256, (max(1, height // 32), max(1, width // 32), 3), dtype=np.uint8)
+    image = cv2.resize(small, (width, height), interpolation=cv2.INTER_NEAREST)
+    noisy = rng.random((height, width)) < noise
+    image[noisy] = rng.integers(0, 256, (int(noisy.sum()), 3), dtype=np.uint8)
+    return image
+
+def photo_image(height, width, source):
+    image = cv2.cvtColor(cv2.imread(source, cv2.IMREAD_COLOR), cv2.COLOR_BGR2RGB)
+    return cv2.resize(image, (width, height), interpolation=cv2.INTER_AREA)
+
+def timed(func, repeat=1):
+    best = float("inf")
+    for _ in range(repeat):
+        start = time.perf_counter()
+        result = func()
+        best = min(best, time.perf_counter() - start)
+    return best, result
+
+def compare(size, content, image):
+    old_enc_time, old_encoded = timed(lambda: legacy_run_length_encoding(image))
+    new_enc_time, new_encoded = timed(lambda: run_length_encoding(image), 5)
+    old_dec_time, old_decoded = timed(lambda: legacy_run_length_decoding(old_encoded, image.shape))
+    new_dec_time, new_decoded = timed(lambda: run_length_decoding(new_encoded, image.shape), 5)
+
+    assert np.array_equal(old_decoded, image) and np.array_equal(new_decoded, image)
+    # The old tuple lists still decode, and the runs are the same
+    assert np.array_equal(run_length_decoding(old_encoded, image.shape), image)
+    assert sum(len(c) for c in old_encoded) == sum(len(v) for v, _ in new_encoded)
+    # Column order round-trips too
+    assert np.array_equal(run_length_decoding(run_length_encoding(image, "column"), image.shape, "column"), image)
+
+    runs = sum(len(v) for v, _ in new_encoded)
+    speed_up = (old_enc_time + old_dec_time) / (new_enc_time + new_dec_time)
+    print(f"{size:>10} {content:>11} {runs:>9} {old_enc_time * 1e3:11.1f} {new_enc_time * 1e3:11.1f} "
+          f"{old_dec_time * 1e3:11.1f} {new_dec_time * 1e3:11.1f} {speed_up:8.0f}x")
+
+def main():
+    parser = argparse.ArgumentParser(description="Vectorized RLE vs the previous Python loops")
+    parser.add_argument("--sizes", nargs="+", default=["1000x750", "2000x1500"])
+    parser.add_argument("--noise", type=float, default=0.0, help="Fraction of pixels replaced by noise")
+    parser.add_argument("--image", default="../stitched_image.png", help="Photo for the natural image cases")
+    args = parser.parse_args()
+
+    rng = np.random.default_rng(0)
+    print(f"{'size':>10} {'content':>11} {'runs':>9} {'old enc ms':>11} {'new enc ms':>11} {'old dec ms':>11} "
+          f"{'new dec ms':>11} {'speed-up':>9}")
+    for size in args.sizes:
+        width, height = (int(v) for v in size.split("x"))
+        photo = photo_image(height, width, args.image)
+        contents = [("posterized", posterized_image(height, width, args.noise, rng)),
+                    ("photo", photo),
+                    ("photo gray", cv2.cvtColor(photo, cv2.COLOR_RGB2GRAY))]
+        for content, image in contents:
+            compare(size, content, image)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,76 @@
+# Peak memory and throughput of compressing a raw or .npy image file to a
+# tiled file and back with libs.tiled_codec, which reads and writes through
+# memory maps one strip at a time. Peak is what tracemalloc sees NumPy and
+# Python allocate; the memory mapped pages belong to the page cache.
+#
+# Run from src/:
+#   python -m benchmarks.bench_streaming --size 20000x12000 --tile-sizes 512 1024
+import argparse
+import os
+import tempfile
+import time
+import tracemalloc
+
+import cv2
+import numpy as np
+
+from libs.tiled_codec import compress_file, decompress_file, open_image
+
+def make_raw(path, width, height, source):
+    # Tiles a resized photo across the frame, a strip at a time
+    image = cv2.cvtColor(cv2.imread(source, cv2.IMREAD_COLOR), cv2.COLOR_BGR2RGB)
+    tile = cv2.resize(image, (min(width, 2000), min(height, 1000)), interpolation=cv2.INTER_AREA)
+    out = np.memmap(path, dtype=np.uint8, mode="w+", shape=(height, width, 3))
+    for y in range(0, height, tile.shape[0]):
+        rows = min(tile.shape[0], height - y)
+        out[y:y + rows] = np.tile(tile[:rows], (1, -(-width // tile.shape[1]), 1))[:, :width]
+    out.flush()
+
+def traced(func):
+    tracemalloc.start()
+    start = time.perf_counter()
+    func()
+    seconds = time.perf_counter() - start
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return seconds, peak
+
+def main():
+    parser = argparse.ArgumentParser(description="Strip streaming compression of large image files")
+    parser.add_argument("--input", help="Raw uint8 RGB file (needs --size) or .npy; generated if omitted")
+    parser.add_argument("--image", default="../stitched_image.png", help="Photo the generated input is made from")
+    parser.add_argument("--size", default="20000x12000", help="WxH of the raw input")
+    parser.add_argument("--codecs", nargs="+", default=["dct"], choices=["dct", "rle"])
+    parser.add_argument("--tile-sizes", nargs="+", type=int, default=[512, 1024])
+    parser.add_argument("--workers", type=int, default=1)
+    args = parser.parse_args()
+
+    width, height = (int(v) for v in args.size.split("x"))
+    with tempfile.TemporaryDirectory() as tmp:
+        source = args.input
+        if source is None:
+            source = os.path.join(tmp, "input.raw")
+            make_raw(source, width, height, args.image)
+        shape = None if source.endswith(".npy") else (height, width, 3)
+        image = open_image(source, shape)
+        megapixels = image.shape[0] * image.shape[1] / 1e6
+        print(f"input {image.shape}, {image.nbytes / 2 ** 20:,.0f} MB")
+        print(f"{'codec':>5} {'tile':>5} {'bytes':>13} {'enc MP/s':>9} {'enc peak MB':>12} "
+              f"{'dec MP/s':>9} {'dec peak MB':>12}")
+
+        for codec in args.codecs:
+            for tile_size in args.tile_sizes:
+                packed = os.path.join(tmp, "image.til")
+                unpacked = os.path.join(tmp, "decoded.npy")
+                enc_time, enc_peak = traced(lambda: compress_file(source, packed, codec, shape, tile_size,
+                                                                  args.workers))
+                dec_time, dec_peak = traced(lambda: decompress_file(packed, unpacked, args.workers))
+                if codec == "rle":
+                    decoded = np.load(unpacked, mmap_mode="r")
+                    assert all(np.array_equal(decoded[y:y + 1024], image[y:y + 1024])
+                               for y in range(0, image.shape[0], 1024))
+                print(f"{codec:>5} {tile_size:>5} {os.path.getsize(packed):13,} {megapixels / enc_time:9.1f} "
+                      f"{enc_peak / 2 ** 20:12.1f} {megapixels / dec_time:9.1f} {dec_peak / 2 ** 20:12.1f}")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,51 @@
+# Size, speed and quality of the DCT codec's chroma subsampling modes against
+# 4:4:4 on the same photo.
+#
+# Run from src/:
+#   python -m benchmarks.bench_subsampling --image ../stitched_image.png --size 4000x3000
+import argparse
+import time
+
+import cv2
+
+from libs.compression_analytics import psnr, ssim
+from libs.dct_codec import SUBSAMPLING_MODES, decode_dct, encode_dct
+
+def timed(func, repeat):
+    best = float("inf")
+    for _ in range(repeat):
+        start = time.perf_counter()
+        result = func()
+        best = min(best, time.perf_counter() - start)
+    return best, result
+
+def main():
+    parser = argparse.ArgumentParser(description="DCT chroma subsampling modes vs 4:4:4")
+    parser.add_argument("--image", default="../stitched_image.png")
+    parser.add_argument("--size", default="4000x3000", help="Resize the image to WxH first")
+    parser.add_argument("--qualities", nargs="+", type=int, default=[50, 75, 90])
+    parser.add_argument("--repeat", type=int, default=2)
+    args = parser.parse_args()
+
+    image = cv2.imread(args.image, cv2.IMREAD_COLOR)
+    if image is None:
+        parser.error(f"cannot read {args.image}")
+    width, height = (int(v) for v in args.size.split("x"))
+    image = cv2.resize(cv2.cvtColor(image, cv2.COLOR_BGR2RGB), (width, height), interpolation=cv2.INTER_CUBIC)
+
+    print(f"{'mode':>6} {'q':>4} {'bytes':>11} {'size':>6} {'enc ms':>8} {'dec ms':>8} {'speed-up':>9} "
+          f"{'PSNR dB':>8} {'dPSNR':>6} {'SSIM':>7}")
+    for quality in args.qualities:
+        base = None
+        for mode in SUBSAMPLING_MODES:
+            enc_time, data = timed(lambda: encode_dct(image, quality, subsampling=mode), args.repeat)
+            dec_time, decoded = timed(lambda: decode_dct(data), args.repeat)
+            quality_db = psnr(image, decoded)
+            if base is None:
+                base = (len(data), enc_time + dec_time, quality_db)
+            print(f"{mode:>6} {quality:>4} {len(data):11,} {len(data) / base[0]:6.0%} {enc_time * 1e3:8.0f} "
+                  f"{dec_time * 1e3:8.0f} {base[1] / (enc_time + dec_time):8.2f}x {quality_db:8.2f} "
+                  f"{quality_db - base[2]:+6.2f} {ssim(image, decoded):7.4f}")
+
+if __name__ == "__main__":
+    main()
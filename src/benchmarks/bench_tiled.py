@@ -0,0 +1,70 @@
+# Scaling of the tiled container in libs.tiled_codec with the number of
+# workers, against encoding and decoding the whole frame as one file, plus
+# the cost of decoding a single region.
+#
+# Run from src/:
+#   python -m benchmarks.bench_tiled --size 8000x6000 --workers 1 2 4 8 --processes
+import argparse
+import time
+
+import cv2
+import numpy as np
+
+from libs.dct_codec import decode_dct, encode_dct
+from libs.rle_format import decode_rle, encode_rle
+from libs.tiled_codec import decode_region, decode_tiled, encode_tiled
+
+WHOLE = {"dct": (encode_dct, decode_dct), "rle": (encode_rle, decode_rle)}
+
+def timed(func, repeat):
+    best = float("inf")
+    for _ in range(repeat):
+        start = time.perf_counter()
+        result = func()
+        best = min(best, time.perf_counter() - start)
+    return best, result
+
+def main():
+    parser = argparse.ArgumentParser(description="Tiled codec scaling with workers")
+    parser.add_argument("--image", default="../stitched_image.png")
+    parser.add_argument("--size", default="4000x3000", help="Resize the image to WxH first")
+    parser.add_argument("--codecs", nargs="+", default=["dct", "rle"], choices=list(WHOLE))
+    parser.add_argument("--tile-size", type=int, default=1024)
+    parser.add_argument("--workers", nargs="+", type=int, default=[1, 2, 4, 8])
+    parser.add_argument("--processes", action="store_true", help="Process pool instead of threads")
+    parser.add_argument("--repeat", type=int, default=2)
+    args = parser.parse_args()
+
+    image = cv2.imread(args.image, cv2.IMREAD_COLOR)
+    if image is None:
+        parser.error(f"cannot read {args.image}")
+    width, height = (int(v) for v in args.size.split("x"))
+    image = cv2.resize(cv2.cvtColor(image, cv2.COLOR_BGR2RGB), (width, height), interpolation=cv2.INTER_CUBIC)
+    megapixels = width * height / 1e6
+
+    print(f"{'codec':>5} {'workers':>8} {'bytes':>11} {'enc MP/s':>9} {'dec MP/s':>9} {'speed-up':>9}")
+    for codec in args.codecs:
+        encode, decode = WHOLE[codec]
+        enc_time, data = timed(lambda: encode(image), args.repeat)
+        dec_time, _ = timed(lambda: decode(data), args.repeat)
+        base = enc_time + dec_time
+        print(f"{codec:>5} {'whole':>8} {len(data):11,} {megapixels / enc_time:9.1f} {megapixels / dec_time:9.1f} "
+              f"{1:8.2f}x")
+
+        for workers in args.workers:
+            enc_time, data = timed(lambda: encode_tiled(image, codec, args.tile_size, workers, args.processes),
+                                   args.repeat)
+            dec_time, decoded = timed(lambda: decode_tiled(data, workers, args.processes), args.repeat)
+            assert decoded.shape == image.shape
+            if codec == "rle":
+                assert np.array_equal(decoded, image)
+            print(f"{codec:>5} {workers:>8} {len(data):11,} {megapixels / enc_time:9.1f} {megapixels / dec_time:9.1f} "
+                  f"{base / (enc_time + dec_time):8.2f}x")
+
+        # A region covering exactly one tile
+        size = args.tile_size
+        region_time, _ = timed(lambda: decode_region(data, size, size, size, size, 1), args.repeat)
+        print(f"{codec:>5} {'region':>8} {size}x{size} tile decoded in {region_time * 1e3:.0f} ms")
+
+if __name__ == "__main__":
+    main()
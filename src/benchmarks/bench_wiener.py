@@ -0,0 +1,85 @@
+# Compares the frequency-domain Wiener deconvolver in libs.frequency_ops with
+# the previous apply_wiener_filter, which thresholded the image and ran
+# scipy.signal.convolve2d with a 5x5 box. The previous path needs scipy and is
+# skipped when it is not installed.
+#
+# Run from src/:
+#   python -m benchmarks.bench_wiener --sizes 1000x1000 4000x3000
+import argparse
+import time
+
+import cv2
+import numpy as np
+
+from libs.frequency_ops import make_psf, wiener_deconvolve
+
+def legacy_wiener(image):
+    from scipy.signal import convolve2d
+
+    kernel_size = 5
+    noise_est = 25
+    signal_est = 100
+    kernel = np.ones((kernel_size, kernel_size)) / (kernel_size * kernel_size)
+
+    img_array = cv2.cvtColor(image, cv2.COLOR_RGB2GRAY)
+    _, binary_image = cv2.threshold(img_array, 127, 255, cv2.THRESH_BINARY)
+
+    blurred_image = convolve2d(binary_image, kernel, mode='same', boundary='symm')
+    ratio = signal_est / (signal_est + noise_est)
+    filtered_image = blurred_image * ratio
+    return np.clip(filtered_image, 0, 255).astype(np.uint8)
+
+def psnr(a, b):
+    mse = np.mean((a.astype(np.float64) - b.astype(np.float64)) ** 2)
+    return float("inf") if mse == 0 else 10 * np.log10(255.0 ** 2 / mse)
+
+def synthetic_scene(height, width, rng):
+    # Blocky shapes softened a little, so blur and its removal are visible
+    small = rng.integers(0, 256, (max(1, height // 16), max(1, width // 16), 3), dtype=np.uint8)
+    scene = cv2.resize(small, (width, height), interpolation=cv2.INTER_NEAREST)
+    return cv2.GaussianBlur(scene, (0, 0), 1.0)
+
+def timed(func, repeat):
+    best = float("inf")
+    for _ in range(repeat):
+        start = time.perf_counter()
+        result = func()
+        best = min(best, time.perf_counter() - start)
+    return best, result
+
+def main():
+    parser = argparse.ArgumentParser(description="Wiener deconvolution vs the previous convolve2d path")
+    parser.add_argument("--sizes", nargs="+", default=["1000x1000", "4000x3000"])
+    parser.add_argument("--noise", type=float, default=2.0)
+    parser.add_argument("--repeat", type=int, default=2)
+    args = parser.parse_args()
+
+    try:
+        import scipy  # noqa: F401
+        have_scipy = True
+    except ImportError:
+        have_scipy = False
+        print("scipy not installed: skipping the previous implementation")
+
+    rng = np.random.default_rng(0)
+    print(f"{'size':>11} {'psf':>9} {'old ms':>9} {'new ms':>9} {'speed-up':>8} {'blurred dB':>10} {'restored dB':>11}")
+    for size in args.sizes:
+        width, height = (int(v) for v in size.split("x"))
+        scene = synthetic_scene(height, width, rng)
+        old_time = None
+        if have_scipy:
+            old_time, _ = timed(lambda: legacy_wiener(scene), args.repeat)
+
+        for psf, psf_size in (("box", 5), ("gaussian", 9), ("motion", 9)):
+            kernel = make_psf(psf, psf_size, 30)
+            blurred = cv2.filter2D(scene.astype(np.float32), -1, kernel, borderType=cv2.BORDER_REFLECT)
+            blurred = np.clip(blurred + rng.normal(0, args.noise, blurred.shape), 0, 255).astype(np.uint8)
+            new_time, restored = timed(lambda: wiener_deconvolve(blurred, psf, psf_size, angle=30), args.repeat)
+
+            old_ms = f"{old_time * 1e3:9.1f}" if old_time else f"{'-':>9}"
+            speed_up = f"{old_time / new_time:7.2f}x" if old_time else f"{'-':>8}"
+            print(f"{size:>11} {psf:>9} {old_ms} {new_time * 1e3:9.1f} {speed_up} "
+                  f"{psnr(blurred, scene):10.2f} {psnr(restored, scene):11.2f}")
+
+if __name__ == "__main__":
+    main()
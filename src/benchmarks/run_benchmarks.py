@@ -0,0 +1,393 @@
+# Benchmark suite for the functions in src/libs. Every case runs on synthetic
+# images at several sizes and colour modes and records the best wall time,
+# throughput and the peak of memory allocated through numpy (tracemalloc).
+#
+# Results can be saved as a baseline and later runs compared against it; the
+# run fails when a case is slower than its baseline by more than --threshold.
+# Independently of the timed sizes, every case is also run once on a small
+# fixed image and its output compared with the fingerprint stored in
+# references.json (shape, dtype, a hash and a 16x16 thumbnail, so harmless
+# last-bit differences between platforms still pass). The file keeps one line
+# per reference so refreshing one shows up as a one-line diff. Code that only
+# takes its tiled path on large frames has extra reference-only "[tiled]"
+# cases run on a frame above the tiling threshold. They fingerprint a window
+# of the reference size around a tile corner, and the neighbourhood filters,
+# which tile to match the whole-frame call pixel for pixel, must also equal
+# that call exactly: a seam a pixel wide is too faint for the thumbnail.
+#
+# Run from src/:
+#   python -m benchmarks.run_benchmarks --sizes 1 12 --save-baseline baseline.json
+#   python -m benchmarks.run_benchmarks --sizes 1 12 --baseline baseline.json
+#   python -m benchmarks.run_benchmarks --only compression --update-references
+import argparse
+import hashlib
+import json
+import math
+import os
+import sys
+import tempfile
+import time
+import tracemalloc
+
+import cv2
+import numpy as np
+
+from libs import background_removal, blend_image, compression_analytics, compression_ops, dct_codec
+from libs import entropy_coding, mathematical_operations, morphology_ops, rle_format, segmentation_ops, tiled_codec
+from libs import tiling
+from libs.basic_operations import apply_chain_array, apply_operation_array
+
+REFERENCES_PATH = os.path.join(os.path.dirname(__file__), "references.json")
+REFERENCE_SIZE = (320, 240)
+# Just above tiling.MIN_TILED_PIXELS, and several 1024 pixel tiles. The window
+# is centred on the corner the last column and the last row of tiles share
+TILED_REFERENCE_SIZE = (2400, 1800)
+_corner_x, _corner_y = 2 * tiling.DEFAULT_TILE_SIZE, tiling.DEFAULT_TILE_SIZE
+TILED_WINDOW = (slice(_corner_y - REFERENCE_SIZE[1] // 2, _corner_y + REFERENCE_SIZE[1] // 2),
+                slice(_corner_x - REFERENCE_SIZE[0] // 2, _corner_x + REFERENCE_SIZE[0] // 2))
+THUMBNAIL_SIZE = 16
+# Largest level difference any thumbnail cell may drift before a result
+# counts as changed. A maximum rather than a mean, so a regression confined
+# to a seam or a border is not averaged away
+REFERENCE_TOLERANCE = 4.0
+# Regressions smaller than this are timer noise
+MIN_REGRESSION_SECONDS = 0.005
+
+def case(module, function, run, label="", modes=("rgb", "gray"), max_megapixels=None, decode=None):
+    # run(inputs) calls the function; inputs has the "image"/"image2" arrays
+    # and "path"/"path2" files of the same images. decode turns a result that
+    # is not an image into one for the reference check
+    name = f"{module}.{function}" + (f"[{label}]" if label else "")
+    return {"name": name, "run": run, "modes": modes, "max_megapixels": max_megapixels, "decode": decode,
+            "reference_size": REFERENCE_SIZE, "timed": True, "exact": False}
+
+def operation_case(name, label="", modes=("rgb", "gray"), max_megapixels=None, **params):
+    return case("basic_operations", name, lambda inputs: apply_operation_array(inputs["image"], name, params),
+                label, modes, max_megapixels)
+
+def tiled_case(c, exact=False):
+    # Reference-only copy of c checked on a frame large enough to be tiled.
+    # With exact the window must also equal the result with tiling turned off
+    def decode(result, inputs):
+        if c["decode"] is not None:
+            result = c["decode"](result, inputs)
+        return np.asarray(result)[TILED_WINDOW]
+    return dict(c, name=c["name"] + "[tiled]", decode=decode, reference_size=TILED_REFERENCE_SIZE, timed=False,
+                exact=exact)
+
+def untiled(c, inputs):
+    # The window of c's result on inputs as an untiled call computes it
+    saved = tiling.MIN_TILED_PIXELS
+    tiling.MIN_TILED_PIXELS = math.inf
+    try:
+        return c["decode"](c["run"](inputs), inputs)
+    finally:
+        tiling.MIN_TILED_PIXELS = saved
+
+def path_case(module, function, *args, label="", two_inputs=True, max_megapixels=None):
+    func = getattr(module, function)
+    def run(inputs):
+        paths = (inputs["path"], inputs["path2"]) if two_inputs else (inputs["path"],)
+        return func(*paths, *args)
+    return case(module.__name__.split(".")[-1], function, run, label, ("rgb",), max_megapixels)
+
+CHAIN = [
+    ("apply_brightness", {"brightness_factor": 1.1}),
+    ("apply_contrast", {"contrast_factor": 1.2}),
+    ("apply_gaussian_filter", {}),
+    ("apply_gamma_correction", {"gamma": 0.8}),
+    ("apply_rotation", {"angle": 15}),
+]
+
+CASES = [
+    operation_case("apply_grayscale", modes=("rgb",)),
+    operation_case("apply_negative"),
+    operation_case("apply_color_manipulation", r_factor=1.2, g_factor=1, b_factor=0.8, modes=("rgb",)),
+    operation_case("apply_scaling", "down", new_width=640, new_height=480),
+    operation_case("apply_scaling", "up", new_width=2000, new_height=1500, max_megapixels=12),
+    operation_case("apply_translation", dx=40, dy=-25),
+    operation_case("apply_crop_image", start_row=100, start_col=100, num_rows=500, num_cols=500),
+    operation_case("apply_flip", flip_type="Horizontal"),
+    operation_case("apply_rotation", "30", angle=30),
+    operation_case("apply_rotation", "90", angle=90),
+    operation_case("apply_brightness", brightness_factor=1.2),
+    operation_case("apply_contrast", contrast_factor=1.3),
+    operation_case("apply_border", thickness=5, color="Black"),
+    operation_case("apply_color_filter", filter_type="Sepia"),
+    operation_case("apply_mean_filter"),
+    operation_case("apply_gaussian_filter"),
+    operation_case("apply_median_filter"),
+    operation_case("apply_sobel_filter"),
+    operation_case("apply_canny_filter"),
+    operation_case("apply_laplacian_filter"),
+    operation_case("apply_low_pass_filter", "ideal", radius=30, mask="ideal"),
+    operation_case("apply_low_pass_filter", "gaussian", radius=30, mask="gaussian"),
+    operation_case("apply_high_pass_filter", "butterworth", radius=30, mask="butterworth"),
+    operation_case("apply_wiener_filter", "box", psf="box", size=5),
+    operation_case("apply_histogram_equalization"),
+    operation_case("apply_contrast_stretching"),
+    operation_case("apply_gamma_correction", gamma=2.2),
+    case("basic_operations", "apply_chain_array", lambda inputs: apply_chain_array(inputs["image"], CHAIN), "5 steps"),
+
+    *[case("compression_ops", "run_length_encoding",
+           lambda inputs, order=order: compression_ops.run_length_encoding(inputs["image"], order), order,
+           decode=lambda result, inputs, order=order: compression_ops.run_length_decoding(result, inputs["image"].shape, order))
+      for order in compression_ops.SCAN_ORDERS],
+    case("compression_ops", "compress_image_rle", lambda inputs: compression_ops.compress_image_rle(inputs["image"])),
+    case("rle_format", "encode_rle", lambda inputs: rle_format.encode_rle(inputs["image"]),
+         decode=lambda result, inputs: rle_format.decode_rle(result)),
+    *[case("compression_ops", "compress_image_dct",
+           lambda inputs, quality=quality: compression_ops.compress_image_dct(inputs["image"], quality), f"q{quality}")
+      for quality in (50, 90)],
+    case("dct_codec", "encode_dct", lambda inputs: dct_codec.encode_dct(inputs["image"]),
+         decode=lambda result, inputs: dct_codec.decode_dct(result)),
+    case("dct_codec", "encode_dct", lambda inputs: dct_codec.encode_dct(inputs["image"], subsampling="4:2:0"), "4:2:0",
+         modes=("rgb",), decode=lambda result, inputs: dct_codec.decode_dct(result)),
+    case("dct_codec", "encode_dct", lambda inputs: dct_codec.encode_dct(inputs["image"], progressive=True), "progressive",
+         decode=lambda result, inputs: dct_codec.decode_dct_preview(result)),
+    case("dct_codec", "encode_dct_to_size",
+         lambda inputs: dct_codec.encode_dct_to_size(inputs["image"], inputs["image"].nbytes // 20), "1:20",
+         decode=lambda result, inputs: dct_codec.decode_dct(result)),
+    *[case("tiled_codec", "encode_tiled", lambda inputs, codec=codec: tiled_codec.encode_tiled(inputs["image"], codec),
+           codec, decode=lambda result, inputs: tiled_codec.decode_tiled(result))
+      for codec in tiled_codec.CODECS],
+    case("entropy_coding", "huffman_encode", lambda inputs: entropy_coding.huffman_encode(inputs["image"]),
+         decode=lambda result, inputs: entropy_coding.huffman_decode(result)[0].reshape(inputs["image"].shape)),
+    *[case("compression_analytics", metric,
+           lambda inputs, metric=metric: getattr(compression_analytics, metric)(inputs["image"], inputs["image2"]),
+           decode=lambda result, inputs: np.full((1, 1), result, np.float32))
+      for metric in ("psnr", "ssim")],
+
+    path_case(background_removal, "remove_background_threshold", two_inputs=False),
+    path_case(background_removal, "remove_background_kmeans", two_inputs=False, max_megapixels=12),
+    path_case(background_removal, "remove_background_kmeans", 2, 10, None, label="full", two_inputs=False,
+              max_megapixels=12),
+    case("background_removal", "kmeans_mask",
+         lambda inputs: background_removal.kmeans_mask(inputs["image"], superpixels=2000), "superpixels",
+         modes=("rgb",)),
+    case("background_removal", "grabcut_mask", lambda inputs: background_removal.grabcut_mask(inputs["image"]),
+         modes=("rgb",)),
+    case("background_removal", "histogram_mask",
+         lambda inputs: background_removal.histogram_mask(
+             inputs["image"], background_removal.learn_background_model([inputs["image2"]])),
+         "learn + classify"),
+
+    path_case(blend_image, "blend_images", 0.6, 0.4, 0),
+    path_case(blend_image, "overlay_images", 0.5, 20, 20),
+
+    path_case(mathematical_operations, "add_images"),
+    path_case(mathematical_operations, "subtract_images"),
+    path_case(mathematical_operations, "multiply_images"),
+    path_case(mathematical_operations, "divide_images"),
+    path_case(mathematical_operations, "bitwise_and_images"),
+    path_case(mathematical_operations, "bitwise_or_images"),
+    path_case(mathematical_operations, "bitwise_xor_images"),
+    path_case(mathematical_operations, "bitwise_not_image", two_inputs=False),
+
+    *[case("morphology_ops", "morphological_operations",
+           lambda inputs, op=op: morphology_ops.morphological_operations(inputs["image"], op), op)
+      for op in ("dilation", "erosion", "opening", "closing")],
+
+    case("segmentation_ops", "global_thresholding",
+         lambda inputs: segmentation_ops.global_thresholding(inputs["image"]), modes=("rgb",)),
+    case("segmentation_ops", "adaptive_thresholding",
+         lambda inputs: segmentation_ops.adaptive_thresholding(inputs["image"]), modes=("rgb",)),
+]
+
+# Neighbourhood filters run tile by tile only from MIN_TILED_PIXELS up, and the
+# tiled container only has several tiles above its 1024 pixel tile size
+assert TILED_REFERENCE_SIZE[0] * TILED_REFERENCE_SIZE[1] >= tiling.MIN_TILED_PIXELS
+TILED_FILTERS = ("basic_operations.apply_mean_filter", "basic_operations.apply_gaussian_filter",
+                 "basic_operations.apply_median_filter", "basic_operations.apply_sobel_filter",
+                 "basic_operations.apply_laplacian_filter", "morphology_ops.")
+CASES += [tiled_case(c, exact=c["name"].startswith(TILED_FILTERS)) for c in CASES
+          if c["name"].startswith(TILED_FILTERS + ("tiled_codec.",))]
+
+def frame_size(megapixels):
+    # 4:3 frame of about the given size: 1 -> 1155x866, 12 -> 4000x3000
+    width = round(math.sqrt(megapixels * 1e6 * 4 / 3))
+    return width, round(width * 3 / 4)
+
+def synthetic_image(width, height, mode, seed):
+    # Smooth colour regions, a few flat patches and mild noise: enough texture
+    # for filters and compression to behave as they do on photos
+    rng = np.random.default_rng(seed)
+    small = rng.integers(0, 256, (max(2, height // 64), max(2, width // 64), 3), dtype=np.uint8)
+    image = cv2.resize(small, (width, height), interpolation=cv2.INTER_CUBIC)
+    for _ in range(4):
+        x, y = rng.integers(0, width), rng.integers(0, height)
+        color = tuple(int(c) for c in rng.integers(0, 256, 3))
+        cv2.rectangle(image, (int(x), int(y)), (int(x) + width // 6, int(y) + height // 6), color, -1)
+    noise = rng.normal(0, 4, (height, width, 1)).astype(np.float32)
+    image = np.clip(image + noise, 0, 255).astype(np.uint8)
+    if mode == "gray":
+        image = cv2.cvtColor(image, cv2.COLOR_RGB2GRAY)
+    return image
+
+def make_inputs(width, height, mode, directory):
+    inputs = {"image": synthetic_image(width, height, mode, 1), "image2": synthetic_image(width, height, mode, 2)}
+    # The path based functions read with cv2.imread, which expects BGR files
+    for key, path_key in (("image", "path"), ("image2", "path2")):
+        path = os.path.join(directory, f"{path_key}_{mode}_{width}x{height}.png")
+        image = inputs[key]
+        cv2.imwrite(path, image if image.ndim == 2 else cv2.cvtColor(image, cv2.COLOR_RGB2BGR),
+                    [cv2.IMWRITE_PNG_COMPRESSION, 1])
+        inputs[path_key] = path
+    return inputs
+
+def measure(run, inputs, repeat):
+    best = float("inf")
+    for _ in range(repeat):
+        start = time.perf_counter()
+        result = run(inputs)
+        best = min(best, time.perf_counter() - start)
+    del result
+
+    # Separate pass, tracing slows allocation down
+    tracemalloc.start()
+    try:
+        run(inputs)
+        _, peak = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+    return best, peak
+
+def fingerprint(result):
+    result = np.asarray(result)
+    thumbnail = cv2.resize(result.astype(np.float32), (THUMBNAIL_SIZE, THUMBNAIL_SIZE), interpolation=cv2.INTER_AREA)
+    # Whole levels are plenty for uint8 images and keep the file small
+    thumbnail = np.rint(thumbnail).astype(int) if result.dtype == np.uint8 else np.round(thumbnail, 2)
+    return {
+        "shape": list(result.shape),
+        "dtype": str(result.dtype),
+        "sha256": hashlib.sha256(np.ascontiguousarray(result).tobytes()).hexdigest(),
+        "thumbnail": thumbnail.ravel().tolist(),
+    }
+
+def compare_fingerprints(actual, expected):
+    if actual["shape"] != expected["shape"] or actual["dtype"] != expected["dtype"]:
+        return "MISMATCH", f"{actual['dtype']}{actual['shape']} != {expected['dtype']}{expected['shape']}"
+    if actual["sha256"] == expected["sha256"]:
+        return "exact", ""
+    diff = float(np.max(np.abs(np.subtract(actual["thumbnail"], expected["thumbnail"]))))
+    if diff <= REFERENCE_TOLERANCE:
+        return "close", f"thumbnail drift {diff:.2f}"
+    return "MISMATCH", f"thumbnail drift {diff:.2f}"
+
+def write_references(references):
+    lines = [f" {json.dumps(key)}: {json.dumps(references[key], sort_keys=True)}" for key in sorted(references)]
+    with open(REFERENCES_PATH, "w") as f:
+        f.write("{\n" + ",\n".join(lines) + "\n}\n")
+
+def selected_cases(only):
+    return [c for c in CASES if not only or any(s in c["name"] for s in only)]
+
+def check_references(cases, modes, update, directory):
+    references = {}
+    if os.path.exists(REFERENCES_PATH):
+        with open(REFERENCES_PATH) as f:
+            references = json.load(f)
+
+    failures = 0
+    for mode in modes:
+        for size in sorted({c["reference_size"] for c in cases}):
+            inputs = make_inputs(*size, mode, directory)
+            for c in cases:
+                if mode not in c["modes"] or c["reference_size"] != size:
+                    continue
+                key = f"{c['name']}@{mode}"
+                result = c["run"](inputs)
+                if c["decode"] is not None:
+                    result = c["decode"](result, inputs)
+                if c["exact"] and not np.array_equal(result, untiled(c, inputs)):
+                    failures += 1
+                    print(f"  {key:<60} MISMATCH differs from the untiled result")
+                actual = fingerprint(result)
+                if update:
+                    references[key] = actual
+                    continue
+                if key not in references:
+                    print(f"  {key:<60} no reference")
+                    continue
+                status, detail = compare_fingerprints(actual, references[key])
+                if status == "MISMATCH":
+                    failures += 1
+                    print(f"  {key:<60} {status} {detail}")
+
+    if update:
+        write_references(references)
+        print(f"Updated {REFERENCES_PATH}")
+    return failures
+
+def run_suite(cases, sizes, modes, repeat, directory):
+    results = {}
+    for megapixels in sizes:
+        width, height = frame_size(megapixels)
+        for mode in modes:
+            inputs = make_inputs(width, height, mode, directory)
+            for c in cases:
+                if (not c["timed"] or mode not in c["modes"]
+                        or (c["max_megapixels"] and megapixels > c["max_megapixels"])):
+                    continue
+                key = f"{c['name']}@{mode}@{megapixels:g}MP"
+                seconds, peak = measure(c["run"], inputs, repeat)
+                results[key] = {
+                    "seconds": seconds,
+                    "megapixels_per_second": width * height / 1e6 / seconds,
+                    "peak_mb": peak / 2 ** 20,
+                }
+                print(f"{key:<70} {seconds * 1e3:10.1f} ms {results[key]['megapixels_per_second']:9.1f} MP/s "
+                      f"{results[key]['peak_mb']:8.1f} MB", flush=True)
+            del inputs
+    return results
+
+def compare_baseline(results, baseline, threshold):
+    regressions = 0
+    for key, result in results.items():
+        if key not in baseline:
+            continue
+        before, after = baseline[key]["seconds"], result["seconds"]
+        if after > before * (1 + threshold) and after - before > MIN_REGRESSION_SECONDS:
+            regressions += 1
+            print(f"REGRESSION {key}: {before * 1e3:.1f} ms -> {after * 1e3:.1f} ms ({after / before:.2f}x)")
+    return regressions
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark the functions in src/libs")
+    parser.add_argument("--sizes", nargs="+", type=float, default=[1, 12, 48], help="Image sizes in megapixels")
+    parser.add_argument("--modes", nargs="+", default=["rgb", "gray"], choices=["rgb", "gray"])
+    parser.add_argument("--only", nargs="+", help="Run the cases whose name contains one of these")
+    parser.add_argument("--repeat", type=int, default=3)
+    parser.add_argument("--baseline", help="Fail on regressions against this baseline JSON")
+    parser.add_argument("--threshold", type=float, default=0.25, help="Allowed slowdown, 0.25 = 25%%")
+    parser.add_argument("--save-baseline", help="Write the results to this JSON file")
+    parser.add_argument("--skip-references", action="store_true", help="Do not check outputs against references.json")
+    parser.add_argument("--update-references", action="store_true", help="Store the current outputs as references")
+    args = parser.parse_args()
+
+    cases = selected_cases(args.only)
+    failed = False
+    with tempfile.TemporaryDirectory() as directory:
+        if not args.skip_references:
+            mismatches = check_references(cases, args.modes, args.update_references, directory)
+            if mismatches:
+                print(f"{mismatches} results differ from their reference")
+                failed = True
+        if args.update_references:
+            return
+
+        results = run_suite(cases, args.sizes, args.modes, args.repeat, directory)
+
+    if args.save_baseline:
+        with open(args.save_baseline, "w") as f:
+            json.dump(results, f, indent=1, sort_keys=True)
+    if args.baseline:
+        with open(args.baseline) as f:
+            regressions = compare_baseline(results, json.load(f), args.threshold)
+        if regressions:
+            print(f"{regressions} cases regressed by more than {args.threshold:.0%}")
+            failed = True
+    sys.exit(1 if failed else 0)
+
+if __name__ == "__main__":
+    main()
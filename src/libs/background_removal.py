@@ -1,68 +1,351 @@
 import cv2
 import numpy as np
 
+from libs.tiling import iter_tiles
+
+# Every method produces a uint8 mask of the input, 255 on the foreground and 0
+# on the background. to_rgba turns image and mask into a transparent cut-out
+# in one pass; remove_background_* composite onto white as they always did.
+
+def load_rgb(path):
+    return cv2.cvtColor(cv2.imread(path), cv2.COLOR_BGR2RGB)
+
+def threshold_mask(image, level=127):
+    # Pixels darker than level are foreground
+    grey = image if image.ndim == 2 else cv2.cvtColor(image, cv2.COLOR_RGB2GRAY)
+    _, mask = cv2.threshold(grey, level - 1, 255, cv2.THRESH_BINARY_INV)
+    return mask
+
+def to_rgba(image, mask):
+    channels = [image] * 3 if image.ndim == 2 else list(cv2.split(image))
+    return cv2.merge(channels + [mask])
+
+def on_white(image, mask):
+    keep = mask != 0
+    return np.where(keep[..., None] if image.ndim == 3 else keep, image, np.uint8(255))
+
 def remove_background_threshold(myimage):
-    myimage =cv2.imread(myimage)
+    image = load_rgb(myimage)
+    return on_white(image, threshold_mask(image))
 
-    # Convert to Grayscale
-    myimage_grey = cv2.cvtColor(myimage, cv2.COLOR_BGR2GRAY)
+# K-means is fitted on a sample of at most KMEANS_SAMPLE pixels, then every
+# pixel of the frame is assigned to its nearest center in chunks of
+# ASSIGN_CHUNK pixels. With sample_size=None the whole frame is clustered as
+# before.
+KMEANS_SAMPLE = 100_000
+ASSIGN_CHUNK = 1 << 18
+KMEANS_SEED = 0
 
-    # Apply threshold segmentation
-    _, baseline = cv2.threshold(myimage_grey, 127, 255, cv2.THRESH_TRUNC)
-    _, background = cv2.threshold(baseline, 126, 255, cv2.THRESH_BINARY)
-    _, foreground = cv2.threshold(baseline, 126, 255, cv2.THRESH_BINARY_INV)
+def _sample_pixels(pixels, sample_size, sampling, seed):
+    # "random" draws pixels uniformly, "grid" takes every n-th pixel
+    if sample_size is None or len(pixels) <= sample_size:
+        return pixels
+    if sampling == "random":
+        return pixels[np.random.default_rng(seed).choice(len(pixels), sample_size, replace=False)]
+    elif sampling == "grid":
+        return pixels[::-(-len(pixels) // sample_size)]
+    raise ValueError(f"Unknown sampling: {sampling}")
 
-    # Update foreground with bitwise_and to extract real foreground
-    foreground = cv2.bitwise_and(myimage, myimage, mask=foreground)  
+def assign_clusters(pixels, centers):
+    # Index of the nearest center for every row of pixels (N x C, any dtype).
+    # |p - c|^2 = |p|^2 - 2 p.c + |c|^2 and |p|^2 is the same for every center,
+    # so the nearest one maximises p.c - |c|^2 / 2: one matmul per chunk
+    centers = centers.astype(np.float32)
+    bias = 0.5 * np.einsum("ij,ij->i", centers, centers)
+    labels = np.empty(len(pixels), dtype=np.uint8 if len(centers) <= 256 else np.int32)
+    for start in range(0, len(pixels), ASSIGN_CHUNK):
+        chunk = pixels[start:start + ASSIGN_CHUNK].astype(np.float32)
+        scores = chunk @ centers.T
+        scores -= bias
+        labels[start:start + ASSIGN_CHUNK] = scores.argmax(axis=1)
+    return labels
 
-    # Convert black and white back into 3 channel greyscale
-    background = cv2.cvtColor(background, cv2.COLOR_GRAY2BGR)
+def kmeans_segment(image, k=2, attempts=10, sample_size=KMEANS_SAMPLE, sampling="random", seed=KMEANS_SEED):
+    # Cluster labels (H x W) and centers (k x C, float32) of an image's pixels
+    pixels = image.reshape(-1, 1 if image.ndim == 2 else image.shape[2])
+    sample = np.float32(_sample_pixels(pixels, sample_size, sampling, seed))
+    if seed is not None:
+        cv2.setRNGSeed(seed)
+    criteria = (cv2.TERM_CRITERIA_EPS + cv2.TERM_CRITERIA_MAX_ITER, 100, 0.2)
+    _, labels, centers = cv2.kmeans(sample, k, None, criteria, attempts, cv2.KMEANS_RANDOM_CENTERS)
+    if sample_size is None:
+        labels = labels.ravel()
+    else:
+        labels = assign_clusters(pixels, centers)
+    return labels.reshape(image.shape[:2]), centers
 
+# SLIC-style superpixels: centers start on a regular grid of step x step
+# cells, and every pixel joins the nearest of the 9 centers around its cell
+# in Lab colour plus compactness-weighted distance. They are computed on a
+# copy at most SUPERPIXEL_SIDE pixels on the long side; the image is cut into
+# step x step blocks so the 9 candidates are compared by broadcasting blocks
+# against shifted center grids, without gathering per pixel.
+SUPERPIXELS = 2000
+SUPERPIXEL_SIDE = 1024
+SUPERPIXEL_COMPACTNESS = 10
+# Weight of a superpixel's position, in fractions of the image, against its
+# 0-255 mean colour when superpixels are clustered
+POSITION_WEIGHT = 32
 
-    # Combine the background and foreground to obtain our final image
-    finalimage = background+foreground
-    finalimage = cv2.cvtColor(finalimage, cv2.COLOR_BGR2RGB)
+def slic_superpixels(image, n_segments=SUPERPIXELS, compactness=SUPERPIXEL_COMPACTNESS, iterations=5):
+    # Superpixel label map (H x W int32) with labels 0..count-1
+    if image.ndim == 2:
+        image = cv2.cvtColor(image, cv2.COLOR_GRAY2RGB)
+    h, w = image.shape[:2]
+    step = max(2, int(round(np.sqrt(h * w / n_segments))))
+    gh, gw = -(-h // step), -(-w // step)
+    lab = cv2.cvtColor(image, cv2.COLOR_RGB2Lab).astype(np.float32)
+    padded = cv2.copyMakeBorder(lab, 0, gh * step - h, 0, gw * step - w, cv2.BORDER_REPLICATE)
+    blocks = padded.reshape(gh, step, gw, step, 3).transpose(0, 2, 1, 3, 4).copy()
+    ys = (np.arange(gh)[:, None] * step + np.arange(step)).astype(np.float32)[:, None, :, None]
+    xs = (np.arange(gw)[:, None] * step + np.arange(step)).astype(np.float32)[None, :, None, :]
+    inside = (ys < h) & (xs < w)
+    spatial = (compactness / step) ** 2
 
-    return finalimage
+    # Centers on the cell middles with the cell's mean colour, padded by a
+    # ring of unreachable ones so border cells see 9 candidates too
+    colours = np.full((gh + 2, gw + 2, 3), 0, np.float32)
+    cy = np.full((gh + 2, gw + 2), -1e6, np.float32)
+    cx = np.full((gh + 2, gw + 2), -1e6, np.float32)
+    colours[1:-1, 1:-1] = blocks.mean(axis=(2, 3))
+    cy[1:-1, 1:-1] = np.minimum(np.arange(gh) * step + step / 2, h - 1)[:, None]
+    cx[1:-1, 1:-1] = np.minimum(np.arange(gw) * step + step / 2, w - 1)[None, :]
+    offsets = [(dy, dx) for dy in (-1, 0, 1) for dx in (-1, 0, 1)]
+    shifts = np.array([dy * gw + dx for dy, dx in offsets], np.int32)
+    cell = (np.arange(gh)[:, None] * gw + np.arange(gw)).astype(np.int32)[:, :, None, None]
+    # The real (not padding) pixels, for moving the centers
+    valid = np.broadcast_to(inside, blocks.shape[:4])
+    pixel_values = [np.broadcast_to(ys, valid.shape)[valid], np.broadcast_to(xs, valid.shape)[valid]]
+    pixel_values += [blocks[..., c][valid] for c in range(3)]
+    center_grids = [cy[1:-1, 1:-1], cx[1:-1, 1:-1]] + [colours[1:-1, 1:-1, c] for c in range(3)]
 
-def remove_background_kmeans(myimage):
-    # Read the image
-    myimage = cv2.imread(myimage)
-    myimage = cv2.cvtColor(myimage, cv2.COLOR_BGR2RGB)  # convert to RGB
+    for iteration in range(iterations + 1):
+        best = np.full(blocks.shape[:4], np.inf, np.float32)
+        nearest = np.zeros(blocks.shape[:4], np.uint8)
+        for i, (dy, dx) in enumerate(offsets):
+            window = slice(1 + dy, 1 + dy + gh), slice(1 + dx, 1 + dx + gw)
+            # |p - c|^2 less the |p|^2 every candidate shares, and the two
+            # spatial terms added separably
+            centre = colours[window]
+            distance = np.einsum("abijc,abc->abij", blocks, -2 * centre)
+            distance += (np.einsum("abc,abc->ab", centre, centre)[:, :, None, None]
+                         + spatial * (ys - cy[window][:, :, None, None]) ** 2)
+            distance += spatial * (xs - cx[window][:, :, None, None]) ** 2
+            closer = distance < best
+            np.copyto(best, distance, where=closer)
+            np.copyto(nearest, i, where=closer)
+        labels = cell + shifts[nearest]
+        if iteration == iterations:
+            break
+        # Move every center to the mean position and colour of its pixels
+        members = labels[valid]
+        counts = np.bincount(members, minlength=gh * gw)
+        used = counts > 0
+        for grid, values in zip(center_grids, pixel_values):
+            grid[used.reshape(gh, gw)] = np.bincount(members, values, minlength=gh * gw)[used] / counts[used]
 
-    # Reshape the image to a 2D array of pixels and 3 color values (RGB)
-    pixel_values = myimage.reshape((-1, 3))
-    pixel_values = np.float32(pixel_values)
+    labels = labels.transpose(0, 2, 1, 3).reshape(gh * step, gw * step)[:h, :w]
+    # Number the superpixels that kept pixels consecutively
+    _, labels = np.unique(labels, return_inverse=True)
+    return labels.reshape(h, w).astype(np.int32)
 
-    # Define the criteria and number of clusters (k)
+def _superpixel_kmeans_mask(image, k, attempts, superpixels, seed):
+    # Clusters the mean colour and position of superpixels of a working copy
+    # and paints the result back through the superpixel map
+    h, w = image.shape[:2]
+    scale = min(1.0, SUPERPIXEL_SIDE / max(h, w))
+    small = image if scale == 1 else cv2.resize(image, (max(1, round(w * scale)), max(1, round(h * scale))),
+                                                interpolation=cv2.INTER_AREA)
+    if small.ndim == 2:
+        small = cv2.cvtColor(small, cv2.COLOR_GRAY2RGB)
+    labels = slic_superpixels(small, superpixels)
+    count = labels.max() + 1
+    sizes = np.bincount(labels.ravel(), minlength=count)
+    sh, sw = labels.shape
+    yy, xx = np.mgrid[0:sh, 0:sw]
+    features = np.empty((count, 5), np.float32)
+    for c in range(3):
+        features[:, c] = np.bincount(labels.ravel(), small[..., c].ravel(), minlength=count) / sizes
+    features[:, 3] = np.bincount(labels.ravel(), yy.ravel(), minlength=count) / sizes * POSITION_WEIGHT / sh
+    features[:, 4] = np.bincount(labels.ravel(), xx.ravel(), minlength=count) / sizes * POSITION_WEIGHT / sw
+    if seed is not None:
+        cv2.setRNGSeed(seed)
     criteria = (cv2.TERM_CRITERIA_EPS + cv2.TERM_CRITERIA_MAX_ITER, 100, 0.2)
-    k = 2  
+    _, clusters, centers = cv2.kmeans(features, k, None, criteria, attempts, cv2.KMEANS_RANDOM_CENTERS)
+    background = np.argmax(np.uint8(centers[:, :3]).mean(axis=1))
+    mask = np.where(clusters.ravel() == background, np.uint8(0), np.uint8(255))[labels]
+    if scale == 1:
+        return mask
+    mask = cv2.resize(mask, (w, h), interpolation=cv2.INTER_LINEAR)
+    cv2.threshold(mask, 127, 255, cv2.THRESH_BINARY, dst=mask)
+    return mask
 
-    # Apply KMeans clustering
-    _, labels, centers = cv2.kmeans(pixel_values, k, None, criteria, 10, cv2.KMEANS_RANDOM_CENTERS)
+def kmeans_mask(image, k=2, attempts=10, sample_size=KMEANS_SAMPLE, sampling="random", seed=KMEANS_SEED,
+                superpixels=None):
+    # The cluster whose center is brightest is taken as the background, the
+    # other clusters are foreground. With superpixels set, about that many
+    # superpixels are clustered instead of pixels
+    if superpixels:
+        return _superpixel_kmeans_mask(image, k, attempts, superpixels, seed)
+    labels, centers = kmeans_segment(image, k, attempts, sample_size, sampling, seed)
+    background = np.argmax(np.uint8(centers).mean(axis=1))
+    return np.where(labels == background, np.uint8(0), np.uint8(255))
 
-    # Convert centers to uint8 (pixel values)
-    centers = np.uint8(centers)
-    labels = labels.flatten()
+def remove_background_kmeans(myimage, k=2, attempts=10, sample_size=KMEANS_SAMPLE, sampling="random",
+                             seed=KMEANS_SEED, superpixels=None):
+    image = load_rgb(myimage)
+    return on_white(image, kmeans_mask(image, k, attempts, sample_size, sampling, seed, superpixels))
 
-    # Map labels to the center colors
-    segmented_image = centers[labels]
-    segmented_image = segmented_image.reshape(myimage.shape)
+# GrabCut iterates on a copy at most GRABCUT_SIDE pixels on the long side,
+# started from a rectangle inset GRABCUT_MARGIN of the image on every side.
+# The mask is then carried up a pyramid GRABCUT_STEP times larger per level
+# to full resolution; at every level it is upsampled and refined only in a
+# band around its outline, one GRABCUT_TILE tile at a time, so the cost above
+# the coarsest level grows with the length of the outline, not the area.
+GRABCUT_SIDE = 256
+GRABCUT_STEP = 4
+GRABCUT_MARGIN = 0.05
+GRABCUT_TILE = 256
+# The colour models are 5 component GMMs, so each side needs a few samples
+GRABCUT_MIN_SAMPLES = 64
 
-    # Separate the clusters into foreground and background
-    mask = labels.reshape(myimage.shape[:2])
-    background = np.zeros_like(myimage)
-    foreground = np.zeros_like(myimage)
+def _grabcut(image, labels, rect, iterations):
+    models = np.zeros((1, 65), np.float64), np.zeros((1, 65), np.float64)
+    mode = cv2.GC_INIT_WITH_MASK if rect is None else cv2.GC_INIT_WITH_RECT
+    cv2.grabCut(image, labels, rect, *models, iterations, mode)
+    # GC_FGD and GC_PR_FGD are the odd labels
+    return np.where(labels & 1, np.uint8(255), np.uint8(0))
 
-    # Assume the cluster with the lower mean intensity is the background
-    if np.mean(centers[0]) > np.mean(centers[1]):
-        background[mask == 0] = [255, 255, 255]  
-        foreground[mask == 1] = myimage[mask == 1]
-    else:
-        background[mask == 1] = [255, 255, 255]  
-        foreground[mask == 0] = myimage[mask == 0]
+def _refine_band(image, mask, band, iterations):
+    # Re-runs GrabCut on the tiles crossing the band of half width `band`
+    # around the outline of mask, with everything outside the band fixed
+    h, w = mask.shape
+    kernel = cv2.getStructuringElement(cv2.MORPH_ELLIPSE, (2 * band + 1, 2 * band + 1))
+    inner, outer = cv2.erode(mask, kernel), cv2.dilate(mask, kernel)
+    labels = np.where(mask != 0, np.uint8(cv2.GC_PR_FGD), np.uint8(cv2.GC_PR_BGD))
+    labels[inner != 0] = cv2.GC_FGD
+    labels[outer == 0] = cv2.GC_BGD
+    in_band = inner != outer
+
+    for y0, y1, x0, x1 in iter_tiles(h, w, GRABCUT_TILE, GRABCUT_TILE):
+        if not in_band[y0:y1, x0:x1].any():
+            continue
+        # The tile is cut with a band wide margin so the graph cut sees the
+        # pixels around its edges; only the tile itself is written back
+        py0, py1, px0, px1 = max(0, y0 - band), min(h, y1 + band), max(0, x0 - band), min(w, x1 + band)
+        tile_labels = labels[py0:py1, px0:px1].copy()
+        foreground = np.count_nonzero(tile_labels & 1)
+        if min(foreground, tile_labels.size - foreground) < GRABCUT_MIN_SAMPLES:
+            continue
+        refined = _grabcut(np.ascontiguousarray(image[py0:py1, px0:px1]), tile_labels, None, iterations)
+        mask[y0:y1, x0:x1] = refined[y0 - py0:y1 - py0, x0 - px0:x1 - px0]
+    return mask
+
+def grabcut_mask(image, rect=None, iterations=5, refine_iterations=2, max_side=GRABCUT_SIDE, seed=KMEANS_SEED):
+    # rect = (x, y, width, height) of the box holding the foreground. GrabCut
+    # seeds its colour models with cv2's k-means, hence the seed
+    if seed is not None:
+        cv2.setRNGSeed(seed)
+    if image.ndim == 2:
+        image = cv2.cvtColor(image, cv2.COLOR_GRAY2RGB)
+    h, w = image.shape[:2]
+    if rect is None:
+        mx, my = int(w * GRABCUT_MARGIN), int(h * GRABCUT_MARGIN)
+        rect = (mx, my, w - 2 * mx, h - 2 * my)
+
+    # Scales of the pyramid levels, coarsest first, ending at full resolution
+    scales = [1.0]
+    while max(h, w) * scales[0] > max_side:
+        scales.insert(0, scales[0] / GRABCUT_STEP)
+    scales[0] = min(1.0, max_side / max(h, w))
+
+    mask = None
+    for scale in scales:
+        size = (max(1, round(w * scale)), max(1, round(h * scale)))
+        level = image if scale == 1 else cv2.resize(image, size, interpolation=cv2.INTER_AREA)
+        if mask is None:
+            x, y, rw, rh = (int(v * scale) for v in rect)
+            mask = _grabcut(level, np.zeros(level.shape[:2], np.uint8), (x, y, max(1, rw), max(1, rh)), iterations)
+            continue
+        # The upsampled outline is off by up to a pixel of the previous level,
+        # so the band spans a couple of them on each side
+        step = size[0] / mask.shape[1]
+        mask = cv2.resize(mask, size, interpolation=cv2.INTER_LINEAR)
+        cv2.threshold(mask, 127, 255, cv2.THRESH_BINARY, dst=mask)
+        mask = _refine_band(level, mask, max(2, int(np.ceil(2 * step))), refine_iterations)
+    return mask
+
+# A background model for known backdrops is a 3-D histogram of their colours
+# with 2**bits bins per channel (HISTOGRAM_BITS = 5 gives 32^3). Bins holding
+# at least min_fraction of the backdrop pixels, grown by `spread` bins to
+# cover shading the samples missed, become a lookup table of mask values;
+# a photo is then classified with one table lookup per pixel, LUT_CHUNK
+# pixels at a time.
+HISTOGRAM_BITS = 5
+MIN_BACKGROUND_FRACTION = 1e-5
+LUT_CHUNK = 1 << 18
+
+def learn_background_model(backdrops, bits=HISTOGRAM_BITS, model=None):
+    # backdrops are RGB arrays or image paths; passing an existing model adds
+    # their counts to it
+    bins = 1 << bits
+    counts = np.zeros((bins, bins, bins), np.float64) if model is None else model.astype(np.float64)
+    if counts.shape != (bins, bins, bins):
+        raise ValueError(f"Model has {counts.shape[0]} bins per channel, not {bins}")
+    for backdrop in backdrops:
+        image = load_rgb(backdrop) if isinstance(backdrop, str) else backdrop
+        if image.ndim == 2:
+            image = cv2.cvtColor(image, cv2.COLOR_GRAY2RGB)
+        counts += cv2.calcHist([image], [0, 1, 2], None, [bins] * 3, [0, 256] * 3)
+    return counts
+
+def save_background_model(path, model):
+    np.save(path, model, allow_pickle=False)
+
+def load_background_model(path):
+    model = np.load(path, allow_pickle=False)
+    bins = model.shape[0] if model.ndim == 3 else 0
+    if model.shape != (bins, bins, bins) or bins & (bins - 1) or not 2 <= bins <= 256:
+        raise ValueError(f"Not a background model: shape {model.shape}")
+    return model
+
+def background_lut(model, min_fraction=MIN_BACKGROUND_FRACTION, spread=1):
+    # Flat table of mask values, 0 for background bins and 255 for the rest
+    background = model >= min_fraction * max(model.sum(), 1)
+    for _ in range(spread):
+        grown = background.copy()
+        for axis in range(3):
+            ahead = [slice(None)] * 3
+            behind = [slice(None)] * 3
+            ahead[axis], behind[axis] = slice(1, None), slice(None, -1)
+            grown[tuple(ahead)] |= background[tuple(behind)]
+            grown[tuple(behind)] |= background[tuple(ahead)]
+        background = grown
+    return np.where(background.ravel(), np.uint8(0), np.uint8(255))
+
+def histogram_mask(image, model, min_fraction=MIN_BACKGROUND_FRACTION, spread=1):
+    if image.ndim == 2:
+        image = cv2.cvtColor(image, cv2.COLOR_GRAY2RGB)
+    lut = background_lut(model, min_fraction, spread)
+    bits = model.shape[0].bit_length() - 1
+    shift = 8 - bits
+    dtype = np.uint16 if 3 * bits <= 16 else np.uint32
+    h, w = image.shape[:2]
+    mask = np.empty((h, w), np.uint8)
+    rows = max(1, LUT_CHUNK // w)
+    for y in range(0, h, rows):
+        strip = image[y:y + rows]
+        index = (strip[..., 0] >> shift).astype(dtype) << 2 * bits
+        index |= (strip[..., 1] >> shift).astype(dtype) << bits
+        index |= strip[..., 2] >> shift
+        np.take(lut, index, out=mask[y:y + rows])
+    return mask
 
-    # Combine background and foreground to form the final image
-    finalimage = background + foreground
+MASKS = {"threshold": threshold_mask, "kmeans": kmeans_mask, "grabcut": grabcut_mask, "histogram": histogram_mask}
 
-    return finalimage
+def background_mask(path, method="kmeans", **options):
+    # The RGB image at path and its foreground mask; options go to the method
+    if method not in MASKS:
+        raise ValueError(f"Unknown background removal method: {method}")
+    image = load_rgb(path)
+    return image, MASKS[method](image, **options)
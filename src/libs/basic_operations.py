@@ -1,211 +1,353 @@
-from PIL import Image as PILImage, ImageOps
+import math
+
+from PIL import Image as PILImage, ImageColor, ImageOps
 import cv2
 import numpy as np
-from scipy.signal import convolve2d
+
+from libs.frequency_ops import frequency_filter, wiener_deconvolve
+from libs.morphology_ops import morphological_operations
+from libs.point_ops import apply_point_ops, is_point_operation, to_grayscale
+from libs.tiling import run_tiled
+
+# The *_array functions are the processing core: they take and return uint8
+# numpy arrays (H x W for grayscale, H x W x 3 for RGB); frames only pass
+# through PIL to load and save. Brightness, contrast, gamma, negative and
+# colour manipulation are evaluated as lookup tables (see libs.point_ops).
+# The apply_* functions without the suffix are thin wrappers kept for callers
+# that still work with PIL images; each call costs one conversion in and one
+# conversion out.
+
+def to_array(image):
+    if image.mode not in ("L", "RGB"):
+        image = image.convert("RGB")
+    # np.asarray reads the PIL buffer once; np.array would copy it a second time
+    return np.ascontiguousarray(np.asarray(image, dtype=np.uint8))
+
+def to_pil(image):
+    return PILImage.fromarray(image)
+
+def _wrap(array_op, image, *args):
+    return to_pil(array_op(to_array(image), *args))
+
+def apply_grayscale_array(image):
+    if image.ndim == 2:
+        return image
+    # PIL's rounding, not cv2.cvtColor's, which differs on about 0.1% of colours
+    return to_grayscale(image)
+
+def apply_negative_array(image):
+    return apply_point_ops(image, [("apply_negative", {})])
+
+def apply_color_manipulation_array(image, r_factor, g_factor, b_factor):
+    params = {"r_factor": r_factor, "g_factor": g_factor, "b_factor": b_factor}
+    return apply_point_ops(image, [("apply_color_manipulation", params)])
+
+def apply_scaling_array(image, new_width, new_height):
+    # Ignore aspect ratio. This is not the PIL LANCZOS resize the editor used
+    # before: PIL widens its Lanczos kernel by the shrink factor, cv2's
+    # INTER_LANCZOS4 is a fixed 8x8 kernel that aliases when shrinking, so
+    # downscales use area averaging instead. Outputs differ from PIL by a few
+    # levels on most pixels and by up to about 40 on sharp edges when
+    # shrinking. An exact NumPy port of PIL's resampler ran about 3x slower
+    # than PIL itself; this shrinks 3-30x faster and needs no PIL round trip
+    h, w = image.shape[:2]
+    shrinking = new_width <= w and new_height <= h
+    interpolation = cv2.INTER_AREA if shrinking else cv2.INTER_LANCZOS4
+    return cv2.resize(image, (new_width, new_height), interpolation=interpolation)
+
+def apply_translation_array(image, dx, dy):
+    # Grow the canvas by the offset and place the image at the shifted position
+    h, w = image.shape[:2]
+    translated = np.zeros((h + abs(dy), w + abs(dx)) + image.shape[2:], dtype=np.uint8)
+    paste_x = max(0, dx)
+    paste_y = max(0, dy)
+    translated[paste_y:paste_y + h, paste_x:paste_x + w] = image
+    return translated
+
+def apply_crop_image_array(image, start_row, start_col, num_rows, num_cols):
+    out = image[start_row:start_row + num_rows, start_col:start_col + num_cols]
+    return np.ascontiguousarray(out)
+
+def apply_flip_array(image, flip_type):
+    if flip_type == "Horizontal":
+        return cv2.flip(image, 1)
+    elif flip_type == "Vertical":
+        return cv2.flip(image, 0)
+    elif flip_type == "Diagonal":
+        return cv2.flip(image, -1)
+    return image
+
+# Output pixels per band of rotation coordinates
+ROTATION_BAND_PIXELS = 1 << 16
+
+def apply_rotation_array(image, angle):
+    # Same geometry as PIL's Image.rotate(angle, expand=True): counter clockwise,
+    # nearest neighbour, black fill
+    angle = angle % 360.0
+    if angle % 90 == 0:
+        return np.ascontiguousarray(np.rot90(image, int(angle // 90)))
+
+    h, w = image.shape[:2]
+    rad = -math.radians(angle)
+    a, b = round(math.cos(rad), 15), round(math.sin(rad), 15)
+    d, e = -b, a
+    cx, cy = w / 2, h / 2
+    c = cx - (a * cx + b * cy)
+    f = cy - (d * cx + e * cy)
+
+    xx = [a * x + b * y + c for x, y in ((0, 0), (w, 0), (w, h), (0, h))]
+    yy = [d * x + e * y + f for x, y in ((0, 0), (w, 0), (w, h), (0, h))]
+    nw = math.ceil(max(xx)) - math.floor(min(xx))
+    nh = math.ceil(max(yy)) - math.floor(min(yy))
+    c, f = a * -(nw - w) / 2 + b * -(nh - h) / 2 + c, d * -(nw - w) / 2 + e * -(nh - h) / 2 + f
+
+    # Inverse mapping in PIL's 16.16 fixed point (affine_fixed in its
+    # Geometry.c), so edge pixels round the same way; cv2.warpAffine's 10 bit
+    # coordinates pick a different source pixel for about 0.2% of them. The
+    # integer coordinates go to cv2.remap a band of rows at a time
+    fix = lambda v: math.floor(v * 65536.0 + 0.5)
+    x_step, x_row, y_step, y_row = fix(a), fix(b), fix(d), fix(e)
+    x_start, y_start = fix(c + a * 0.5 + b * 0.5), fix(f + d * 0.5 + e * 0.5)
+    rotated = np.empty((nh, nw) + image.shape[2:], dtype=np.uint8)
+    rows = max(1, ROTATION_BAND_PIXELS // nw)
+    x_steps = np.arange(nw, dtype=np.int32) * np.int32(x_step)
+    y_steps = np.arange(nw, dtype=np.int32) * np.int32(y_step)
+    coords = np.empty((rows, nw, 2), dtype=np.int16)
+    for y in range(0, nh, rows):
+        n = min(rows, nh - y)
+        ys = np.arange(y, y + n, dtype=np.int32)[:, None]
+        for axis, start, row_step, steps, size in ((0, x_start, x_row, x_steps, w),
+                                                   (1, y_start, y_row, y_steps, h)):
+            fixed = ys * np.int32(row_step) + np.int32(start) + steps
+            # Anything outside the source maps to the black border
+            coords[:n, :, axis] = np.clip(fixed >> 16, -1, size)
+        rotated[y:y + n] = cv2.remap(image, coords[:n], None, cv2.INTER_NEAREST,
+                                     borderMode=cv2.BORDER_CONSTANT, borderValue=0)
+    return rotated
+
+def apply_brightness_array(image, brightness_factor):
+    return apply_point_ops(image, [("apply_brightness", {"brightness_factor": brightness_factor})])
+
+def apply_contrast_array(image, contrast_factor):
+    return apply_point_ops(image, [("apply_contrast", {"contrast_factor": contrast_factor})])
+
+def apply_border_array(image, thickness, color):
+    # color is anything ImageOps.expand takes: a colour string, a tuple, or an
+    # int, which PIL reads as a level for L and as packed 0xBBGGRR for RGB
+    mode = "L" if image.ndim == 2 else "RGB"
+    if isinstance(color, str):
+        color = ImageColor.getcolor(color, mode)
+    if isinstance(color, int):
+        fill = (color,) if mode == "L" else (color & 255, color >> 8 & 255, color >> 16 & 255)
+    else:
+        fill = tuple(color)
+    return cv2.copyMakeBorder(image, thickness, thickness, thickness, thickness,
+                              cv2.BORDER_CONSTANT, value=fill)
+
+def _colorize_lut(black, white):
+    # Let PIL colorize a 0..255 ramp once so the filter becomes a table lookup
+    ramp = PILImage.fromarray(np.arange(256, dtype=np.uint8).reshape(1, 256))
+    return np.asarray(ImageOps.colorize(ramp, black, white)).reshape(256, 3)
+
+COLOR_FILTERS = {
+    "Sepia": ("#704214", "#C0A080"),
+    "Cyanotype": ("#002B5B", "#8CF0E8"),
+}
+_color_filter_luts = {}
+
+def apply_color_filter_array(image, filter_type):
+    if filter_type not in COLOR_FILTERS:
+        return image
+    if filter_type not in _color_filter_luts:
+        _color_filter_luts[filter_type] = _colorize_lut(*COLOR_FILTERS[filter_type])
+    return np.take(_color_filter_luts[filter_type], apply_grayscale_array(image), axis=0)
+
+def _mean_filter(image):
+    kernel = np.ones((5,5), np.float32)/25
+    return cv2.filter2D(image, -1, kernel)
+
+def _sobel_filter(image):
+    img_array = apply_grayscale_array(image)
+    sobelx = cv2.Sobel(img_array, cv2.CV_64F, 1, 0, ksize=3)
+    sobely = cv2.Sobel(img_array, cv2.CV_64F, 0, 1, ksize=3)
+    magnitude = np.sqrt(sobelx**2 + sobely**2)
+    return np.uint8(magnitude)
+
+def _laplacian_filter(image):
+    laplacian = cv2.Laplacian(apply_grayscale_array(image), cv2.CV_64F)
+    return np.uint8(np.absolute(laplacian))
+
+# Neighbourhood filters run tile by tile on large images (see libs.tiling);
+# the halo is the kernel radius
+def apply_mean_filter_array(image):
+    return run_tiled(_mean_filter, image, halo=2)
+
+def apply_gaussian_filter_array(image):
+    return run_tiled(lambda tile: cv2.GaussianBlur(tile, (5,5), 0), image, halo=2)
+
+def apply_median_filter_array(image):
+    return run_tiled(lambda tile: cv2.medianBlur(tile, 3), image, halo=1)
+
+def apply_sobel_filter_array(image):
+    return run_tiled(_sobel_filter, image, halo=1)
+
+def apply_canny_filter_array(image):
+    return cv2.Canny(apply_grayscale_array(image), 100, 200)
+
+def apply_laplacian_filter_array(image):
+    return run_tiled(_laplacian_filter, image, halo=1)
+
+def apply_low_pass_filter_array(image, radius=30, mask="ideal"):
+    return frequency_filter(image, radius, mask)
+
+def apply_high_pass_filter_array(image, radius=30, mask="ideal"):
+    return frequency_filter(image, radius, mask, high_pass=True)
+
+def apply_wiener_filter_array(image, psf="box", size=5, nsr=None):
+    # nsr=None estimates the noise-to-signal ratio from the image
+    return wiener_deconvolve(image, psf, size, nsr)
+
+def apply_histogram_equalization_array(image):
+    if image.ndim == 3:
+        img_yuv = cv2.cvtColor(image, cv2.COLOR_RGB2YUV)
+        img_yuv[:,:,0] = cv2.equalizeHist(img_yuv[:,:,0])
+        return cv2.cvtColor(img_yuv, cv2.COLOR_YUV2RGB)
+    return cv2.equalizeHist(image)
+
+def apply_contrast_stretching_array(image):
+    p2, p98 = np.percentile(image, (2, 98))
+    return np.clip(((image - p2) / (p98 - p2) * 255), 0, 255).astype(np.uint8)
+
+def apply_gamma_correction_array(image, gamma=1.0):
+    return apply_point_ops(image, [("apply_gamma_correction", {"gamma": gamma})])
+
+def apply_morphological_operation_array(image, operation_type):
+    return morphological_operations(image, operation_type)
+
+# Operations by the names PhotoEditorPage records them under. A chain is a
+# list of (name, params) steps where params are the keyword arguments of the
+# matching *_array function.
+OPERATIONS = {
+    "apply_grayscale": apply_grayscale_array,
+    "apply_negative": apply_negative_array,
+    "apply_color_manipulation": apply_color_manipulation_array,
+    "apply_scaling": apply_scaling_array,
+    "apply_translation": apply_translation_array,
+    "apply_crop_image": apply_crop_image_array,
+    "apply_flip": apply_flip_array,
+    "apply_rotation": apply_rotation_array,
+    "apply_brightness": apply_brightness_array,
+    "apply_contrast": apply_contrast_array,
+    "apply_border": apply_border_array,
+    "apply_color_filter": apply_color_filter_array,
+    "apply_mean_filter": apply_mean_filter_array,
+    "apply_gaussian_filter": apply_gaussian_filter_array,
+    "apply_median_filter": apply_median_filter_array,
+    "apply_sobel_filter": apply_sobel_filter_array,
+    "apply_canny_filter": apply_canny_filter_array,
+    "apply_laplacian_filter": apply_laplacian_filter_array,
+    "apply_low_pass_filter": apply_low_pass_filter_array,
+    "apply_high_pass_filter": apply_high_pass_filter_array,
+    "apply_wiener_filter": apply_wiener_filter_array,
+    "apply_histogram_equalization": apply_histogram_equalization_array,
+    "apply_contrast_stretching": apply_contrast_stretching_array,
+    "apply_gamma_correction": apply_gamma_correction_array,
+    "apply_morphological_operation": apply_morphological_operation_array,
+}
+
+def apply_operation_array(image, name, params):
+    if name not in OPERATIONS:
+        raise ValueError(f"Unknown operation: {name}")
+    return OPERATIONS[name](image, **params)
+
+def apply_chain_array(image, chain):
+    # Consecutive point operations are folded into a single lookup pass
+    point_run = []
+    for name, params in chain:
+        if is_point_operation(name):
+            point_run.append((name, params))
+            continue
+        if point_run:
+            image = apply_point_ops(image, point_run)
+            point_run = []
+        image = apply_operation_array(image, name, params)
+    if point_run:
+        image = apply_point_ops(image, point_run)
+    return image
+
+# PIL wrappers
 
 def apply_grayscale(image):
-    return ImageOps.grayscale(image)
+    return _wrap(apply_grayscale_array, image)
 
 def apply_negative(image):
-    image = apply_grayscale(image)
-    return ImageOps.invert(image)
+    return _wrap(apply_negative_array, image)
 
 def apply_color_manipulation(image, r_factor, g_factor, b_factor):
-    img_array = np.array(image, dtype=np.float32)
-    r, g, b = img_array[..., 0], img_array[..., 1], img_array[..., 2]
-    r = np.clip(r * r_factor, 0, 255)
-    g = np.clip(g * g_factor, 0, 255)
-    b = np.clip(b * b_factor, 0, 255)
-    
-    adjusted_img = np.stack((r, g, b), axis=-1).astype(np.uint8)
-    return PILImage.fromarray(adjusted_img)
-
-def apply_scaling(image, new_width, new_height):    
-    result = image.resize((new_width, new_height), PILImage.LANCZOS)  # Ignore aspect ratio
-    
-    return result
+    return _wrap(apply_color_manipulation_array, image, r_factor, g_factor, b_factor)
+
+def apply_scaling(image, new_width, new_height):
+    return _wrap(apply_scaling_array, image, new_width, new_height)
 
 def apply_translation(image, dx, dy):
-    # translated_image = PILImage.new("RGB", (image.width, image.height), (0,0,0))
-    # translated_image.paste(image, (dx, dy))
-    # Create a new blank image with the same mode and increased size
-    new_width = image.width + abs(dx)
-    new_height = image.height + abs(dy)
-    translated_image = PILImage.new(image.mode, (new_width, new_height))
-    
-    # Calculate the paste position
-    paste_x = max(0, dx) 
-    paste_y = max(0, dy)
-    
-    # Paste the original image onto the new canvas
-    translated_image.paste(image, (paste_x, paste_y))
-    return translated_image
+    return _wrap(apply_translation_array, image, dx, dy)
 
 def apply_crop_image(image, start_row, start_col, num_rows, num_cols):
-    image = np.array(image)
-    if len(image.shape) == 3: # for RGB or BGR
-        out = image[start_row:start_row + num_rows, start_col:start_col + num_cols, :]
-    elif len(image.shape) == 2: # for grayscale image
-        out = image[start_row:start_row + num_rows, start_col:start_col + num_cols]
-    return PILImage.fromarray(np.uint8(out))
+    return _wrap(apply_crop_image_array, image, start_row, start_col, num_rows, num_cols)
 
 def apply_flip(image, flip_type):
-    if flip_type == "Horizontal":
-        return ImageOps.mirror(image)
-    elif flip_type == "Vertical":
-        return ImageOps.flip(image)
-    elif flip_type == "Diagonal":
-        return ImageOps.mirror(ImageOps.flip(image))
-    return image
+    return _wrap(apply_flip_array, image, flip_type)
 
 def apply_rotation(image, angle):
-    return image.rotate(angle, expand=True)
+    return _wrap(apply_rotation_array, image, angle)
 
 def apply_brightness(image, brightness_factor):
-    img_array = np.array(image)
-    adjusted = img_array * brightness_factor
-    adjusted = np.clip(adjusted, 0, 255).astype(np.uint8)
-    return PILImage.fromarray(adjusted)
+    return _wrap(apply_brightness_array, image, brightness_factor)
 
 def apply_contrast(image, contrast_factor):
-    img_array = np.array(image)
-    mean = np.mean(img_array)
-    adjusted = (img_array - mean) * contrast_factor + mean
-    adjusted = np.clip(adjusted, 0, 255).astype(np.uint8)
-    return PILImage.fromarray(adjusted)
+    return _wrap(apply_contrast_array, image, contrast_factor)
 
 def apply_border(image, thickness, color):
-    return ImageOps.expand(image, border=thickness, fill=color)
+    return _wrap(apply_border_array, image, thickness, color)
 
 def apply_color_filter(image, filter_type):
-    if filter_type == "Sepia":
-        return ImageOps.colorize(image.convert("L"), "#704214", "#C0A080")
-    elif filter_type == "Cyanotype":
-        return ImageOps.colorize(image.convert("L"), "#002B5B", "#8CF0E8")
-    return image
+    return _wrap(apply_color_filter_array, image, filter_type)
 
 def apply_mean_filter(image):
-    img_array = np.array(image)
-    kernel = np.ones((5,5), np.float32)/25
-    filtered = cv2.filter2D(img_array, -1, kernel)
-    return PILImage.fromarray(filtered)
+    return _wrap(apply_mean_filter_array, image)
 
 def apply_gaussian_filter(image):
-    img_array = np.array(image)
-    filtered = cv2.GaussianBlur(img_array, (5,5), 0)
-    return PILImage.fromarray(filtered)
+    return _wrap(apply_gaussian_filter_array, image)
 
 def apply_median_filter(image):
-    img_array = np.array(image)
-    filtered = cv2.medianBlur(img_array, 3)
-    return PILImage.fromarray(filtered)
+    return _wrap(apply_median_filter_array, image)
 
 def apply_sobel_filter(image):
-    img_array = np.array(image.convert('L'))
-    sobelx = cv2.Sobel(img_array, cv2.CV_64F, 1, 0, ksize=3)
-    sobely = cv2.Sobel(img_array, cv2.CV_64F, 0, 1, ksize=3)
-    magnitude = np.sqrt(sobelx**2 + sobely**2)
-    return PILImage.fromarray(np.uint8(magnitude))
+    return _wrap(apply_sobel_filter_array, image)
 
 def apply_canny_filter(image):
-    img_array = np.array(image.convert('L'))
-    edges = cv2.Canny(img_array, 100, 200)
-    return PILImage.fromarray(edges)
+    return _wrap(apply_canny_filter_array, image)
 
 def apply_laplacian_filter(image):
-    img_array = np.array(image.convert('L'))
-    laplacian = cv2.Laplacian(img_array, cv2.CV_64F)
-    return PILImage.fromarray(np.uint8(np.absolute(laplacian)))
-
-def apply_low_pass_filter(image, radius=30):
-    img_array = np.array(image.convert('L'))
-    rows, cols = img_array.shape
-    crow, ccol = rows // 2, cols // 2  
-    
-    f_transform = np.fft.fft2(img_array)
-    f_shift = np.fft.fftshift(f_transform)
-    
-    mask = np.zeros((rows, cols), np.uint8)
-    cv2.circle(mask, (ccol, crow), radius, 1, thickness=-1)
-    
-    f_shift_filtered = f_shift * mask
-    f_ishift = np.fft.ifftshift(f_shift_filtered)
-    img_back = np.fft.ifft2(f_ishift)
-    img_back = np.abs(img_back)
-    return PILImage.fromarray(np.uint8(img_back))
-
-def apply_high_pass_filter(image, radius=30):
-    img_array = np.array(image.convert('L'))
-    rows, cols = img_array.shape
-    crow, ccol = rows // 2, cols // 2 
-    
-    f_transform = np.fft.fft2(img_array)
-    f_shift = np.fft.fftshift(f_transform)
-    
-    mask = np.ones((rows, cols), np.uint8)
-    cv2.circle(mask, (ccol, crow), radius, 0, thickness=-1)
-    
-    f_shift_filtered = f_shift * mask
-    f_ishift = np.fft.ifftshift(f_shift_filtered)
-    img_back = np.fft.ifft2(f_ishift)
-    img_back = np.abs(img_back)
-    return PILImage.fromarray(np.uint8(img_back))
-
-def apply_wiener_filter(image):
-    kernel_size = 5
-    noise_est = 25
-    signal_est = 100
-    kernel = np.ones((kernel_size, kernel_size)) / (kernel_size * kernel_size)
-
-    gray_image = apply_grayscale(image)
-    img_array = np.array(gray_image)
-    _, binary_image = cv2.threshold(img_array, 127, 255, cv2.THRESH_BINARY)
-
-    blurred_image = convolve2d(binary_image, kernel, mode='same', boundary='symm')
-    ratio = signal_est / (signal_est + noise_est)
-    filtered_image = blurred_image * ratio
-    result = np.clip(filtered_image, 0, 255).astype(np.uint8)
-    return PILImage.fromarray(result)
+    return _wrap(apply_laplacian_filter_array, image)
+
+def apply_low_pass_filter(image, radius=30, mask="ideal"):
+    return _wrap(apply_low_pass_filter_array, image, radius, mask)
+
+def apply_high_pass_filter(image, radius=30, mask="ideal"):
+    return _wrap(apply_high_pass_filter_array, image, radius, mask)
+
+def apply_wiener_filter(image, psf="box", size=5, nsr=None):
+    return _wrap(apply_wiener_filter_array, image, psf, size, nsr)
 
 def apply_histogram_equalization(image):
-    img_array = np.array(image)
-    if len(img_array.shape) == 3:
-        img_yuv = cv2.cvtColor(img_array, cv2.COLOR_RGB2YUV)
-        img_yuv[:,:,0] = cv2.equalizeHist(img_yuv[:,:,0])
-        result = cv2.cvtColor(img_yuv, cv2.COLOR_YUV2RGB)
-    else:
-        result = cv2.equalizeHist(img_array)
-    return PILImage.fromarray(result)
+    return _wrap(apply_histogram_equalization_array, image)
 
 def apply_contrast_stretching(image):
-    img_array = np.array(image)
-    p2, p98 = np.percentile(img_array, (2, 98))
-    result = np.clip(((img_array - p2) / (p98 - p2) * 255), 0, 255).astype(np.uint8)
-    return PILImage.fromarray(result)
+    return _wrap(apply_contrast_stretching_array, image)
 
 def apply_gamma_correction(image, gamma=1.0):
-    img_array = np.array(image, dtype=np.float32) / 255.0  
-    corrected = np.power(img_array, gamma)
-    corrected = (corrected * 255).astype(np.uint8)
-    return PILImage.fromarray(corrected)
+    return _wrap(apply_gamma_correction_array, image, gamma)
 
 def apply_morphological_operation(image, operation_type):
-    img_array = np.array(image)
-    kernel = np.ones((5, 5), np.uint8)
-
-    if len(img_array) == 3:
-        img_array = cv2.cvtColor(img_array, cv2.COLOR_RGB2GRAY)
-    
-    if operation_type == "dilation":
-        result = cv2.dilate(img_array, kernel, iterations=1)
-    elif operation_type == "erosion":
-        result = cv2.erode(img_array, kernel, iterations=1)
-    elif operation_type == "opening":
-        result = cv2.morphologyEx(img_array, cv2.MORPH_OPEN, kernel)
-    elif operation_type == "closing":
-        result = cv2.morphologyEx(img_array, cv2.MORPH_CLOSE, kernel)
-    else:
-        return image
-        
-    return PILImage.fromarray(result)
-
+    return _wrap(apply_morphological_operation_array, image, operation_type)
@@ -0,0 +1,142 @@
+import csv
+import io
+import time
+
+import cv2
+import numpy as np
+from PIL import Image
+
+from libs.dct_codec import decode_dct, encode_dct
+from libs.rle_format import decode_rle, encode_rle
+
+# Size, speed and quality of the app's codecs next to Pillow's JPEG, PNG and
+# WebP encoders on the same image, one row per codec setting.
+#
+# SSIM uses a uniform 7x7 window instead of the usual Gaussian: the five local
+# statistics are box filters, which cv2 computes in float32 with running sums
+# at a cost that does not depend on the window size.
+
+SSIM_WINDOW = 7
+SSIM_C1 = (0.01 * 255) ** 2
+SSIM_C2 = (0.03 * 255) ** 2
+SSIM_STRIP_ROWS = 256
+
+REPORT_FIELDS = ["method", "setting", "bytes", "ratio", "bits_per_pixel",
+                 "encode_ms", "decode_ms", "psnr_db", "ssim"]
+
+def psnr(reference, image):
+    # Peak signal to noise ratio in dB, inf for identical images
+    reference, image = np.asarray(reference), np.asarray(image)
+    error = cv2.norm(reference, image, cv2.NORM_L2SQR) / reference.size
+    return float("inf") if error == 0 else float(10 * np.log10(255 ** 2 / error))
+
+def _ssim_map(reference, image, window):
+    a = np.asarray(reference, np.float32)
+    b = np.asarray(image, np.float32)
+
+    def mean(x):
+        return cv2.boxFilter(x, -1, (window, window), borderType=cv2.BORDER_REFLECT)
+
+    mu_a, mu_b = mean(a), mean(b)
+    # Second moments become variances and covariance in place
+    var_a = mean(a * a)
+    var_b = mean(b * b)
+    cov = mean(a * b)
+    mu_ab = mu_a * mu_b
+    mu_a *= mu_a
+    mu_b *= mu_b
+    var_a -= mu_a
+    var_b -= mu_b
+    cov -= mu_ab
+    # numerator (2 mu_ab + C1)(2 cov + C2), denominator (mu_a^2 + mu_b^2 + C1)(var_a + var_b + C2)
+    mu_ab *= 2
+    mu_ab += SSIM_C1
+    cov *= 2
+    cov += SSIM_C2
+    mu_ab *= cov
+    mu_a += mu_b
+    mu_a += SSIM_C1
+    var_a += var_b
+    var_a += SSIM_C2
+    mu_a *= var_a
+    mu_ab /= mu_a
+    return mu_ab
+
+def ssim(reference, image, window=SSIM_WINDOW):
+    # Mean structural similarity over all pixels and channels. Strips of rows
+    # overlapping by half a window give the same map as the whole image with
+    # a fraction of the float32 temporaries
+    reference, image = np.asarray(reference), np.asarray(image)
+    height = reference.shape[0]
+    overlap = window // 2
+    total = 0.0
+    for y in range(0, height, SSIM_STRIP_ROWS):
+        top, bottom = max(y - overlap, 0), min(y + SSIM_STRIP_ROWS + overlap, height)
+        strip = _ssim_map(reference[top:bottom], image[top:bottom], window)
+        total += strip[y - top:y - top + SSIM_STRIP_ROWS].sum(dtype=np.float64)
+    return float(total / reference.size)
+
+def _pillow(fmt, **options):
+    def encode(image):
+        buffer = io.BytesIO()
+        Image.fromarray(image).save(buffer, format=fmt, **options)
+        return buffer.getvalue()
+
+    def decode(data):
+        return np.asarray(Image.open(io.BytesIO(data)))
+    return encode, decode
+
+def codecs(dct_quality=None):
+    # (method, setting, encode, decode) for every row of the report. The app's
+    # DCT codec is also run at dct_quality, e.g. the page's slider value
+    qualities = sorted({50, 75, 90} | ({int(dct_quality)} if dct_quality is not None else set()))
+    rows = [
+        ("RLE", "deflate", lambda image: encode_rle(image), decode_rle),
+        ("RLE", "huffman", lambda image: encode_rle(image, coding="huffman"), decode_rle),
+    ]
+    rows += [("DCT", f"q{q}", lambda image, q=q: encode_dct(image, q), decode_dct) for q in qualities]
+    rows += [("DCT", f"q{q} {mode}", lambda image, q=q, mode=mode: encode_dct(image, q, subsampling=mode), decode_dct)
+             for q in (75, 90) for mode in ("4:2:2", "4:2:0")]
+    rows += [("JPEG", f"q{q}", *_pillow("JPEG", quality=q)) for q in (50, 75, 90)]
+    rows += [("JPEG", "q90 4:4:4", *_pillow("JPEG", quality=90, subsampling=0))]
+    rows += [("PNG", f"level {level}", *_pillow("PNG", compress_level=level)) for level in (1, 6, 9)]
+    rows += [("WebP", f"q{q}", *_pillow("WEBP", quality=q)) for q in (50, 75, 90)]
+    rows += [("WebP", "lossless", *_pillow("WEBP", lossless=True))]
+    return rows
+
+def measure(image, method, setting, encode, decode):
+    image = np.ascontiguousarray(image, dtype=np.uint8)
+    start = time.perf_counter()
+    data = encode(image)
+    encode_seconds = time.perf_counter() - start
+    start = time.perf_counter()
+    decoded = decode(data)
+    decode_seconds = time.perf_counter() - start
+    if image.ndim == 2 and decoded.ndim == 3:
+        # WebP has no grayscale mode
+        decoded = cv2.cvtColor(decoded, cv2.COLOR_RGB2GRAY)
+    return {
+        "method": method,
+        "setting": setting,
+        "bytes": len(data),
+        "ratio": round(image.nbytes / len(data), 2),
+        "bits_per_pixel": round(8 * len(data) / (image.shape[0] * image.shape[1]), 3),
+        "encode_ms": round(encode_seconds * 1e3, 1),
+        "decode_ms": round(decode_seconds * 1e3, 1),
+        "psnr_db": round(psnr(image, decoded), 2),
+        "ssim": round(ssim(image, decoded), 4),
+    }
+
+def compression_report(image, dct_quality=None):
+    # One measured row per codec setting, see REPORT_FIELDS
+    image = np.asarray(image, dtype=np.uint8)
+    if image.ndim == 3 and image.shape[2] == 4:
+        image = image[:, :, :3]
+    return [measure(image, *codec) for codec in codecs(dct_quality)]
+
+def report_to_csv(rows):
+    buffer = io.StringIO()
+    writer = csv.DictWriter(buffer, fieldnames=REPORT_FIELDS)
+    writer.writeheader()
+    writer.writerows(rows)
+    return buffer.getvalue()
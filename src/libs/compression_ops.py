@@ -1,47 +1,77 @@
 import cv2
 import numpy as np
 
-def run_length_encoding(image):
+from libs.dct_codec import DEFAULT_QUALITY, decode_dct, encode_dct, encode_dct_to_size
+
+# Run-length coding scans each channel in row order (or column order) as one
+# sequence, so runs continue across line ends. A channel is encoded as a pair
+# of arrays: the value of every run and its length.
+
+SCAN_ORDERS = ("row", "column")
+
+def _scan(image, order):
+    # The pixels in scan order as an N x C array
+    channels = 1 if image.ndim == 2 else image.shape[2]
+    if order == "row":
+        return image.reshape(-1, channels)
+    elif order == "column":
+        return image.swapaxes(0, 1).reshape(-1, channels)
+    raise ValueError(f"Unknown scan order: {order}")
+
+def _unscan(flat, shape, order):
+    h, w = shape[:2]
+    if order == "column":
+        return flat.reshape(w, h).T
+    return flat.reshape(h, w)
+
+def run_length_encoding(image, order="row"):
+    pixels = _scan(image, order)
+    n = len(pixels)
+    # Runs start where the value changes; all channels are compared in one
+    # pass over the interleaved pixels
+    changes = np.flatnonzero(pixels[1:] != pixels[:-1])
+    rows, cols = np.divmod(changes, pixels.shape[1])
     encoded_channels = []
-    for channel in cv2.split(image):
-        flattened = channel.flatten()
-        encoded = []
-        prev_pixel = flattened[0]
-        count = 1
-        for pixel in flattened[1:]:
-            if pixel == prev_pixel:
-                count += 1
-            else:
-                encoded.append((prev_pixel, count))
-                prev_pixel = pixel
-                count = 1
-        encoded.append((prev_pixel, count))
-        encoded_channels.append(encoded)
+    for c in range(pixels.shape[1]):
+        starts = np.concatenate(([0], rows[cols == c] + 1))
+        lengths = np.diff(np.append(starts, n)).astype(np.uint32)
+        encoded_channels.append((pixels[starts, c], lengths))
     return encoded_channels
 
-def run_length_decoding(encoded_channels, shape):
+def run_length_decoding(encoded_channels, shape, order="row"):
     decoded_channels = []
     for encoded in encoded_channels:
-        decoded = []
-        for pixel, count in encoded:
-            decoded.extend([pixel] * count)
-        decoded_array = np.array(decoded, dtype=np.uint8)
-        decoded_channels.append(decoded_array.reshape(shape[:2]))
+        if isinstance(encoded, tuple) and len(encoded) == 2 and isinstance(encoded[0], np.ndarray):
+            values, lengths = encoded
+        else:
+            # Lists of (pixel, count) tuples from the previous encoder
+            runs = np.array(encoded, dtype=np.int64).reshape(-1, 2)
+            values, lengths = runs[:, 0], runs[:, 1]
+        decoded = np.repeat(values.astype(np.uint8, copy=False), lengths)
+        decoded_channels.append(np.ascontiguousarray(_unscan(decoded, shape, order)))
     return cv2.merge(decoded_channels)
 
-def compress_image_rle(image):
-    encoded = run_length_encoding(image)
-    return run_length_decoding(encoded, image.shape)
-
-def compress_image_dct(image):
-    channels = cv2.split(image)
-    dct_channels = []
-    for channel in channels:
-        dct = cv2.dct(np.float32(channel) / 255.0)
-        h, w = dct.shape
-        mask = np.zeros((h, w), dtype=np.float32)
-        mask[:h // 4, :w // 4] = 1
-        dct_simplified = dct * mask
-        idct = cv2.idct(dct_simplified) * 255.0
-        dct_channels.append(np.uint8(np.clip(idct, 0, 255)))
-    return cv2.merge(dct_channels)
+def compress_image_rle(image, order="row", tile_size=None, workers=None):
+    # With tile_size the round trip goes through libs.tiled_codec, with tiles
+    # encoded and decoded in parallel
+    if tile_size is not None:
+        # Imported here: tiled_codec builds on rle_format, which imports this module
+        from libs.tiled_codec import decode_tiled, encode_tiled
+        return decode_tiled(encode_tiled(image, "rle", tile_size, workers, order=order), workers)
+    encoded = run_length_encoding(image, order)
+    return run_length_decoding(encoded, image.shape, order)
+
+def compress_image_dct(image, quality=DEFAULT_QUALITY, target_bytes=None, subsampling="4:4:4", tile_size=None,
+                       workers=None):
+    # Round trip through the 8x8 block codec in libs.dct_codec. With
+    # target_bytes the quality is chosen to fit that file size instead, with
+    # tile_size the image is coded as parallel tiles as in compress_image_rle
+    if tile_size is not None:
+        if target_bytes is not None:
+            raise ValueError("Rate control works on whole images, not tiles")
+        from libs.tiled_codec import decode_tiled, encode_tiled
+        return decode_tiled(encode_tiled(image, "dct", tile_size, workers, quality=quality, subsampling=subsampling),
+                            workers)
+    if target_bytes is not None:
+        return decode_dct(encode_dct_to_size(image, target_bytes, subsampling))
+    return decode_dct(encode_dct(image, quality, subsampling=subsampling))
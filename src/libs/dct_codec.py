@@ -0,0 +1,321 @@
+import struct
+import zlib
+
+import cv2
+import numpy as np
+
+from libs.entropy_coding import huffman_decode, huffman_encode, huffman_size
+
+# JPEG style block transform codec. The image is converted to YCbCr, each
+# component is cut into 8x8 blocks (edges padded by replication) and every
+# block is transformed at once: with the blocks as rows of an N x 64 matrix,
+# the 2-D DCT of all of them is one matrix product with kron(D, D), whose rows
+# are permuted into zig-zag order so the coefficients come out already
+# ordered. Coefficients are quantized with the standard JPEG tables scaled by
+# quality.
+#
+# Chroma can be subsampled before the transform, as in JPEG: 4:2:2 halves the
+# width of the Cb and Cr planes, 4:2:0 both dimensions (area averaging). The
+# decoder upsamples them back linearly. At 4:2:0 only half as many blocks are
+# transformed and coded as at 4:4:4.
+#
+# Rate control (encode_dct_to_size) transforms the image once and binary
+# searches quality on the coefficients: each step only quantizes and sizes
+# the Huffman streams from their histograms, which gives the exact file size
+# without packing any bits.
+#
+# File layout:
+#   header   "DCT1", height, width, components, quality, flags   (<4sIIBBB)
+#            flags: bit 0 Huffman coding, bits 1-2 chroma subsampling
+#            (index into SUBSAMPLING_MODES), bit 3 progressive
+#   tables   luma and chroma quantization tables, 64 bytes each, zig-zag order
+#   sizes    compressed size of each component's payload (<Q each)
+#   payload  per component: the end-of-block position of every block (one
+#            byte), then the coefficients up to it, sign folded into 16-bit
+#            codes. DC terms are differences from the previous block
+#
+# Progressive files split every block's coefficients into the scans of
+# PROGRESSIVE_SCANS and store payloads scan by scan, each scan holding all
+# components. The DC scan comes first and is a fraction of the file, so a
+# reader that has only that much can already show a 1/8 scale preview
+# (decode_dct_preview).
+#
+# With the Huffman flag (the default) the end-of-block positions and the codes
+# are two libs.entropy_coding streams. Without it both are deflated together,
+# the codes split into a low byte plane and a high byte plane.
+
+MAGIC = b"DCT1"
+HEADER = struct.Struct("<4sIIBBB")
+SIZE = struct.Struct("<Q")
+BLOCK = 8
+DEFAULT_QUALITY = 75
+DEFLATE_LEVEL = 1
+FLAG_HUFFMAN = 1
+SUBSAMPLING_SHIFT = 1
+FLAG_PROGRESSIVE = 1 << 3
+# Spectral selection of progressive files: DC, the 5 lowest AC terms, the rest
+PROGRESSIVE_SCANS = ((0, 1), (1, 6), (6, BLOCK * BLOCK))
+# Chroma plane height and width divisors
+SUBSAMPLING_MODES = {"4:4:4": (1, 1), "4:2:2": (1, 2), "4:2:0": (2, 2)}
+
+LUMA_TABLE = np.array([
+    16, 11, 10, 16, 24, 40, 51, 61,
+    12, 12, 14, 19, 26, 58, 60, 55,
+    14, 13, 16, 24, 40, 57, 69, 56,
+    14, 17, 22, 29, 51, 87, 80, 62,
+    18, 22, 37, 56, 68, 109, 103, 77,
+    24, 35, 55, 64, 81, 104, 113, 92,
+    49, 64, 78, 87, 103, 121, 120, 101,
+    72, 92, 95, 98, 112, 100, 103, 99,
+], dtype=np.float32)
+
+CHROMA_TABLE = np.array([
+    17, 18, 24, 47, 99, 99, 99, 99,
+    18, 21, 26, 66, 99, 99, 99, 99,
+    24, 26, 56, 99, 99, 99, 99, 99,
+    47, 66, 99, 99, 99, 99, 99, 99,
+    99, 99, 99, 99, 99, 99, 99, 99,
+    99, 99, 99, 99, 99, 99, 99, 99,
+    99, 99, 99, 99, 99, 99, 99, 99,
+    99, 99, 99, 99, 99, 99, 99, 99,
+], dtype=np.float32)
+
+def _zigzag():
+    # Row-major index of the k-th coefficient in zig-zag order
+    return np.array(sorted(range(64), key=lambda i: (i // 8 + i % 8, i // 8 if (i // 8 + i % 8) % 2 else i % 8)))
+
+def _dct_matrix():
+    x = np.arange(BLOCK)
+    d = np.cos((2 * x[None, :] + 1) * x[:, None] * np.pi / (2 * BLOCK)) * np.sqrt(2 / BLOCK)
+    d[0] /= np.sqrt(2)
+    return d
+
+ZIGZAG = _zigzag()
+# Row k gives zig-zag coefficient k of a row-major flattened block
+TRANSFORM = np.kron(_dct_matrix(), _dct_matrix())[ZIGZAG].astype(np.float32)
+
+def quantization_table(quality, chroma=False):
+    # IJG quality scaling of the standard tables, in zig-zag order
+    quality = min(max(int(quality), 1), 100)
+    scale = 5000 / quality if quality < 50 else 200 - 2 * quality
+    base = CHROMA_TABLE if chroma else LUMA_TABLE
+    return np.clip(np.floor((base * scale + 50) / 100), 1, 255)[ZIGZAG].astype(np.float32)
+
+def component_shapes(height, width, components, subsampling="4:4:4"):
+    fy, fx = SUBSAMPLING_MODES[subsampling]
+    return [(height, width)] + [(-(-height // fy), -(-width // fx))] * (components - 1)
+
+def to_components(image, subsampling="4:4:4"):
+    # Level shifted float32 planes: Y for grayscale, else Y, Cb, Cr
+    if subsampling not in SUBSAMPLING_MODES:
+        raise ValueError(f"Unknown chroma subsampling: {subsampling}")
+    image = np.asarray(image, dtype=np.uint8)
+    if image.ndim == 2:
+        return [image.astype(np.float32) - 128]
+    ycrcb = cv2.cvtColor(image[:, :, :3], cv2.COLOR_RGB2YCrCb).astype(np.float32) - 128
+    y, cr, cb = cv2.split(ycrcb)
+    (h, w), (ch, cw), _ = component_shapes(*image.shape[:2], 3, subsampling)
+    if (ch, cw) != (h, w):
+        cb = cv2.resize(cb, (cw, ch), interpolation=cv2.INTER_AREA)
+        cr = cv2.resize(cr, (cw, ch), interpolation=cv2.INTER_AREA)
+    return [y, cb, cr]
+
+def from_components(planes):
+    if len(planes) == 1:
+        return np.clip(planes[0] + 128, 0, 255).astype(np.uint8)
+    y, cb, cr = planes
+    if cb.shape != y.shape:
+        cb = cv2.resize(cb, (y.shape[1], y.shape[0]), interpolation=cv2.INTER_LINEAR)
+        cr = cv2.resize(cr, (y.shape[1], y.shape[0]), interpolation=cv2.INTER_LINEAR)
+    ycrcb = np.clip(cv2.merge([y, cr, cb]) + 128, 0, 255).astype(np.uint8)
+    return cv2.cvtColor(ycrcb, cv2.COLOR_YCrCb2RGB)
+
+def to_blocks(plane):
+    # N x 64 matrix of row-major 8x8 blocks, N = block rows * block columns
+    h, w = plane.shape
+    ph, pw = -h % BLOCK, -w % BLOCK
+    if ph or pw:
+        plane = cv2.copyMakeBorder(plane, 0, ph, 0, pw, cv2.BORDER_REPLICATE)
+    bh, bw = plane.shape[0] // BLOCK, plane.shape[1] // BLOCK
+    return plane.reshape(bh, BLOCK, bw, BLOCK).swapaxes(1, 2).reshape(-1, BLOCK * BLOCK)
+
+def from_blocks(blocks, height, width):
+    bh, bw = -(-height // BLOCK), -(-width // BLOCK)
+    plane = blocks.reshape(bh, bw, BLOCK, BLOCK).swapaxes(1, 2).reshape(bh * BLOCK, bw * BLOCK)
+    return plane[:height, :width]
+
+def forward_dct(blocks):
+    return blocks @ TRANSFORM.T
+
+def inverse_dct(coefficients):
+    return coefficients @ TRANSFORM
+
+def quantize(coefficients, table):
+    return np.rint(coefficients * (1 / table)).astype(np.int16)
+
+def dequantize(quantized, table):
+    return quantized.astype(np.float32) * table
+
+def _end_of_blocks(quantized):
+    # Number of coefficients up to and including the last non-zero one
+    return ((quantized != 0) * np.arange(1, quantized.shape[1] + 1, dtype=np.uint8)).max(axis=1)
+
+def coefficient_codes(quantized, differential=True):
+    # End-of-block positions and the sign folded codes of the coefficients
+    # before them, the two streams that get entropy coded. quantized is N x 64
+    # or, in progressive files, the columns of one scan
+    quantized = quantized.copy()
+    if differential:
+        # DC terms change slowly from block to block
+        quantized[1:, 0] = np.diff(quantized[:, 0])
+    eob = _end_of_blocks(quantized)
+    values = quantized[np.arange(quantized.shape[1]) < eob[:, None]].astype(np.int32)
+    # Small magnitudes of either sign map to small codes
+    return eob, ((values << 1) ^ (values >> 31)).astype(np.uint16)
+
+def _pack_coefficients(quantized, huffman=True, differential=True):
+    eob, codes = coefficient_codes(quantized, differential)
+    if huffman:
+        return huffman_encode(eob) + huffman_encode(codes)
+    return zlib.compress(b"".join([eob.tobytes(), (codes & 0xFF).astype(np.uint8).tobytes(),
+                                   (codes >> 8).astype(np.uint8).tobytes()]), DEFLATE_LEVEL)
+
+def _unpack_coefficients(payload, blocks, huffman=True, columns=BLOCK * BLOCK, differential=True):
+    if huffman:
+        eob, offset = huffman_decode(payload)
+        codes = huffman_decode(payload, offset)[0].astype(np.int32)
+        if len(eob) != blocks:
+            raise ValueError("Corrupt DCT file: block count mismatch")
+    else:
+        data = np.frombuffer(zlib.decompress(payload), dtype=np.uint8)
+        eob = data[:blocks]
+        count = (len(data) - blocks) // 2
+        codes = data[blocks:blocks + count].astype(np.int32) | (data[blocks + count:].astype(np.int32) << 8)
+    quantized = np.zeros((blocks, columns), dtype=np.int16)
+    quantized[np.arange(columns) < eob[:, None]] = (codes >> 1) ^ -(codes & 1)
+    if differential:
+        quantized[:, 0] = np.cumsum(quantized[:, 0], dtype=np.int16)
+    return quantized
+
+def scans(progressive):
+    # (first, last) zig-zag positions of each scan
+    return PROGRESSIVE_SCANS if progressive else ((0, BLOCK * BLOCK),)
+
+def transform(image, subsampling="4:4:4"):
+    # Forward DCT coefficients of every component, before quantization
+    return [forward_dct(to_blocks(plane)) for plane in to_components(image, subsampling)]
+
+def _quantize_all(coefficients, quality):
+    tables = [quantization_table(quality), quantization_table(quality, chroma=True)]
+    return tables, [quantize(c, tables[min(i, 1)]) for i, c in enumerate(coefficients)]
+
+def _container(height, width, components, quality, flags, tables, payloads):
+    header = HEADER.pack(MAGIC, height, width, components, min(max(int(quality), 1), 100), flags)
+    table_bytes = b"".join(t.astype(np.uint8).tobytes() for t in tables)
+    sizes = b"".join(SIZE.pack(len(p)) for p in payloads)
+    return b"".join([header, table_bytes, sizes, *payloads])
+
+def encode_coefficients(coefficients, height, width, quality=DEFAULT_QUALITY, huffman=True, subsampling="4:4:4",
+                        progressive=False):
+    # A file from the output of transform(), with the same subsampling
+    tables, quantized = _quantize_all(coefficients, quality)
+    payloads = [_pack_coefficients(q[:, first:last], huffman, first == 0)
+                for first, last in scans(progressive) for q in quantized]
+    flags = ((FLAG_HUFFMAN if huffman else 0) | (FLAG_PROGRESSIVE if progressive else 0)
+             | list(SUBSAMPLING_MODES).index(subsampling) << SUBSAMPLING_SHIFT)
+    return _container(height, width, len(quantized), quality, flags, tables, payloads)
+
+def encoded_size(coefficients, quality, progressive=False):
+    # Size in bytes of encode_coefficients(coefficients, ..., quality) with
+    # Huffman coding, from symbol histograms alone
+    _, quantized = _quantize_all(coefficients, quality)
+    size = HEADER.size + 2 * BLOCK * BLOCK
+    for first, last in scans(progressive):
+        for q in quantized:
+            eob, codes = coefficient_codes(q[:, first:last], first == 0)
+            size += (SIZE.size + huffman_size(np.bincount(eob))
+                     + huffman_size(np.bincount(codes, minlength=1 << 16)))
+    return size
+
+def encode_dct(image, quality=DEFAULT_QUALITY, huffman=True, subsampling="4:4:4", progressive=False):
+    image = np.asarray(image, dtype=np.uint8)
+    return encode_coefficients(transform(image, subsampling), image.shape[0], image.shape[1], quality, huffman,
+                               subsampling, progressive)
+
+def encode_dct_to_size(image, target_bytes, subsampling="4:4:4", progressive=False):
+    # The highest quality whose file fits in target_bytes, or the quality 1
+    # file when none does. Size grows with quality, so a binary search over
+    # 1..100 takes at most 7 sizing passes after a single forward transform
+    image = np.asarray(image, dtype=np.uint8)
+    coefficients = transform(image, subsampling)
+    low, high = 1, 100
+    while low < high:
+        quality = (low + high + 1) // 2
+        if encoded_size(coefficients, quality, progressive) <= target_bytes:
+            low = quality
+        else:
+            high = quality - 1
+    return encode_coefficients(coefficients, image.shape[0], image.shape[1], low, subsampling=subsampling,
+                               progressive=progressive)
+
+def read_header(data):
+    if len(data) < HEADER.size:
+        raise ValueError("Not a DCT file: too short")
+    magic, h, w, components, quality, flags = HEADER.unpack_from(data)
+    if magic != MAGIC:
+        raise ValueError("Not a DCT file")
+    subsampling = flags >> SUBSAMPLING_SHIFT & 3
+    if subsampling >= len(SUBSAMPLING_MODES):
+        raise ValueError(f"Unknown chroma subsampling id: {subsampling}")
+    return {"height": h, "width": w, "components": components, "quality": quality, "flags": flags,
+            "subsampling": list(SUBSAMPLING_MODES)[subsampling], "progressive": bool(flags & FLAG_PROGRESSIVE)}
+
+def _read_layout(data):
+    # Header, quantization tables and the (offset, size) of every payload,
+    # ordered scan by scan and component by component within a scan
+    header = read_header(data)
+    offset = HEADER.size
+    tables = [np.frombuffer(data, np.uint8, 64, offset + 64 * i).astype(np.float32) for i in range(2)]
+    offset += 128
+    count = header["components"] * len(scans(header["progressive"]))
+    if len(data) < offset + SIZE.size * count:
+        raise ValueError("Corrupt DCT file: too short")
+    sizes = [SIZE.unpack_from(data, offset + SIZE.size * i)[0] for i in range(count)]
+    offset += SIZE.size * count
+    payloads = []
+    for size in sizes:
+        payloads.append((offset, size))
+        offset += size
+    return header, tables, payloads
+
+def decode_dct(data):
+    header, tables, payloads = _read_layout(data)
+    huffman = bool(header["flags"] & FLAG_HUFFMAN)
+    components = header["components"]
+    shapes = component_shapes(header["height"], header["width"], components, header["subsampling"])
+    quantized = [np.zeros((-(-ph // BLOCK) * -(-pw // BLOCK), BLOCK * BLOCK), dtype=np.int16) for ph, pw in shapes]
+    for k, (offset, size) in enumerate(payloads):
+        (first, last), i = scans(header["progressive"])[k // components], k % components
+        quantized[i][:, first:last] = _unpack_coefficients(data[offset:offset + size], len(quantized[i]), huffman,
+                                                           last - first, first == 0)
+    planes = [from_blocks(inverse_dct(dequantize(q, tables[min(i, 1)])), ph, pw)
+              for i, (q, (ph, pw)) in enumerate(zip(quantized, shapes))]
+    return from_components(planes)
+
+def decode_dct_preview(data):
+    # A 1/8 scale image from the DC terms alone: in a progressive file they
+    # are the first scan, so data only has to reach its end. The DC
+    # coefficient of an orthonormal 8x8 DCT is 8 times the block mean
+    header, tables, payloads = _read_layout(data)
+    if not header["progressive"]:
+        raise ValueError("DCT file is not progressive")
+    components = header["components"]
+    shapes = component_shapes(header["height"], header["width"], components, header["subsampling"])
+    planes = []
+    for i, ((offset, size), (ph, pw)) in enumerate(zip(payloads[:components], shapes)):
+        if len(data) < offset + size:
+            raise ValueError("DCT data ends inside the first scan")
+        bh, bw = -(-ph // BLOCK), -(-pw // BLOCK)
+        dc = _unpack_coefficients(data[offset:offset + size], bh * bw, bool(header["flags"] & FLAG_HUFFMAN), 1)
+        planes.append((dc.astype(np.float32) * tables[min(i, 1)][0] / BLOCK).reshape(bh, bw))
+    return from_components(planes)
@@ -0,0 +1,123 @@
+import inspect
+import json
+from collections import OrderedDict
+
+from libs.basic_operations import OPERATIONS, apply_operation_array
+from libs.point_ops import apply_point_ops, is_point_operation
+from libs.preview import scale_params
+
+DEFAULT_CACHE_BYTES = 512 * 1024 * 1024
+
+class StepCache:
+    # LRU of intermediate results, bounded by the total size of the arrays
+    def __init__(self, max_bytes=DEFAULT_CACHE_BYTES):
+        self.max_bytes = max_bytes
+        self.total_bytes = 0
+        self.entries = OrderedDict()
+
+    def get(self, key):
+        image = self.entries.get(key)
+        if image is not None:
+            self.entries.move_to_end(key)
+        return image
+
+    def put(self, key, image):
+        if image.nbytes > self.max_bytes:
+            return
+        if key in self.entries:
+            self.total_bytes -= self.entries.pop(key).nbytes
+        self.entries[key] = image
+        self.total_bytes += image.nbytes
+        while self.total_bytes > self.max_bytes:
+            _, evicted = self.entries.popitem(last=False)
+            self.total_bytes -= evicted.nbytes
+
+    def clear(self):
+        self.entries.clear()
+        self.total_bytes = 0
+
+def steps_to_json(steps):
+    # Recipes are stored as a list of {"name": ..., "params": {...}} objects
+    # with the operation names and keyword arguments of basic_operations
+    return json.dumps([{"name": name, "params": params} for name, params in steps], indent=2)
+
+def steps_from_json(text):
+    steps = []
+    for step in json.loads(text):
+        name, params = step["name"], step.get("params", {})
+        if name not in OPERATIONS:
+            raise ValueError(f"Unknown operation: {name}")
+        # Catch misspelt parameters before anything is rendered
+        try:
+            inspect.signature(OPERATIONS[name]).bind(None, **params)
+        except TypeError as e:
+            raise ValueError(f"Invalid parameters for {name}: {e}") from None
+        steps.append((name, params))
+    return steps
+
+def _step_key(name, params):
+    return name, tuple(sorted(params.items()))
+
+class EditRecipe:
+    # A replayable list of (name, params) steps rendered on top of a source
+    # image. The result after each step is cached under a key made of every
+    # step up to it, so changing step i only recomputes from step i onwards.
+    # Runs of point operations are rendered with one lookup pass and only the
+    # result at the end of the run is cached.
+    def __init__(self, source, scale=1.0, cache_bytes=DEFAULT_CACHE_BYTES):
+        self.steps = []
+        self.cache = StepCache(cache_bytes)
+        self.set_source(source, scale)
+
+    def set_source(self, source, scale=1.0):
+        # scale maps full resolution parameters onto a proxy source
+        self.source = source
+        self.scale = scale
+        self.cache.clear()
+
+    def add_step(self, name, params):
+        self.steps.append((name, params))
+        return len(self.steps) - 1
+
+    def update_step(self, index, params):
+        name, _ = self.steps[index]
+        self.steps[index] = (name, params)
+
+    def remove_step(self, index):
+        del self.steps[index]
+
+    def clear(self):
+        self.steps = []
+
+    def render(self):
+        keys = []
+        key = None
+        for name, params in self.steps:
+            key = (key, _step_key(name, params))
+            keys.append(key)
+
+        # Resume from the latest cached step
+        start = len(self.steps)
+        image = None
+        while start > 0:
+            image = self.cache.get(keys[start - 1])
+            if image is not None:
+                break
+            start -= 1
+        if image is None:
+            image = self.source
+
+        i = start
+        while i < len(self.steps):
+            name, params = self.steps[i]
+            if is_point_operation(name):
+                end = i
+                while end < len(self.steps) and is_point_operation(self.steps[end][0]):
+                    end += 1
+                image = apply_point_ops(image, self.steps[i:end])
+                i = end
+            else:
+                image = apply_operation_array(image, name, scale_params(name, params, self.scale))
+                i += 1
+            self.cache.put(keys[i - 1], image)
+        return image
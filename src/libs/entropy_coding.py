@@ -0,0 +1,207 @@
+import heapq
+import io
+import math
+import struct
+
+import numpy as np
+
+# Canonical Huffman coding of uint8/uint16 symbol arrays, shared by the RLE
+# and DCT file formats.
+#
+# Packing is vectorized: the bit offset of every code comes from a cumulative
+# sum and the codes are summed into the bytes they cover with np.bincount. Decoding a
+# prefix code is sequential by nature, so the encoder records the bit offset
+# of every `interval`-th symbol. The decoder starts one lane at each of these
+# sync points and advances all lanes together, one symbol per step, reading a
+# MAX_CODE_LENGTH bit window per lane and mapping it to a symbol and a code
+# length through lookup tables. A stream of N symbols takes about sqrt(N)
+# steps over sqrt(N) lanes.
+#
+# Stream layout:
+#   header   symbol count, sync interval, used symbols, payload bytes (<QIIQ)
+#   table    used symbols (<u2 each), then their code lengths (one byte each)
+#   sync     bit offset of every interval-th symbol (<u8 each)
+#   payload  the packed codes, most significant bit first
+
+HEADER = struct.Struct("<QIIQ")
+MAX_CODE_LENGTH = 16
+MIN_INTERVAL = 64
+MAX_INTERVAL = 8192
+# Symbols placed at once when packing
+PACK_CHUNK = 1 << 20
+
+def code_lengths(counts, max_length=MAX_CODE_LENGTH):
+    # Huffman code length of every symbol with a non-zero count. Lengths over
+    # max_length are avoided by flattening the histogram and rebuilding
+    counts = np.asarray(counts, dtype=np.int64)
+    symbols = np.flatnonzero(counts)
+    lengths = np.zeros(len(counts), dtype=np.uint8)
+    if len(symbols) == 1:
+        lengths[symbols] = 1
+        return lengths
+    weights = counts[symbols]
+    while True:
+        heap = [(int(w), i) for i, w in enumerate(weights)]
+        heapq.heapify(heap)
+        parent = list(range(len(weights)))
+        next_id = len(weights)
+        while len(heap) > 1:
+            w1, a = heapq.heappop(heap)
+            w2, b = heapq.heappop(heap)
+            parent[a] = parent[b] = next_id
+            parent.append(next_id)
+            heapq.heappush(heap, (w1 + w2, next_id))
+            next_id += 1
+        # Depth of every node, parents always come after their children
+        depth = [0] * next_id
+        for node in range(next_id - 2, -1, -1):
+            depth[node] = depth[parent[node]] + 1
+        leaf_depths = np.array(depth[:len(weights)])
+        if leaf_depths.max() <= max_length:
+            lengths[symbols] = leaf_depths
+            return lengths
+        weights = np.maximum(weights >> 1, 1)
+
+def canonical_codes(lengths):
+    # Codes assigned in order of (length, symbol)
+    lengths = np.asarray(lengths)
+    codes = np.zeros(len(lengths), dtype=np.uint32)
+    code = 0
+    previous = 0
+    used = np.flatnonzero(lengths)
+    for symbol in used[np.argsort(lengths[used], kind="stable")]:
+        length = int(lengths[symbol])
+        code <<= length - previous
+        codes[symbol] = code
+        code += 1
+        previous = length
+    return codes
+
+def decode_tables(lengths, codes):
+    # Symbol and code length for every MAX_CODE_LENGTH bit window
+    symbol_table = np.zeros(1 << MAX_CODE_LENGTH, dtype=np.uint16)
+    length_table = np.zeros(1 << MAX_CODE_LENGTH, dtype=np.uint8)
+    for symbol in np.flatnonzero(lengths):
+        shift = MAX_CODE_LENGTH - int(lengths[symbol])
+        start = int(codes[symbol]) << shift
+        symbol_table[start:start + (1 << shift)] = symbol
+        length_table[start:start + (1 << shift)] = lengths[symbol]
+    return symbol_table, length_table
+
+def _sync_interval(count):
+    # About as many lanes as steps
+    interval = 1 << math.ceil(math.log2(max(math.isqrt(max(count, 1)), 1)))
+    return min(max(interval, MIN_INTERVAL), MAX_INTERVAL)
+
+def _pack_bits(symbols, codes, lengths, bit_ends):
+    # Codes occupy disjoint bits, so placing them is a sum: every code, shifted
+    # to its bit offset, adds to at most three bytes
+    total = int(bit_ends[-1]) if len(bit_ends) else 0
+    out = np.zeros(-(-total // 8) + 2, dtype=np.float64)
+    for start in range(0, len(symbols), PACK_CHUNK):
+        chunk = symbols[start:start + PACK_CHUNK]
+        code_bits = lengths[chunk].astype(np.int64)
+        offsets = bit_ends[start:start + PACK_CHUNK] - code_bits
+        first_byte = offsets >> 3
+        base = int(first_byte[0])
+        first_byte -= base
+        placed = codes[chunk].astype(np.int64) << (24 - code_bits - (offsets & 7))
+        bins = int(first_byte[-1]) + 1
+        for k in range(3):
+            out[base + k:base + k + bins] += np.bincount(first_byte, weights=(placed >> (16 - 8 * k)) & 0xFF,
+                                                        minlength=bins)
+    # The last code can spill its zero tail into the two spare bytes
+    return out[:-2].astype(np.uint8).tobytes()
+
+def huffman_encode(symbols):
+    symbols = np.asarray(symbols)
+    if symbols.dtype not in (np.uint8, np.uint16):
+        raise ValueError(f"Symbols must be uint8 or uint16, got {symbols.dtype}")
+    symbols = symbols.ravel().astype(np.intp)
+    count = len(symbols)
+    alphabet = 1 << (8 * 2)
+    lengths = code_lengths(np.bincount(symbols, minlength=alphabet)) if count else np.zeros(alphabet, np.uint8)
+    codes = canonical_codes(lengths)
+    used = np.flatnonzero(lengths)
+
+    interval = _sync_interval(count)
+    bit_ends = np.cumsum(lengths[symbols], dtype=np.int64)
+    sync = np.concatenate(([0], bit_ends[interval - 1:-1:interval])) if count else np.zeros(0, np.int64)
+    payload = _pack_bits(symbols, codes, lengths, bit_ends)
+
+    return b"".join([
+        HEADER.pack(count, interval, len(used), len(payload)),
+        used.astype("<u2").tobytes(),
+        lengths[used].tobytes(),
+        sync.astype("<u8").tobytes(),
+        payload,
+    ])
+
+def huffman_size(counts):
+    # Exact size in bytes of huffman_encode's output for symbols with this
+    # histogram, without building the stream
+    counts = np.asarray(counts, dtype=np.int64)
+    count = int(counts.sum())
+    lengths = code_lengths(counts) if count else np.zeros(len(counts), np.uint8)
+    used = int(np.count_nonzero(lengths))
+    payload_bits = int(np.dot(counts, lengths.astype(np.int64)))
+    lanes = -(-count // _sync_interval(count))
+    return HEADER.size + 3 * used + 8 * lanes + -(-payload_bits // 8)
+
+class HuffmanStream:
+    # A Huffman stream at `offset` in a seekable binary file. The symbols can
+    # be decoded all at once or a range of sync intervals at a time
+    def __init__(self, fh, offset=0):
+        self.fh = fh
+        fh.seek(offset)
+        self.count, self.interval, used_count, self.payload_size = HEADER.unpack(fh.read(HEADER.size))
+        used = np.frombuffer(fh.read(2 * used_count), dtype="<u2")
+        lengths = np.zeros(1 << 16, dtype=np.uint8)
+        lengths[used] = np.frombuffer(fh.read(used_count), dtype=np.uint8)
+        self.lanes = -(-self.count // self.interval)
+        self.sync = np.frombuffer(fh.read(8 * self.lanes), dtype="<u8").astype(np.int64)
+        self.payload_offset = offset + HEADER.size + 3 * used_count + 8 * self.lanes
+        self.end = self.payload_offset + self.payload_size
+        symbol_table, length_table = decode_tables(lengths, canonical_codes(lengths))
+        # Code length in the high half, symbol in the low half
+        self.table = (length_table.astype(np.int64) << 16) | symbol_table
+        self.dtype = np.uint8 if used_count == 0 or used.max() < 256 else np.uint16
+
+    def decode(self, first=0, last=None):
+        # Symbols of sync intervals first .. last - 1
+        last = self.lanes if last is None else min(last, self.lanes)
+        if first >= last:
+            return np.zeros(0, dtype=self.dtype)
+        start_byte = int(self.sync[first]) >> 3
+        end_byte = self.payload_size if last == self.lanes else (int(self.sync[last]) >> 3) + 1
+        self.fh.seek(self.payload_offset + start_byte)
+        # The last lane runs past the end of the stream; the zero padding
+        # keeps its reads in bounds and what it decodes there is dropped
+        padding = 2 * self.interval + 8
+        data = np.frombuffer(self.fh.read(end_byte - start_byte) + bytes(padding), dtype=np.uint8).astype(np.int64)
+        # Big endian 32-bit window starting at every byte
+        windows = (data[:-3] << 24) | (data[1:-2] << 16) | (data[2:-1] << 8) | data[3:]
+
+        positions = self.sync[first:last] - 8 * start_byte
+        out = np.empty((self.interval, last - first), dtype=np.uint16)
+        shift = 32 - MAX_CODE_LENGTH
+        mask = (1 << MAX_CODE_LENGTH) - 1
+        for step in range(self.interval):
+            bits = (windows[positions >> 3] >> (shift - (positions & 7))) & mask
+            entry = self.table[bits]
+            out[step] = entry
+            positions += entry >> 16
+        count = min(last * self.interval, self.count) - first * self.interval
+        return out.T.ravel()[:count].astype(self.dtype)
+
+def huffman_decode(data, offset=0):
+    # Returns the symbols and the offset just past the stream
+    stream = HuffmanStream(io.BytesIO(data), offset)
+    return stream.decode(), stream.end
+
+def huffman_compress(data):
+    return huffman_encode(np.frombuffer(data, dtype=np.uint8))
+
+def huffman_decompress(data):
+    symbols, _ = huffman_decode(data)
+    return symbols.astype(np.uint8).tobytes()
@@ -0,0 +1,180 @@
+import weakref
+from collections import OrderedDict
+
+import cv2
+import numpy as np
+
+# Frequency-domain filtering on a cached real-input spectrum. The grayscale
+# image is padded to an FFT-friendly size (cv2.getOptimalDFTSize) by
+# reflection and transformed once with a real FFT in single precision. The
+# spectrum is cached per image object, so sweeping the radius or switching
+# the mask on the same image costs one mask multiply and one inverse
+# transform. Arrays passed through the editor are never modified in place,
+# which makes the array object itself a safe version key.
+#
+# The Wiener deconvolver below works on the same spectra, per colour channel.
+#
+# Radii are measured in cycles per image, as in the original centred-circle
+# masks, so the same radius means the same cut-off on a proxy and on the
+# full resolution image.
+
+MASK_TYPES = ("ideal", "butterworth", "gaussian")
+PSF_TYPES = ("box", "gaussian", "motion")
+MAX_CACHED_SPECTRA = 2
+NSR_FALLOFF = 10.0
+MIN_NSR = 3e-3
+
+_spectra = OrderedDict()
+_distance_grids = OrderedDict()
+_transfer_functions = OrderedDict()
+
+def _grayscale(image):
+    if image.ndim == 2:
+        return image
+    return cv2.cvtColor(image, cv2.COLOR_RGB2GRAY)
+
+def _remember(cache, key, value, limit):
+    cache[key] = value
+    cache.move_to_end(key)
+    while len(cache) > limit:
+        cache.popitem(last=False)
+
+def _forget(key):
+    _spectra.pop(key, None)
+
+def padded_shape(height, width):
+    return cv2.getOptimalDFTSize(height), cv2.getOptimalDFTSize(width)
+
+def real_spectrum(image, margin=0):
+    # image is a float32 H x W (x C) array; channels are transformed together.
+    # margin pads every side by reflection to keep wrap-around away from the
+    # edges, e.g. for deconvolution
+    h, w = image.shape[:2]
+    ph, pw = padded_shape(h + 2 * margin, w + 2 * margin)
+    padded = cv2.copyMakeBorder(image, margin, ph - h - margin, margin, pw - w - margin, cv2.BORDER_REFLECT)
+    if padded.ndim == 2 and image.ndim == 3:
+        padded = padded[:, :, None]
+    return np.fft.rfft2(padded, axes=(0, 1)).astype(np.complex64, copy=False)
+
+def inverse_spectrum(spectrum, height, width, margin=0):
+    ph, pw = padded_shape(height + 2 * margin, width + 2 * margin)
+    result = np.fft.irfft2(spectrum, s=(ph, pw), axes=(0, 1))
+    result = result[margin:margin + height, margin:margin + width]
+    return result.astype(np.float32, copy=False)
+
+def cached_spectrum(image, grayscale=True, margin=0):
+    key = (id(image), grayscale, margin)
+    entry = _spectra.get(key)
+    if entry is not None and entry[0]() is image:
+        _spectra.move_to_end(key)
+        return entry[1]
+    source = _grayscale(image) if grayscale else image
+    spectrum = real_spectrum(source.astype(np.float32), margin)
+    # Drop the entry as soon as the image it belongs to is freed
+    _remember(_spectra, key, (weakref.ref(image, lambda _, key=key: _forget(key)), spectrum), MAX_CACHED_SPECTRA)
+    return spectrum
+
+def frequency_distance(height, width):
+    # Distance of each rfft2 bin from DC, in cycles per (unpadded) image
+    key = (height, width)
+    grid = _distance_grids.get(key)
+    if grid is None:
+        ph, pw = padded_shape(height, width)
+        fy = (np.fft.fftfreq(ph) * height).astype(np.float32)
+        fx = (np.fft.rfftfreq(pw) * width).astype(np.float32)
+        grid = np.sqrt(fy[:, None] ** 2 + fx[None, :] ** 2)
+        _remember(_distance_grids, key, grid, MAX_CACHED_SPECTRA)
+    return grid
+
+def low_pass_mask(distance, radius, mask="ideal", order=2):
+    if mask == "ideal":
+        return (distance <= radius).astype(np.float32)
+    elif mask == "butterworth":
+        return 1.0 / (1.0 + (distance / np.float32(max(radius, 1e-6))) ** (2 * order))
+    elif mask == "gaussian":
+        return np.exp(-(distance ** 2) / np.float32(2.0 * max(radius, 1e-6) ** 2))
+    raise ValueError(f"Unknown mask type: {mask}")
+
+def frequency_filter(image, radius=30, mask="ideal", high_pass=False, order=2):
+    h, w = image.shape[:2]
+    spectrum = cached_spectrum(image)
+    weights = low_pass_mask(frequency_distance(h, w), radius, mask, order)
+    if high_pass:
+        weights = 1.0 - weights
+    result = inverse_spectrum(spectrum * weights, h, w)
+    np.abs(result, out=result)
+    np.clip(result, 0, 255, out=result)
+    return result.astype(np.uint8)
+
+def make_psf(psf="box", size=5, angle=0.0):
+    # Point spread function of the blur to undo, normalised to sum 1
+    size = max(1, int(size))
+    if psf == "box":
+        # Odd like the other kernels: an even box has no centre pixel and
+        # would shift the deconvolved image by half a pixel
+        kernel = np.ones((size | 1, size | 1), np.float32)
+    elif psf == "gaussian":
+        # size is the kernel width; sigma follows OpenCV's default for it
+        g = cv2.getGaussianKernel(size | 1, 0).astype(np.float32)
+        kernel = g @ g.T
+    elif psf == "motion":
+        # A line of length size through the centre, angle in degrees
+        kernel = np.zeros((size | 1, size | 1), np.float32)
+        c = (size | 1) // 2
+        dx = np.cos(np.radians(angle)) * (size - 1) / 2
+        dy = -np.sin(np.radians(angle)) * (size - 1) / 2
+        cv2.line(kernel, (round(c - dx), round(c - dy)), (round(c + dx), round(c + dy)), 1.0, 1)
+    else:
+        raise ValueError(f"Unknown PSF type: {psf}")
+    return kernel / kernel.sum()
+
+def transfer_function(psf, padded_height, padded_width):
+    # rfft2 of the PSF centred on the origin of the padded grid
+    key = (psf.shape, psf.tobytes(), padded_height, padded_width)
+    otf = _transfer_functions.get(key)
+    if otf is None:
+        kh, kw = psf.shape
+        grid = np.zeros((padded_height, padded_width), np.float32)
+        grid[:kh, :kw] = psf
+        grid = np.roll(grid, (-(kh // 2), -(kw // 2)), axis=(0, 1))
+        otf = np.fft.rfft2(grid).astype(np.complex64, copy=False)
+        _remember(_transfer_functions, key, otf, MAX_CACHED_SPECTRA)
+    return otf
+
+def estimate_noise_sigma(image):
+    # Immerkaer's fast noise variance estimator on a single channel
+    h, w = image.shape
+    if h < 3 or w < 3:
+        return 0.0
+    kernel = np.array([[1, -2, 1], [-2, 4, -2], [1, -2, 1]], np.float32)
+    response = cv2.filter2D(image.astype(np.float32), -1, kernel)[1:-1, 1:-1]
+    return float(np.sum(np.abs(response), dtype=np.float64) * np.sqrt(np.pi / 2) / (6 * (w - 2) * (h - 2)))
+
+def estimate_nsr(image):
+    # Noise-to-signal power ratio, averaged over channels. Photo spectra fall
+    # off with frequency, so at the high frequencies where the PSF response is
+    # weak the signal is about NSR_FALLOFF times below its average power
+    channels = [image] if image.ndim == 2 else [image[:, :, c] for c in range(image.shape[2])]
+    ratios = []
+    for channel in channels:
+        noise = estimate_noise_sigma(channel) ** 2
+        signal = max(float(np.var(channel, dtype=np.float64)) - noise, 1e-6)
+        ratios.append(noise / signal)
+    # The floor covers 8-bit quantisation noise and keeps clean images stable
+    return max(NSR_FALLOFF * float(np.mean(ratios)), MIN_NSR)
+
+def wiener_deconvolve(image, psf="box", size=5, nsr=None, angle=0.0):
+    kernel = make_psf(psf, size, angle)
+    margin = max(kernel.shape)
+    h, w = image.shape[:2]
+    if nsr is None:
+        nsr = estimate_nsr(image)
+
+    spectrum = cached_spectrum(image, grayscale=False, margin=margin)
+    otf = transfer_function(kernel, *padded_shape(h + 2 * margin, w + 2 * margin))
+    restore = np.conj(otf) / (np.abs(otf) ** 2 + np.float32(nsr))
+    if spectrum.ndim == 3:
+        restore = restore[:, :, None]
+    result = inverse_spectrum(spectrum * restore, h, w, margin)
+    np.clip(result, 0, 255, out=result)
+    return result.astype(np.uint8)
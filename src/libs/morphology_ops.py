@@ -1,7 +1,12 @@
 import cv2
 import numpy as np
 
-def morphological_operations(image, operation_type="dilation"):
+from libs.tiling import run_tiled
+
+# Opening and closing chain two passes, so their halo is twice the kernel radius
+MORPHOLOGY_HALO = {"dilation": 2, "erosion": 2, "opening": 4, "closing": 4}
+
+def _morphology(image, operation_type):
     kernel = np.ones((5, 5), np.uint8)
     if operation_type == "dilation":
         return cv2.dilate(image, kernel, iterations=1)
@@ -12,3 +17,8 @@ def morphological_operations(image, operation_type="dilation"):
     elif operation_type == "closing":
         return cv2.morphologyEx(image, cv2.MORPH_CLOSE, kernel)
     return image
+
+def morphological_operations(image, operation_type="dilation"):
+    if operation_type not in MORPHOLOGY_HALO:
+        return image
+    return run_tiled(lambda tile: _morphology(tile, operation_type), image, halo=MORPHOLOGY_HALO[operation_type])
@@ -0,0 +1,50 @@
+import cv2
+
+# Interactive editing runs the operation chain on a proxy: the original image
+# downscaled once to fit the display box. Parameters are always entered in
+# full resolution pixels, so the ones measured in pixels are rescaled before
+# an operation runs on the proxy.
+
+def make_proxy(image, max_width, max_height):
+    h, w = image.shape[:2]
+    scale = min(1.0, max_width / w, max_height / h)
+    if scale == 1.0:
+        return image, 1.0
+    size = (max(1, round(w * scale)), max(1, round(h * scale)))
+    return cv2.resize(image, size, interpolation=cv2.INTER_AREA), scale
+
+def _scale_length(value, scale):
+    # Keep non-zero lengths visible on the proxy
+    if value == 0:
+        return 0
+    length = max(1, round(abs(value) * scale))
+    return length if value > 0 else -length
+
+def _scale_span(start, length, scale):
+    # Scale both ends so adjacent spans stay adjacent after rounding
+    new_start = round(start * scale)
+    new_end = round((start + length) * scale)
+    return new_start, max(1, new_end - new_start)
+
+def scale_params(name, params, scale):
+    if scale == 1.0:
+        return params
+    params = dict(params)
+    if name == "apply_crop_image":
+        params["start_row"], params["num_rows"] = _scale_span(params["start_row"], params["num_rows"], scale)
+        params["start_col"], params["num_cols"] = _scale_span(params["start_col"], params["num_cols"], scale)
+    elif name == "apply_translation":
+        params["dx"] = _scale_length(params["dx"], scale)
+        params["dy"] = _scale_length(params["dy"], scale)
+    elif name == "apply_scaling":
+        params["new_width"] = _scale_length(params["new_width"], scale)
+        params["new_height"] = _scale_length(params["new_height"], scale)
+    elif name == "apply_border":
+        params["thickness"] = _scale_length(params["thickness"], scale)
+    elif name == "apply_wiener_filter":
+        # Kept odd so the proxy's PSF stays centred like the full size one
+        params["size"] = _scale_length(params["size"], scale) | 1
+    return params
+
+def scale_chain(chain, scale):
+    return [(name, scale_params(name, params, scale)) for name, params in chain]
@@ -0,0 +1,77 @@
+import base64
+import weakref
+from collections import OrderedDict
+
+import cv2
+import numpy as np
+
+from libs.preview import make_proxy
+
+# Encoding of result images for display. Flet sends images to the client as
+# base64 strings, so every update used to carry a full resolution PNG. Previews
+# are downscaled to the box they are shown in and written as JPEG, or WebP
+# when there is an alpha channel. Arrays shown by the pages are never modified
+# in place, so the encoded string is cached per array object and repeated
+# update() calls reuse it. Lossless PNG is only written for downloads.
+
+PREVIEW_FORMAT = "JPEG"
+PREVIEW_QUALITY = 85
+MAX_CACHED_PREVIEWS = 8
+
+_EXTENSIONS = {"JPEG": ".jpg", "WEBP": ".webp", "PNG": ".png"}
+
+_previews = OrderedDict()
+
+def _forget(key):
+    _previews.pop(key, None)
+
+def _to_bgr(image):
+    # cv2 encoders expect BGR(A) channel order
+    if image.ndim == 2:
+        return image
+    if image.shape[2] == 4:
+        return cv2.cvtColor(image, cv2.COLOR_RGBA2BGRA)
+    return cv2.cvtColor(image, cv2.COLOR_RGB2BGR)
+
+def encode_image(image, fmt=PREVIEW_FORMAT, quality=PREVIEW_QUALITY):
+    fmt = fmt.upper()
+    if fmt not in _EXTENSIONS:
+        raise ValueError(f"Unknown image format: {fmt}")
+    image = np.asarray(image)
+    if image.dtype != np.uint8:
+        image = np.clip(image, 0, 255).astype(np.uint8)
+    # JPEG has no alpha channel
+    if fmt == "JPEG" and image.ndim == 3 and image.shape[2] == 4:
+        fmt = "WEBP"
+    if fmt == "JPEG":
+        options = [cv2.IMWRITE_JPEG_QUALITY, int(quality)]
+    elif fmt == "WEBP":
+        options = [cv2.IMWRITE_WEBP_QUALITY, int(quality)]
+    else:
+        options = [cv2.IMWRITE_PNG_COMPRESSION, 3]
+    ok, buffer = cv2.imencode(_EXTENSIONS[fmt], _to_bgr(image), options)
+    if not ok:
+        raise ValueError(f"Could not encode image as {fmt}")
+    return buffer.tobytes()
+
+def encode_png(image):
+    # Lossless encoding for downloads
+    return encode_image(image, "PNG")
+
+def encode_preview(image, max_width, max_height, fmt=PREVIEW_FORMAT, quality=PREVIEW_QUALITY):
+    # Base64 preview of an H x W (x C) uint8 array that fits max_width x max_height
+    key = (id(image), max_width, max_height, fmt, quality)
+    entry = _previews.get(key)
+    if entry is not None and entry[0]() is image:
+        _previews.move_to_end(key)
+        return entry[1]
+
+    proxy, _ = make_proxy(image, max_width, max_height)
+    encoded = base64.b64encode(encode_image(proxy, fmt, quality)).decode()
+
+    # Drop the entry as soon as the image it belongs to is freed
+    _previews[key] = (weakref.ref(image, lambda _, key=key: _forget(key)), encoded)
+    _previews.move_to_end(key)
+    while len(_previews) > MAX_CACHED_PREVIEWS:
+        _previews.popitem(last=False)
+    return encoded
@@ -0,0 +1,253 @@
+import io
+import struct
+import zlib
+
+import cv2
+import numpy as np
+
+from libs.compression_ops import SCAN_ORDERS, run_length_decoding, run_length_encoding
+from libs.entropy_coding import HuffmanStream, huffman_compress, huffman_decompress
+
+# Binary container for run-length coded images.
+#
+#   header   "RLE1", height, width, channels, scan order, flags  (<4sIIBBB)
+#   table    per channel: run count, values bytes, lengths bytes (<QQQ)
+#   data     per channel: the run values (one byte each), then the run
+#            lengths as LEB128 varints
+#
+# With the deflate or the Huffman flag each values and lengths section is
+# compressed as its own zlib or libs.entropy_coding stream, so a reader can
+# walk all sections side by side: rows are decoded from a few runs at a time
+# without loading the whole run list. Deflate is the default: run values and
+# lengths repeat in patterns that its string matching finds and a Huffman code
+# of single bytes does not.
+
+MAGIC = b"RLE1"
+HEADER = struct.Struct("<4sIIBBB")
+CHANNEL_ENTRY = struct.Struct("<QQQ")
+FLAG_DEFLATE = 1
+FLAG_HUFFMAN = 2
+CODINGS = {"raw": 0, "deflate": FLAG_DEFLATE, "huffman": FLAG_HUFFMAN}
+DEFLATE_LEVEL = 6
+# Compressed bytes (or Huffman symbols) read per section at a time when streaming
+READ_CHUNK = 1 << 16
+# Pixels per channel decoded at once when streaming rows
+BLOCK_PIXELS = 1 << 20
+
+def encode_varints(values):
+    values = np.asarray(values, dtype=np.uint64)
+    nbytes = np.ones(len(values), dtype=np.int64)
+    for k in range(1, 10):
+        nbytes += values >= np.uint64(1 << (7 * k))
+    ends = np.cumsum(nbytes)
+    out = np.empty(int(ends[-1]) if len(ends) else 0, dtype=np.uint8)
+    starts = ends - nbytes
+    for k in range(int(nbytes.max()) if len(nbytes) else 0):
+        sel = nbytes > k
+        digit = (values[sel] >> np.uint64(7 * k)) & np.uint64(0x7F)
+        more = (nbytes[sel] > k + 1).astype(np.uint64) << np.uint64(7)
+        out[starts[sel] + k] = digit | more
+    return out.tobytes()
+
+def decode_varints(data):
+    # Returns the complete varints in data and the number of bytes they used
+    data = np.frombuffer(data, dtype=np.uint8)
+    ends = np.flatnonzero(data < 0x80)
+    if len(ends) == 0:
+        return np.zeros(0, dtype=np.uint64), 0
+    used = int(ends[-1]) + 1
+    starts = np.concatenate(([0], ends[:-1] + 1))
+    position = np.arange(used) - np.repeat(starts, ends - starts + 1)
+    digits = (data[:used] & 0x7F).astype(np.uint64) << (7 * position).astype(np.uint64)
+    return np.add.reduceat(digits, starts), used
+
+def _compress(section, coding):
+    if coding == "deflate":
+        return zlib.compress(section, DEFLATE_LEVEL)
+    if coding == "huffman":
+        return huffman_compress(section)
+    return section
+
+def _decompress(section, coding):
+    if coding == "deflate":
+        return zlib.decompress(section)
+    if coding == "huffman":
+        return huffman_decompress(section)
+    return section
+
+def encode_rle(image, order="row", coding="deflate"):
+    if coding not in CODINGS:
+        raise ValueError(f"Unknown section coding: {coding}")
+    image = np.asarray(image, dtype=np.uint8)
+    h, w = image.shape[:2]
+    channels = 1 if image.ndim == 2 else image.shape[2]
+    table = []
+    sections = []
+    for values, lengths in run_length_encoding(image, order):
+        runs = len(values)
+        values = _compress(values.tobytes(), coding)
+        lengths = _compress(encode_varints(lengths), coding)
+        table.append(CHANNEL_ENTRY.pack(runs, len(values), len(lengths)))
+        sections += [values, lengths]
+
+    header = HEADER.pack(MAGIC, h, w, channels, SCAN_ORDERS.index(order), CODINGS[coding])
+    return b"".join([header, *table, *sections])
+
+def _read_layout(fh):
+    header = fh.read(HEADER.size)
+    if len(header) < HEADER.size:
+        raise ValueError("Not an RLE file: too short")
+    magic, h, w, channels, order, flags = HEADER.unpack(header)
+    if magic != MAGIC:
+        raise ValueError("Not an RLE file")
+    if order >= len(SCAN_ORDERS):
+        raise ValueError(f"Unknown scan order id: {order}")
+    entries = [CHANNEL_ENTRY.unpack(fh.read(CHANNEL_ENTRY.size)) for _ in range(channels)]
+    offset = HEADER.size + CHANNEL_ENTRY.size * channels
+    layout = []
+    for runs, values_size, lengths_size in entries:
+        layout.append((runs, offset, values_size, offset + values_size, lengths_size))
+        offset += values_size + lengths_size
+    coding = "huffman" if flags & FLAG_HUFFMAN else "deflate" if flags & FLAG_DEFLATE else "raw"
+    return (h, w, channels), SCAN_ORDERS[order], coding, layout
+
+def decode_rle(data):
+    fh = io.BytesIO(data)
+    shape, order, coding, layout = _read_layout(fh)
+    encoded = []
+    for runs, values_offset, values_size, lengths_offset, lengths_size in layout:
+        values = _decompress(data[values_offset:values_offset + values_size], coding)
+        lengths = _decompress(data[lengths_offset:lengths_offset + lengths_size], coding)
+        lengths, _ = decode_varints(lengths)
+        if len(lengths) != runs or len(values) != runs:
+            raise ValueError("Corrupt RLE file: run count mismatch")
+        encoded.append((np.frombuffer(values, dtype=np.uint8), lengths.astype(np.int64)))
+    return run_length_decoding(encoded, shape, order)
+
+class _SectionReader:
+    # Sequential reader over one (optionally compressed) section of the file.
+    # At most about READ_CHUNK bytes beyond the request are decoded ahead, so
+    # a highly compressible section is never inflated whole
+    def __init__(self, fh, offset, size, coding):
+        self.fh = fh
+        self.position = offset
+        self.remaining = size
+        self.decompressor = zlib.decompressobj() if coding == "deflate" else None
+        self.tail = b""
+        # Decoded bytes and the offset of the first unread one
+        self.buffer = bytearray()
+        self.start = 0
+        self.huffman = None
+        if coding == "huffman" and size:
+            # Decoded a few sync intervals at a time
+            self.huffman = HuffmanStream(fh, offset)
+            self.next_lane = 0
+            self.lanes_per_read = max(1, READ_CHUNK // self.huffman.interval)
+
+    def _raw(self):
+        self.fh.seek(self.position)
+        raw = self.fh.read(min(READ_CHUNK, self.remaining))
+        if not raw:
+            raise ValueError("Corrupt RLE file: section cut short")
+        self.position += len(raw)
+        self.remaining -= len(raw)
+        return raw
+
+    def _decode_more(self, wanted):
+        # Next piece of the section, b"" once it is exhausted
+        if self.huffman is not None:
+            if self.next_lane >= self.huffman.lanes:
+                return b""
+            last = self.next_lane + self.lanes_per_read
+            data = self.huffman.decode(self.next_lane, last).astype(np.uint8).tobytes()
+            self.next_lane = last
+            return data
+        if self.decompressor is None:
+            return self._raw() if self.remaining > 0 else b""
+        while self.tail or self.remaining > 0:
+            raw = self.tail or self._raw()
+            data = self.decompressor.decompress(raw, max(wanted, READ_CHUNK))
+            self.tail = self.decompressor.unconsumed_tail
+            if data:
+                return data
+        return b""
+
+    def read(self, n):
+        # Up to n bytes; fewer only at the end of the section
+        while len(self.buffer) - self.start < n:
+            data = self._decode_more(n - (len(self.buffer) - self.start))
+            if not data:
+                break
+            # Drop the consumed bytes before growing; what is left is less than n
+            del self.buffer[:self.start]
+            self.start = 0
+            self.buffer += data
+        data = bytes(self.buffer[self.start:self.start + n])
+        self.start += len(data)
+        return data
+
+class _RunCursor:
+    # Hands out the samples of one channel in order, keeping one chunk of runs
+    def __init__(self, fh, runs, values_offset, values_size, lengths_offset, lengths_size, coding):
+        self.values_reader = _SectionReader(fh, values_offset, values_size, coding)
+        self.lengths_reader = _SectionReader(fh, lengths_offset, lengths_size, coding)
+        self.runs_left = runs
+        self.carry = b""
+        self.values = np.zeros(0, dtype=np.uint8)
+        self.starts = self.ends = np.zeros(0, dtype=np.int64)
+        self.position = 0
+
+    def _refill(self):
+        data = self.carry + self.lengths_reader.read(READ_CHUNK)
+        lengths, used = decode_varints(data)
+        self.carry = data[used:]
+        if len(lengths) == 0 or len(lengths) > self.runs_left:
+            raise ValueError("Corrupt RLE file: run lengths do not match the run count")
+        self.runs_left -= len(lengths)
+        self.values = np.frombuffer(self.values_reader.read(len(lengths)), dtype=np.uint8)
+        if len(self.values) != len(lengths):
+            raise ValueError("Corrupt RLE file: missing run values")
+        self.ends = np.cumsum(lengths.astype(np.int64))
+        self.starts = self.ends - lengths.astype(np.int64)
+        self.position = 0
+
+    def take(self, n):
+        out = np.empty(n, dtype=np.uint8)
+        filled = 0
+        while filled < n:
+            if len(self.ends) == 0 or self.position >= self.ends[-1]:
+                self._refill()
+            stop = min(self.position + n - filled, int(self.ends[-1]))
+            first = np.searchsorted(self.ends, self.position, side="right")
+            last = np.searchsorted(self.ends, stop, side="left") + 1
+            lengths = (np.minimum(self.ends[first:last], stop)
+                       - np.maximum(self.starts[first:last], self.position))
+            out[filled:filled + stop - self.position] = np.repeat(self.values[first:last], lengths)
+            filled += stop - self.position
+            self.position = stop
+        return out
+
+def iter_rle_rows(source):
+    # Yields the rows of an RLE file (path, bytes or seekable binary file)
+    # one at a time, holding one block of runs per channel
+    if isinstance(source, (bytes, bytearray)):
+        source = io.BytesIO(source)
+    fh = open(source, "rb") if isinstance(source, str) else source
+    try:
+        (h, w, channels), order, coding, layout = _read_layout(fh)
+        if order != "row":
+            # Rows of a column ordered file are only complete at the end
+            fh.seek(0)
+            yield from decode_rle(fh.read())
+            return
+
+        cursors = [_RunCursor(fh, *entry, coding) for entry in layout]
+        block_rows = max(1, BLOCK_PIXELS // max(w, 1))
+        for y in range(0, h, block_rows):
+            rows = min(block_rows, h - y)
+            planes = [cursor.take(rows * w).reshape(rows, w) for cursor in cursors]
+            block = planes[0] if channels == 1 else cv2.merge(planes)
+            yield from block
+    finally:
+        if fh is not source:
+            fh.close()
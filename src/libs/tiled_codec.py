@@ -0,0 +1,204 @@
+import io
+import os
+import struct
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+
+import cv2
+import numpy as np
+
+from libs.dct_codec import decode_dct, encode_dct
+from libs.rle_format import decode_rle, encode_rle
+from libs.tiling import DEFAULT_TILE_SIZE, iter_tiles
+
+# Tiled container for the RLE and DCT codecs. The image is cut into tiles and
+# every tile is encoded as an independent RLE or DCT file, so tiles encode and
+# decode in parallel on a thread or process pool, and a region is decoded from
+# the tiles it touches alone.
+#
+# Tiles are encoded one strip (row of tiles) at a time and written as they
+# are done, with the index at the end, so an image memory mapped from a .npy
+# or raw file is compressed to disk, and decompressed back, holding about one
+# strip in memory whatever the image size:
+#   header    "TIL1", height, width, channels, tile size, codec id (<4sIIBIB)
+#   segments  the encoded tiles, row by row
+#   index     offset and size of every segment (<QQ each)
+#   footer    index offset, tile count, "TIL1"                     (<QI4s)
+# Offsets count from the start of the header.
+
+MAGIC = b"TIL1"
+HEADER = struct.Struct("<4sIIBIB")
+INDEX_ENTRY = struct.Struct("<QQ")
+FOOTER = struct.Struct("<QI4s")
+CODECS = {"rle": (encode_rle, decode_rle), "dct": (encode_dct, decode_dct)}
+# Keeps 4:2:0 chroma blocks of neighbouring tiles aligned
+TILE_ALIGN = 16
+
+def init_worker():
+    # One tile per process; OpenCV's own threads would only oversubscribe
+    cv2.setNumThreads(1)
+
+def _pool(workers, processes):
+    workers = workers or os.cpu_count() or 1
+    if processes:
+        return ProcessPoolExecutor(max_workers=workers, initializer=init_worker)
+    return ThreadPoolExecutor(max_workers=workers)
+
+def _encode_tile(codec, tile, options):
+    return CODECS[codec][0](tile, **options)
+
+def _decode_tile(codec, data):
+    return CODECS[codec][1](data)
+
+def open_image(path, shape=None, dtype=np.uint8):
+    # A read-only memory map of a .npy file, or of a headerless raw file with
+    # the given (height, width[, channels]) shape
+    if path.endswith(".npy"):
+        return np.load(path, mmap_mode="r")
+    if shape is None:
+        raise ValueError("Raw image files need a shape")
+    return np.memmap(path, dtype=dtype, mode="r", shape=tuple(shape))
+
+def write_tiled(fh, image, codec="dct", tile_size=DEFAULT_TILE_SIZE, workers=None, processes=False, **options):
+    # Encodes image (an array or memory map) into fh one strip of tiles at a
+    # time: only the strip being encoded is read into memory and its segments
+    # are written before the next strip is read
+    if codec not in CODECS:
+        raise ValueError(f"Unknown tile codec: {codec}")
+    if tile_size <= 0 or tile_size % TILE_ALIGN:
+        raise ValueError(f"Tile size must be a positive multiple of {TILE_ALIGN}")
+    if image.dtype != np.uint8:
+        raise ValueError(f"Tiled images must be uint8, got {image.dtype}")
+    h, w = image.shape[:2]
+    channels = 1 if image.ndim == 2 else image.shape[2]
+    # RLE round trips any number of channels; DCT codes grayscale as one plane
+    # and colour as YCbCr, dropping anything past the third channel
+    if codec == "dct" and image.ndim != 2 and channels != 3:
+        raise ValueError(f"DCT tiles must be grayscale (H x W) or RGB, got {channels} channels")
+    # Offsets are stored relative to the header, so the container can sit at
+    # any position of fh; the readers take the position they are handed the
+    # file at as its start
+    start = fh.tell()
+    fh.write(HEADER.pack(MAGIC, h, w, channels, tile_size, list(CODECS).index(codec)))
+    index = []
+    with _pool(workers, processes) as pool:
+        for y in range(0, h, tile_size):
+            strip = list(iter_tiles(min(tile_size, h - y), w, tile_size, tile_size))
+            tiles = [np.ascontiguousarray(image[y + y0:y + y1, x0:x1]) for y0, y1, x0, x1 in strip]
+            for segment in pool.map(_encode_tile, [codec] * len(tiles), tiles, [options] * len(tiles)):
+                index.append(INDEX_ENTRY.pack(fh.tell() - start, len(segment)))
+                fh.write(segment)
+            del tiles
+    index_offset = fh.tell() - start
+    fh.write(b"".join(index))
+    fh.write(FOOTER.pack(index_offset, len(index), MAGIC))
+
+def encode_tiled(image, codec="dct", tile_size=DEFAULT_TILE_SIZE, workers=None, processes=False, **options):
+    # options go to the tile encoder, e.g. quality or subsampling for DCT
+    out = io.BytesIO()
+    write_tiled(out, np.asarray(image, dtype=np.uint8), codec, tile_size, workers, processes, **options)
+    return out.getvalue()
+
+def _open(source):
+    # A seekable binary file for a path, bytes or an open file
+    if isinstance(source, (bytes, bytearray)):
+        return io.BytesIO(source)
+    return open(source, "rb") if isinstance(source, str) else source
+
+def read_layout(fh):
+    # Header fields and the (y0, y1, x0, x1, offset, size) of every tile, with
+    # absolute offsets. The container starts at the current position of fh
+    # and runs to its end
+    start = fh.tell()
+    header = fh.read(HEADER.size)
+    if len(header) < HEADER.size:
+        raise ValueError("Not a tiled file: too short")
+    magic, h, w, channels, tile_size, codec = HEADER.unpack(header)
+    if magic != MAGIC:
+        raise ValueError("Not a tiled file")
+    if codec >= len(CODECS):
+        raise ValueError(f"Unknown tile codec id: {codec}")
+    fh.seek(-FOOTER.size, os.SEEK_END)
+    index_offset, count, footer_magic = FOOTER.unpack(fh.read(FOOTER.size))
+    tiles = list(iter_tiles(h, w, tile_size, tile_size))
+    if footer_magic != MAGIC or count != len(tiles):
+        raise ValueError("Corrupt tiled file: bad index")
+    fh.seek(start + index_offset)
+    entries = [INDEX_ENTRY.unpack(fh.read(INDEX_ENTRY.size)) for _ in range(count)]
+    layout = {"height": h, "width": w, "channels": channels, "tile_size": tile_size, "codec": list(CODECS)[codec]}
+    return layout, [tile + (start + offset, size) for tile, (offset, size) in zip(tiles, entries)]
+
+def _decode_tiles(fh, layout, tiles, region, pool):
+    # Decodes the tiles overlapping region = (y0, y1, x0, x1) into an array
+    # covering just that region
+    ry0, ry1, rx0, rx1 = region
+    shape = (ry1 - ry0, rx1 - rx0) + ((layout["channels"],) if layout["channels"] > 1 else ())
+    out = np.empty(shape, dtype=np.uint8)
+    wanted = [t for t in tiles if t[0] < ry1 and t[1] > ry0 and t[2] < rx1 and t[3] > rx0]
+    segments = []
+    for _, _, _, _, offset, size in wanted:
+        fh.seek(offset)
+        segments.append(fh.read(size))
+
+    codec = layout["codec"]
+    for (y0, y1, x0, x1, _, _), tile in zip(wanted, pool.map(_decode_tile, [codec] * len(wanted), segments)):
+        ys, ye, xs, xe = max(y0, ry0), min(y1, ry1), max(x0, rx0), min(x1, rx1)
+        out[ys - ry0:ye - ry0, xs - rx0:xe - rx0] = tile[ys - y0:ye - y0, xs - x0:xe - x0]
+    return out
+
+def decode_tiled(source, workers=None, processes=False):
+    fh = _open(source)
+    try:
+        layout, tiles = read_layout(fh)
+        region = (0, layout["height"], 0, layout["width"])
+        with _pool(workers, processes) as pool:
+            return _decode_tiles(fh, layout, tiles, region, pool)
+    finally:
+        if fh is not source:
+            fh.close()
+
+def iter_strips(source, workers=None, processes=False):
+    # Yields (y, strip) for every strip of tiles, decoding one strip at a time
+    fh = _open(source)
+    try:
+        layout, tiles = read_layout(fh)
+        h, w, tile_size = layout["height"], layout["width"], layout["tile_size"]
+        with _pool(workers, processes) as pool:
+            for y in range(0, h, tile_size):
+                yield y, _decode_tiles(fh, layout, tiles, (y, min(y + tile_size, h), 0, w), pool)
+    finally:
+        if fh is not source:
+            fh.close()
+
+def decode_region(source, x, y, width, height, workers=None, processes=False):
+    # The width x height region at (x, y), clipped to the image, reading and
+    # decoding only the tiles it overlaps
+    fh = _open(source)
+    try:
+        layout, tiles = read_layout(fh)
+        x0, y0 = max(0, x), max(0, y)
+        x1, y1 = min(layout["width"], x + width), min(layout["height"], y + height)
+        if x1 <= x0 or y1 <= y0:
+            raise ValueError("Region is outside the image")
+        with _pool(workers, processes) as pool:
+            return _decode_tiles(fh, layout, tiles, (y0, y1, x0, x1), pool)
+    finally:
+        if fh is not source:
+            fh.close()
+
+def compress_file(src_path, dst_path, codec="dct", shape=None, tile_size=DEFAULT_TILE_SIZE, workers=None,
+                  processes=False, **options):
+    # .npy or raw image file to a tiled file, holding one strip in memory
+    image = open_image(src_path, shape)
+    with open(dst_path, "wb") as fh:
+        write_tiled(fh, image, codec, tile_size, workers, processes, **options)
+
+def decompress_file(src_path, dst_path, workers=None, processes=False):
+    # Tiled file to a .npy file, written strip by strip through a memory map
+    with open(src_path, "rb") as fh:
+        layout, _ = read_layout(fh)
+    shape = (layout["height"], layout["width"]) + ((layout["channels"],) if layout["channels"] > 1 else ())
+    out = np.lib.format.open_memmap(dst_path, mode="w+", dtype=np.uint8, shape=shape)
+    for y, strip in iter_strips(src_path, workers, processes):
+        out[y:y + len(strip)] = strip
+        out.flush()
+    del out
@@ -1,4 +1,3 @@
-import base64
 import uuid
 import flet as ft
 from flet import (
@@ -18,10 +17,11 @@ from flet import (
     FilePickerResultEvent,
     SnackBar,
 )
-import numpy as np
-import io
-from PIL import Image
-from libs.background_removal import remove_background_threshold, remove_background_kmeans
+from libs.background_removal import background_mask, to_rgba
+from libs.preview_encoder import encode_png, encode_preview
+
+# Method buttons and the libs.background_removal masks they select
+METHODS = {"Threshold": "threshold", "KMeans": "kmeans", "GrabCut": "grabcut"}
 
 class BackgroundRemovalPage(UserControl):
     def __init__(self, page, on_back):
@@ -121,41 +121,19 @@ class BackgroundRemovalPage(UserControl):
 
     def remove_background(self, e):
         if self.selected_image:
-            # Remove the background based on the selected method
-            if self.selected_method == "Threshold":
-                result_array = remove_background_threshold(self.selected_image.src)
-            else:  # KMeans
-                result_array = remove_background_kmeans(self.selected_image.src)
-
-            # Convert the result array back to an image (assuming it's in RGB)
-            result_img = Image.fromarray(result_array.astype('uint8'))
-
-            # Convert image to RGBA to add transparency (alpha channel)
-            result_img = result_img.convert("RGBA")
-            result_array = np.array(result_img)
-
-            # Create a mask where white pixels are found (or almost white)
-            # Threshold values can be adjusted for specific use cases
-            lower_white = np.array([200, 200, 200, 255])  # White pixel threshold
-            upper_white = np.array([255, 255, 255, 255])
-
-            # Create a mask to find white pixels
-            white_mask = np.all((result_array[:, :, :3] >= lower_white[:3]) & (result_array[:, :, :3] <= upper_white[:3]), axis=-1)
+            # The selected method gives a foreground mask, which becomes the
+            # alpha channel of the result directly
+            method = METHODS[self.selected_method]
+            image, mask = background_mask(self.selected_image.src, method)
+            result_array = to_rgba(image, mask)
 
-            # Set the alpha channel to 0 (transparent) for white pixels
-            result_array[white_mask] = [0, 0, 0, 0]  # Black with full transparency
-
-            # Convert the numpy array back to an image
-            result_img = Image.fromarray(result_array)
-
-            # Save the image to an in-memory buffer
-            self.result_image = io.BytesIO()
-            result_img.save(self.result_image, format="PNG")
-            self.result_image.seek(0)
+            # Keep the full resolution result; it is only encoded losslessly
+            # on download
+            self.result_image = result_array
 
             # Update the result image
             result = ft.Image(
-                src_base64=base64.b64encode(self.result_image.getvalue()).decode("utf-8"),
+                src_base64=encode_preview(self.result_image, 300, 300),
                 width=300,
                 height=300,
                 fit=ft.ImageFit.CONTAIN,
@@ -166,13 +144,13 @@ class BackgroundRemovalPage(UserControl):
 
 
     def download_result(self, e):
-        if self.result_image:
+        if self.result_image is not None:
             # Save the image to a file
             unique_id = uuid.uuid4().hex  # Generate a UUID and get its hexadecimal representation
             # Construct the file path with the UUID
             save_path = f"background_removed_image_{unique_id}.png"
             with open(save_path, "wb") as dst_file:
-                dst_file.write(self.result_image.getvalue())
+                dst_file.write(encode_png(self.result_image))
             
             # Trigger download
             self.page.launch_url(save_path)
@@ -263,6 +241,21 @@ class BackgroundRemovalPage(UserControl):
                     bgcolor=colors.WHITE,
                     data="KMeans",  # Store method identifier
                 ),
+                Container(
+                    content=Text("GrabCut Segmentation", size=14),
+                    width=200,
+                    height=40,
+                    border=border.all(
+                        width=2,
+                        color=colors.BLUE_400 if self.selected_method == "GrabCut" else colors.BLACK38
+                    ),
+                    border_radius=border_radius.all(8),
+                    padding=padding.all(10),
+                    alignment=alignment.center,
+                    on_click=self.select_method("GrabCut"),
+                    bgcolor=colors.BLUE_50 if self.selected_method == "GrabCut" else colors.WHITE,
+                    data="GrabCut",  # Store method identifier
+                ),
             ],
             spacing=10,
             alignment=ft.MainAxisAlignment.CENTER,
@@ -1,9 +1,13 @@
-import base64
 import flet as ft
 from PIL import Image
-import io
 import os
 from libs.basic_operations import *
+from libs.edit_graph import EditRecipe, steps_to_json
+from libs.preview import make_proxy
+from libs.preview_encoder import encode_preview
+
+PREVIEW_WIDTH = 600
+PREVIEW_HEIGHT = 600
 
 class PhotoEditorPage(ft.UserControl):
     def __init__(self, page: ft.Page, on_back):
@@ -12,6 +16,10 @@ class PhotoEditorPage(ft.UserControl):
         self.on_back = on_back
         self.uploaded_image = None
         self.processed_image = None
+        self.proxy_image = None
+        self.proxy_scale = 1.0
+        self.recipe = None
+        self.selected_step = None
         self.init_controls()
 
     def init_controls(self):
@@ -21,6 +29,7 @@ class PhotoEditorPage(ft.UserControl):
         self.blue_slider = ft.Slider(min=0, max=255, value=0, label="Blue")
         self.brightness_slider = ft.Slider(min=0.1, max=3.0, value=1.0, label="Brightness")
         self.contrast_slider = ft.Slider(min=0.1, max=3.0, value=1.0, label="Contrast")
+        self.frequency_radius = ft.Slider(min=1, max=300, value=30, label="Radius {value}")
         
         # Initialize dropdowns
         self.flip_dropdown = ft.Dropdown(
@@ -33,6 +42,28 @@ class PhotoEditorPage(ft.UserControl):
             value="Horizontal"
         )
         
+        self.frequency_mask = ft.Dropdown(
+            width=145,
+            label="Mask",
+            options=[
+                ft.dropdown.Option("Ideal"),
+                ft.dropdown.Option("Butterworth"),
+                ft.dropdown.Option("Gaussian"),
+            ],
+            value="Ideal"
+        )
+
+        self.wiener_psf = ft.Dropdown(
+            width=145,
+            label="Blur",
+            options=[
+                ft.dropdown.Option("Box"),
+                ft.dropdown.Option("Gaussian"),
+                ft.dropdown.Option("Motion"),
+            ],
+            value="Box"
+        )
+
         self.filter_dropdown = ft.Dropdown(
             width=300,
             options=[
@@ -49,6 +80,7 @@ class PhotoEditorPage(ft.UserControl):
         self.crop_height = ft.TextField(value="100", label="Height", width=70)
         self.rotation_angle = ft.TextField(value="0", label="Angle", width=300)
         self.gamma = ft.TextField(value="1", label="Gamma", width=300)
+        self.wiener_size = ft.TextField(value="5", label="Blur Size", width=145)
         self.new_width = ft.TextField(value="0", label="New Width", width=145)
         self.new_height = ft.TextField(value="0", label="New Heigth", width=145)
         self.maintain_aspect = None # use toogle button to implement this
@@ -56,6 +88,12 @@ class PhotoEditorPage(ft.UserControl):
         self.translate_y = ft.TextField(value="0", label="Y", width=145)
         self.border_thickness = ft.TextField(value="5", label="Thickness")
         self.border_color = ft.TextField(value="Black", label="Color")
+
+        # Edit a downscaled proxy and apply the chain at full size on download
+        self.preview_mode = ft.Switch(label="Fast preview", value=True, on_change=self.toggle_preview_mode)
+
+        # Recorded edit steps
+        self.history = ft.Column(spacing=0)
         
         # Initialize file picker
         self.file_picker = ft.FilePicker(
@@ -68,16 +106,19 @@ class PhotoEditorPage(ft.UserControl):
         )
         self.page.overlay.append(self.save_file_dialog)
 
-    def pil_to_ft_image(self, pil_image, width=None, height=None):
-        # Convert PIL image to flet Image
-        img_byte_arr = io.BytesIO()
-        pil_image.save(img_byte_arr, format='PNG')
-        img_byte_arr = img_byte_arr.getvalue()
-        
+        # Recipes saved here can be replayed with batch.py
+        self.save_recipe_dialog = ft.FilePicker(
+            on_result=self.handle_save_recipe
+        )
+        self.page.overlay.append(self.save_recipe_dialog)
+
+    def pil_to_ft_image(self, image, width=PREVIEW_WIDTH, height=PREVIEW_HEIGHT):
+        # Convert the working array to flet Image, downscaled to the display
+        # box and encoded lossy; the encoding is cached per result
         return ft.Stack(
             controls=[
                     ft.Image(
-                        src_base64=base64.b64encode(img_byte_arr).decode(),
+                        src_base64=encode_preview(image, width, height),
                         width=width,
                         height=height,
                         fit=ft.ImageFit.CONTAIN,
@@ -96,173 +137,241 @@ class PhotoEditorPage(ft.UserControl):
     def handle_file_picked(self, e: ft.FilePickerResultEvent):
         if e.files:
             file_path = e.files[0].path
-            self.uploaded_image = Image.open(file_path)
-            self.processed_image = self.uploaded_image.copy()
-            self.update_images()
+            # The only PIL -> array conversion; operations never modify their
+            # input, so the working image can share the original buffer
+            self.uploaded_image = to_array(Image.open(file_path))
+            self.proxy_image, self.proxy_scale = make_proxy(self.uploaded_image, PREVIEW_WIDTH, PREVIEW_HEIGHT)
+            self.recipe = EditRecipe(*self.source_image())
+            self.selected_step = None
+            self.render()
 
     def handle_save_result(self, e: ft.FilePickerResultEvent):
-        if e.path and self.processed_image:
+        if e.path and self.processed_image is not None:
             try:
-                self.processed_image.save(e.path)
+                to_pil(self.render_full_resolution()).save(e.path)
             except Exception as e:
                 print(f"Error saving image: {str(e)}")
 
+    def handle_save_recipe(self, e: ft.FilePickerResultEvent):
+        if e.path and self.recipe is not None:
+            try:
+                with open(e.path, "w") as f:
+                    f.write(steps_to_json(self.recipe.steps))
+            except Exception as e:
+                print(f"Error saving recipe: {str(e)}")
+
+    def source_image(self):
+        # The image the recipe renders on and the factor its pixel parameters
+        # are scaled by
+        if self.preview_mode.value:
+            return self.proxy_image, self.proxy_scale
+        return self.uploaded_image, 1.0
+
+    def render_full_resolution(self):
+        # In preview mode the displayed image is the proxy result, so the
+        # recorded chain is replayed on the original for the download
+        if not self.preview_mode.value:
+            return self.processed_image
+        return apply_chain_array(self.uploaded_image, self.recipe.steps)
+
+    def render(self):
+        # Steps before the first changed one come from the recipe's cache
+        self.processed_image = self.recipe.render()
+        self.update_history()
+        self.update_images()
+
+    def apply_operation(self, name, params):
+        # params are in full resolution pixels. With a step of the same kind
+        # selected in the history, the step is re-tweaked instead of appended
+        if self.recipe is None:
+            return
+        steps, selected = list(self.recipe.steps), self.selected_step
+        if selected is not None and self.recipe.steps[selected][0] == name:
+            self.recipe.update_step(selected, params)
+        else:
+            self.recipe.add_step(name, params)
+            self.selected_step = None
+        self.render_or_restore(steps, selected)
+
+    def render_or_restore(self, steps, selected):
+        # A step that fails to render (e.g. Scale to 0x0) is taken back out so
+        # the recipe, history and image stay as they were before the edit
+        try:
+            self.render()
+        except Exception as error:
+            self.recipe.steps = steps
+            self.selected_step = selected
+            self.page.show_snack_bar(ft.SnackBar(content=ft.Text(f"Could not apply the operation: {error}")))
+
+    def select_step(self, index):
+        self.selected_step = None if self.selected_step == index else index
+        self.update_history()
+        self.update()
+
+    def remove_step(self, index):
+        # Later steps can depend on the removed one, e.g. a crop on an upscale
+        steps, selected = list(self.recipe.steps), self.selected_step
+        self.recipe.remove_step(index)
+        self.selected_step = None
+        self.render_or_restore(steps, selected)
+
+    def update_history(self):
+        steps = self.recipe.steps if self.recipe else []
+        self.history.controls = [
+            ft.Row(
+                [
+                    ft.TextButton(
+                        f"{i + 1}. {name}" + (f" {params}" if params else ""),
+                        on_click=lambda _, i=i: self.select_step(i),
+                        style=ft.ButtonStyle(
+                            bgcolor=ft.colors.BLUE_50 if i == self.selected_step else None,
+                        ),
+                        expand=True,
+                    ),
+                    ft.IconButton(
+                        icon=ft.icons.DELETE_OUTLINE,
+                        icon_size=18,
+                        on_click=lambda _, i=i: self.remove_step(i),
+                    ),
+                ],
+                spacing=5,
+            )
+            for i, (name, params) in enumerate(steps)
+        ]
+
+    def toggle_preview_mode(self, _):
+        if self.recipe is not None:
+            self.recipe.set_source(*self.source_image())
+            self.render()
+
     def update_images(self):
-        if self.processed_image:
-            self.output_image.controls[0].content = self.pil_to_ft_image(self.processed_image, 600, 600)
+        if self.processed_image is not None:
+            self.output_image.controls[0].content = self.pil_to_ft_image(self.processed_image, PREVIEW_WIDTH, PREVIEW_HEIGHT)
         self.update()
 
     # Image processing methods
     def apply_grayscale(self, _):
-        if self.processed_image:
-            self.processed_image = apply_grayscale(self.processed_image)
-            self.update_images()
+        self.apply_operation("apply_grayscale", {})
 
     def apply_negative(self, _):
-        if self.processed_image:
-            self.processed_image = apply_negative(self.processed_image)
-            self.update_images()
+        self.apply_operation("apply_negative", {})
 
     def apply_color_manipulation(self, _):
-        if self.processed_image:
-            r = int(self.red_slider.value)
-            g = int(self.green_slider.value)
-            b = int(self.blue_slider.value)
-            self.processed_image = apply_color_manipulation(self.processed_image, r, g, b)
-            self.update_images()
+        self.apply_operation("apply_color_manipulation", {
+            "r_factor": int(self.red_slider.value),
+            "g_factor": int(self.green_slider.value),
+            "b_factor": int(self.blue_slider.value),
+        })
 
     def apply_crop(self, _):
-        if self.processed_image:
-            start_x = int(self.crop_start_x.value)
-            start_y = int(self.crop_start_y.value)
-            width = int(self.crop_width.value)
-            height = int(self.crop_height.value)
-            
-            self.processed_image = apply_crop_image(self.processed_image, start_y, start_x, height, width)
-            self.update_images()
+        self.apply_operation("apply_crop_image", {
+            "start_row": int(self.crop_start_y.value),
+            "start_col": int(self.crop_start_x.value),
+            "num_rows": int(self.crop_height.value),
+            "num_cols": int(self.crop_width.value),
+        })
 
     def apply_flip(self, _):
-        if self.processed_image:
-            self.processed_image = apply_flip(self.processed_image, self.flip_dropdown.value)
-            self.update_images()
+        self.apply_operation("apply_flip", {"flip_type": self.flip_dropdown.value})
 
     def apply_scale(self, _):
-        if self.processed_image:
-            self.processed_image = apply_scaling(self.processed_image, int(self.new_width.value), int(self.new_height.value))
-            self.update_images()
+        self.apply_operation("apply_scaling", {
+            "new_width": int(self.new_width.value),
+            "new_height": int(self.new_height.value),
+        })
 
     def apply_translate(self, _):
-        if self.processed_image:
-            self.processed_image = apply_translation(self.processed_image, int(self.translate_x.value), int(self.translate_y.value))
-            self.update_images()
+        self.apply_operation("apply_translation", {
+            "dx": int(self.translate_x.value),
+            "dy": int(self.translate_y.value),
+        })
 
     def apply_rotation(self, _):
-        if self.processed_image:
-            angle = float(self.rotation_angle.value)
-            self.processed_image = apply_rotation(self.processed_image, angle)
-            self.update_images()
+        self.apply_operation("apply_rotation", {"angle": float(self.rotation_angle.value)})
 
     def apply_brightness(self, _):
-        if self.processed_image:
-            factor = float(self.brightness_slider.value)
-            self.processed_image = apply_brightness(self.processed_image, factor)
-            self.update_images()
+        self.apply_operation("apply_brightness", {"brightness_factor": float(self.brightness_slider.value)})
 
     def apply_contrast(self, _):
-        if self.processed_image:
-            factor = float(self.contrast_slider.value)
-            self.processed_image = apply_contrast(self.processed_image, factor)
-            self.update_images()
+        self.apply_operation("apply_contrast", {"contrast_factor": float(self.contrast_slider.value)})
 
     def apply_he(self, _):
-        if self.processed_image:
-            self.processed_image = apply_histogram_equalization(self.processed_image)
-            self.update_images()
+        self.apply_operation("apply_histogram_equalization", {})
 
     def apply_cs(self, _):
-        if self.processed_image:
-            self.processed_image = apply_contrast_stretching(self.processed_image)
-            self.update_images()
+        self.apply_operation("apply_contrast_stretching", {})
 
     def apply_gc(self, _):
-        if self.processed_image:
-            gamma = float(self.gamma.value)
-            self.processed_image = apply_gamma_correction(self.processed_image, gamma)
-            self.update_images()
+        self.apply_operation("apply_gamma_correction", {"gamma": float(self.gamma.value)})
 
     def apply_color_filtering(self, _):
-        if self.processed_image:
-            self.processed_image = apply_color_filter(self.processed_image, self.filter_dropdown.value)
-            self.update_images()
-    
+        self.apply_operation("apply_color_filter", {"filter_type": self.filter_dropdown.value})
+
     def apply_gaussian(self, _):
-        if self.processed_image:
-            self.processed_image = apply_gaussian_filter(self.processed_image)
-            self.update_images()
+        self.apply_operation("apply_gaussian_filter", {})
 
     def apply_median(self, _):
-        if self.processed_image:
-            self.processed_image = apply_median_filter(self.processed_image)
-            self.update_images()
+        self.apply_operation("apply_median_filter", {})
 
     def apply_mean(self, _):
-        if self.processed_image:
-            self.processed_image = apply_mean_filter(self.processed_image)
-            self.update_images()
+        self.apply_operation("apply_mean_filter", {})
 
     def apply_sobel(self, _):
-        if self.processed_image:
-            self.processed_image = apply_sobel_filter(self.processed_image)
-            self.update_images()
+        self.apply_operation("apply_sobel_filter", {})
 
     def apply_canny(self, _):
-        if self.processed_image:
-            self.processed_image = apply_canny_filter(self.processed_image)
-            self.update_images()
+        self.apply_operation("apply_canny_filter", {})
 
     def apply_laplacian(self, _):
-        if self.processed_image:
-            self.processed_image = apply_laplacian_filter(self.processed_image)
-            self.update_images()
+        self.apply_operation("apply_laplacian_filter", {})
 
     def apply_wiener(self, _):
-        if self.processed_image:
-            self.processed_image = apply_wiener_filter(self.processed_image)
-            self.update_images()
+        self.apply_operation("apply_wiener_filter", {
+            "psf": self.wiener_psf.value.lower(),
+            "size": int(self.wiener_size.value),
+        })
+
+    def frequency_params(self):
+        return {
+            "radius": int(self.frequency_radius.value),
+            "mask": self.frequency_mask.value.lower(),
+        }
 
     def apply_high_pass(self, _):
-        if self.processed_image:
-            self.processed_image = apply_high_pass_filter(self.processed_image)
-            self.update_images()
+        self.apply_operation("apply_high_pass_filter", self.frequency_params())
 
     def apply_low_pass(self, _):
-        if self.processed_image:
-            self.processed_image = apply_low_pass_filter(self.processed_image)
-            self.update_images()
+        self.apply_operation("apply_low_pass_filter", self.frequency_params())
 
     def apply_border(self, _):
-        if self.processed_image:
-            thickness = int(self.border_thickness.value)
-            color = self.border_color.value
-            self.processed_image = apply_border(self.processed_image, thickness, color)
-            self.update_images()
+        self.apply_operation("apply_border", {
+            "thickness": int(self.border_thickness.value),
+            "color": self.border_color.value,
+        })
 
     def apply_morphological(self, operation_type):
-        if self.processed_image:
-            self.processed_image = apply_morphological_operation(self.processed_image, operation_type)
-            self.update_images()
+        self.apply_operation("apply_morphological_operation", {"operation_type": operation_type})
 
     def reset_image(self, _):
-        if self.uploaded_image:
-            self.processed_image = self.uploaded_image.copy()
-            self.update_images()
+        if self.recipe is not None:
+            self.recipe.clear()
+            self.selected_step = None
+            self.render()
 
     def save_image(self, _):
-        if self.processed_image:
+        if self.processed_image is not None:
             self.save_file_dialog.save_file(
                 allowed_extensions=["png", "jpg", "jpeg"],
                 file_name="processed_image.png"
             )
+
+    def save_recipe(self, _):
+        if self.recipe is not None and self.recipe.steps:
+            self.save_recipe_dialog.save_file(
+                allowed_extensions=["json"],
+                file_name="recipe.json"
+            )
+
     def create_tool_button(self, text, icon, on_click):
         return ft.Container(
             content=ft.Row(
@@ -290,6 +399,10 @@ class PhotoEditorPage(ft.UserControl):
     def reset_input(self):
         self.uploaded_image = None
         self.processed_image = None
+        self.proxy_image = None
+        self.recipe = None
+        self.selected_step = None
+        self.update_history()
         self.output_image.controls[0].content = ft.Container(
             content=ft.IconButton(
                 icon=ft.icons.ADD_PHOTO_ALTERNATE_ROUNDED,
@@ -419,7 +532,21 @@ class PhotoEditorPage(ft.UserControl):
                         self.create_tool_button("Sobel Filter", ft.icons.FILTER_4, self.apply_sobel),
                         self.create_tool_button("Canny Filter", ft.icons.FILTER_5, self.apply_canny),
                         self.create_tool_button("Laplacian Filter", ft.icons.FILTER_6, self.apply_laplacian),
-                        self.create_tool_button("Wiener Filter", ft.icons.FILTER_7, self.apply_wiener),
+                        ft.Row(
+                            [
+                                self.wiener_psf,
+                                self.wiener_size,
+                                self.create_tool_button("Wiener Filter", ft.icons.FILTER_7, self.apply_wiener),
+                            ],
+                            spacing=5
+                        ),
+                        ft.Row(
+                            [
+                                self.frequency_mask,
+                                ft.Container(content=self.frequency_radius, expand=True),
+                            ],
+                            spacing=5
+                        ),
                         self.create_tool_button("Low Pass Filter", ft.icons.FILTER_8, self.apply_low_pass),
                         self.create_tool_button("High Pass Filter", ft.icons.FILTER_9, self.apply_high_pass),
                         ft.Row(
@@ -517,9 +644,20 @@ class PhotoEditorPage(ft.UserControl):
             tile_padding=5,
         )
 
+        history_tools = ft.ExpansionTile(
+            title=ft.Text("History"),
+            subtitle=ft.Text("Select a step and apply the same tool to change it"),
+            controls=[
+                self.history,
+                self.create_tool_button("Save Recipe", ft.icons.SAVE_OUTLINED, self.save_recipe),
+            ],
+            tile_padding=5,
+        )
+
         # Create toolbar with ExpansionTiles
         toolbar = ft.Column(
             controls=[
+                history_tools,
                 crop_rotate_tools,
                 transform_tools,
                 filter_tools,
@@ -548,8 +686,8 @@ class PhotoEditorPage(ft.UserControl):
                         border_radius=10,
                         alignment=ft.alignment.center,
                     ),
-                    width=600,
-                    height=600,
+                    width=PREVIEW_WIDTH,
+                    height=PREVIEW_HEIGHT,
                     bgcolor=ft.colors.GREY_50,
                     border_radius=10,
                     alignment=ft.alignment.center,
@@ -576,6 +714,7 @@ class PhotoEditorPage(ft.UserControl):
                                             icon=ft.icons.REFRESH,
                                             on_click=self.reset_image,
                                         ),
+                                        self.preview_mode,
                                     ],
                                     alignment=ft.MainAxisAlignment.CENTER,
                                     spacing=20,
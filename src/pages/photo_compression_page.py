@@ -1,5 +1,4 @@
-import base64
-import io
+import threading
 import uuid
 import flet as ft
 from flet import (
@@ -12,6 +11,10 @@ from flet import (
     IconButton,
     ElevatedButton,
     Slider,
+    DataTable,
+    DataColumn,
+    DataRow,
+    DataCell,
     alignment,
     border_radius,
     padding,
@@ -23,7 +26,24 @@ from flet import (
 import numpy as np
 from PIL import Image as PILImage
 
-from libs.compression_ops import compress_image_dct, compress_image_rle
+from libs.compression_analytics import compression_report, report_to_csv
+from libs.dct_codec import (
+    DEFAULT_QUALITY,
+    SUBSAMPLING_MODES,
+    decode_dct,
+    decode_dct_preview,
+    encode_dct,
+    encode_dct_to_size,
+    read_header,
+)
+from libs.preview_encoder import encode_png, encode_preview
+from libs.rle_format import decode_rle, encode_rle
+
+def format_size(n):
+    for unit in ("B", "KB", "MB"):
+        if n < 1024 or unit == "MB":
+            return f"{n:.0f} {unit}" if unit == "B" else f"{n:.1f} {unit}"
+        n /= 1024
 
 class PhotoCompressionPage(UserControl):
     def __init__(self, page, on_back):
@@ -35,8 +55,23 @@ class PhotoCompressionPage(UserControl):
         self.image_container = None
         self.result_container = None
         self.download_button = None
+        self.save_compressed_button = None
+        self.compressed_data = None
+        self.compressed_format = None
+        # Bumped for every compression, so a full decode still running for an
+        # older one is dropped; the lock makes the check and the display atomic
+        self.result_generation = 0
+        self.result_lock = threading.Lock()
+        self.size_text = None
+        self.quality_slider = None
+        self.target_size = None
+        self.subsampling = None
         self.method_buttons = None
         self.selected_method = "RLE"
+        self.report_rows = None
+        self.report_table = None
+        self.report_status = None
+        self.export_report_button = None
 
     def add_image(self, e):
         def on_result(e: ft.FilePickerResultEvent):
@@ -62,39 +97,96 @@ class PhotoCompressionPage(UserControl):
             img = PILImage.open(self.selected_image.src).convert("RGB")
             img_array = np.array(img)
 
-            # Compress the image based on the selected method
+            # Encode to the selected file format and show what decoding it gives
             if self.selected_method == "RLE":
-                compressed_array = compress_image_rle(img_array)  # Call RLE compression function
+                data = encode_rle(img_array)
             else:  # DCT
-                compressed_array = compress_image_dct(img_array)  # Call DCT compression function
-
-            # Convert the compressed array back to an image
-            compressed_img = PILImage.fromarray(compressed_array.astype('uint8'))
-
-            # Save the compressed image in a high-compression format (JPEG with quality 85)
-            self.result_image = io.BytesIO()
-            compressed_img.save(self.result_image, format="JPEG", quality=85)
-            self.result_image.seek(0)
-
-            # Update the UI with the result image
-            result = Image(
-                src_base64=base64.b64encode(self.result_image.getvalue()).decode("utf-8"),
-                width=300,
-                height=300,
-                fit=ft.ImageFit.CONTAIN,
-            )
-            self.result_container.content = result
-            self.download_button.disabled = False
-            self.update()
+                target = self.target_size.value.strip()
+                if target:
+                    # Rate control picks the quality that fits the budget
+                    try:
+                        target_bytes = int(float(target) * 1024)
+                    except ValueError:
+                        self.page.show_snack_bar(ft.SnackBar(content=Text("Target size must be a number of KB")))
+                        return
+                    data = encode_dct_to_size(img_array, target_bytes, self.subsampling.value, progressive=True)
+                    self.quality_slider.value = read_header(data)["quality"]
+                else:
+                    data = encode_dct(img_array, int(self.quality_slider.value), subsampling=self.subsampling.value,
+                                      progressive=True)
+
+            with self.result_lock:
+                self.result_generation += 1
+                self.compressed_data = data
+                self.compressed_format = self.selected_method.lower()
+                ratio = img_array.nbytes / len(data)
+                self.size_text.value = f"{format_size(img_array.nbytes)} -> {format_size(len(data))} ({ratio:.2f}:1)"
+                self.result_image = None
+
+                if self.selected_method == "RLE":
+                    self.show_result(decode_rle(data))
+                else:
+                    # The DC scan gives a 1/8 scale preview right away; the full
+                    # decode runs on a worker thread and replaces it when done
+                    self.show_result(decode_dct_preview(data), final=False)
+                    threading.Thread(target=self.finish_decode, args=(data, self.result_generation),
+                                     daemon=True).start()
+
+    def finish_decode(self, data, generation):
+        try:
+            decoded = decode_dct(data)
+            error = None
+        except Exception as e:
+            decoded, error = None, e
+        with self.result_lock:
+            # Dropped if the image was compressed again in the meantime
+            if generation != self.result_generation:
+                return
+            if error is not None:
+                # Otherwise the page would sit on the preview with Download
+                # disabled and no explanation
+                self.page.show_snack_bar(ft.SnackBar(content=Text(f"Could not decode the compressed image: {error}")))
+            else:
+                self.show_result(decoded)
+
+    def show_result(self, image, final=True):
+        if final:
+            # Keep the decoded result at full resolution. The preview is a
+            # downscaled JPEG and the download a lossless PNG, so neither adds
+            # artefacts of its own on top of the compression being shown
+            self.result_image = image.astype('uint8')
+
+        # Update the UI with the result image
+        result = Image(
+            src_base64=encode_preview(image, 300, 300),
+            width=300,
+            height=300,
+            fit=ft.ImageFit.CONTAIN,
+        )
+        self.result_container.content = result
+        self.download_button.disabled = not final
+        self.save_compressed_button.disabled = False
+        self.update()
+
+    def save_compressed(self, e):
+        if self.compressed_data is not None:
+            # The compressed file itself, not the decoded image
+            unique_id = uuid.uuid4().hex
+            save_path = f"compressed_image_{unique_id}.{self.compressed_format}"
+            with open(save_path, "wb") as dst_file:
+                dst_file.write(self.compressed_data)
+
+            self.page.launch_url(save_path)
+            self.page.show_snack_bar(ft.SnackBar(content=Text("Compressed file downloaded successfully!")))
 
     def download_result(self, e):
-        if self.result_image:
+        if self.result_image is not None:
             # Save the image to a file
             unique_id = uuid.uuid4().hex  # Generate a UUID and get its hexadecimal representation
             # Construct the file path with the UUID
             save_path = f"compressed_image_{unique_id}.png"
             with open(save_path, "wb") as dst_file:
-                dst_file.write(self.result_image.getvalue())
+                dst_file.write(encode_png(self.result_image))
             
             # Trigger download
             self.page.launch_url(save_path)
@@ -104,10 +196,46 @@ class PhotoCompressionPage(UserControl):
 
     def save_file_result(self, e: ft.FilePickerResultEvent):
         if e.path:
-            img = Image.open(self.result_image.src)
-            img.save(e.path)
+            with open(e.path, "wb") as dst_file:
+                dst_file.write(encode_png(self.result_image))
             self.page.show_snack_bar(ft.SnackBar(content=Text("Image saved successfully!")))
 
+    def analyze_compression(self, e):
+        if not self.selected_image:
+            self.page.show_snack_bar(ft.SnackBar(content=Text("Add an image first!")))
+            return
+        self.report_status.value = "Encoding with every codec..."
+        self.update()
+
+        img_array = np.array(PILImage.open(self.selected_image.src).convert("RGB"))
+        self.report_rows = compression_report(img_array, int(self.quality_slider.value))
+        self.report_table.rows = [
+            DataRow(cells=[
+                DataCell(Text(row["method"])),
+                DataCell(Text(row["setting"])),
+                DataCell(Text(format_size(row["bytes"]))),
+                DataCell(Text(f"{row['ratio']:.2f}:1")),
+                DataCell(Text(f"{row['encode_ms']:.0f} / {row['decode_ms']:.0f}")),
+                DataCell(Text(f"{row['psnr_db']:.2f}")),
+                DataCell(Text(f"{row['ssim']:.4f}")),
+            ])
+            for row in self.report_rows
+        ]
+        self.report_table.visible = True
+        self.report_status.value = f"{img_array.shape[1]}x{img_array.shape[0]} image"
+        self.export_report_button.disabled = False
+        self.update()
+
+    def export_report(self, e):
+        if self.report_rows:
+            unique_id = uuid.uuid4().hex
+            save_path = f"compression_report_{unique_id}.csv"
+            with open(save_path, "w", newline="") as dst_file:
+                dst_file.write(report_to_csv(self.report_rows))
+
+            self.page.launch_url(save_path)
+            self.page.show_snack_bar(ft.SnackBar(content=Text("Report downloaded successfully!")))
+
     def show_preview(self, e):
         # Add your preview logic here
         print("Image preview clicked!")
@@ -213,6 +341,27 @@ class PhotoCompressionPage(UserControl):
             alignment=ft.MainAxisAlignment.CENTER,
         )
 
+        # DCT quality, as in JPEG
+        self.quality_slider = Slider(
+            min=1,
+            max=100,
+            divisions=99,
+            value=DEFAULT_QUALITY,
+            label="Quality {value}",
+            width=300,
+        )
+
+        # DCT chroma resolution: 4:2:0 codes half as many blocks as 4:4:4
+        self.subsampling = ft.Dropdown(
+            width=300,
+            label="Chroma subsampling",
+            options=[ft.dropdown.Option(mode) for mode in SUBSAMPLING_MODES],
+            value="4:4:4",
+        )
+
+        # Optional DCT file size budget, overrides the quality slider
+        self.target_size = ft.TextField(value="", label="Target size (KB)", hint_text="Use quality", width=300)
+
         # Compress button
         compress_button = ElevatedButton(
             text="Compress Image",
@@ -241,6 +390,59 @@ class PhotoCompressionPage(UserControl):
             disabled=True,
         )
 
+        self.save_compressed_button = ElevatedButton(
+            text="Compressed File",
+            icon=ft.icons.SAVE_ALT,
+            on_click=self.save_compressed,
+            disabled=True,
+        )
+
+        # Original and compressed sizes
+        self.size_text = Text("", size=14, color=colors.BLACK54)
+
+        # Size, speed and quality of every codec on the selected image
+        analyze_button = ElevatedButton(
+            text="Analyze",
+            icon=ft.icons.ANALYTICS,
+            on_click=self.analyze_compression,
+        )
+
+        self.export_report_button = ElevatedButton(
+            text="Export CSV",
+            icon=ft.icons.TABLE_VIEW,
+            on_click=self.export_report,
+            disabled=True,
+        )
+
+        self.report_status = Text("", size=14, color=colors.BLACK54)
+
+        self.report_table = DataTable(
+            columns=[
+                DataColumn(Text("Method")),
+                DataColumn(Text("Setting")),
+                DataColumn(Text("Size"), numeric=True),
+                DataColumn(Text("Ratio"), numeric=True),
+                DataColumn(Text("Enc / dec ms"), numeric=True),
+                DataColumn(Text("PSNR dB"), numeric=True),
+                DataColumn(Text("SSIM"), numeric=True),
+            ],
+            rows=[],
+            visible=False,
+        )
+
+        report_section = Column(
+            controls=[
+                Row(
+                    controls=[analyze_button, self.export_report_button, self.report_status],
+                    alignment=ft.MainAxisAlignment.CENTER,
+                    spacing=10,
+                ),
+                self.report_table,
+            ],
+            spacing=10,
+            horizontal_alignment=ft.CrossAxisAlignment.CENTER,
+        )
+
         # Main layout with horizontal arrangement
         main_content = Row(
             controls=[
@@ -250,6 +452,9 @@ class PhotoCompressionPage(UserControl):
                 Column(
                     controls=[
                         self.method_buttons,
+                        self.quality_slider,
+                        self.subsampling,
+                        self.target_size,
                         compress_button,
                     ],
                     spacing=20,
@@ -259,8 +464,9 @@ class PhotoCompressionPage(UserControl):
                 Column(
                     controls=[
                         self.result_container,
+                        self.size_text,
                         Row(
-                            controls=[self.download_button],
+                            controls=[self.download_button, self.save_compressed_button],
                             alignment=ft.MainAxisAlignment.CENTER,
                             spacing=10,
                         ),
@@ -280,6 +486,7 @@ class PhotoCompressionPage(UserControl):
                     Row([back_button], alignment=ft.MainAxisAlignment.START),
                     header,
                     main_content,
+                    report_section,
                     Container(
                         content=Text(
                             "Copyright © 2023 by Sona Enterprise",
@@ -1,5 +1,3 @@
-import base64
-import io
 import uuid
 import flet as ft
 from flet import (
@@ -22,11 +20,9 @@ from flet import (
     colors,
 )
 
-import numpy as np
-from PIL import Image as PILImage
-
 from libs.mathematical_operations import add_images, subtract_images, multiply_images, divide_images, bitwise_and_images, bitwise_or_images, bitwise_xor_images
 from libs.blend_image import blend_images, overlay_images
+from libs.preview_encoder import encode_png, encode_preview
 
 class PhotoOperatorsPage(UserControl):
     def __init__(self, page, on_back):
@@ -178,17 +174,13 @@ class PhotoOperatorsPage(UserControl):
             else:
                 return
 
-            # Convert the result array back to an image
-            result_img = PILImage.fromarray(result_array.astype('uint8'))
-
-            # Save the image to an in-memory buffer
-            self.result_image = io.BytesIO()
-            result_img.save(self.result_image, format="PNG")
-            self.result_image.seek(0)
+            # Keep the full resolution result; it is only encoded losslessly
+            # on download
+            self.result_image = result_array.astype('uint8')
 
             # Update the result image
             result = Image(
-                src_base64= base64.b64encode(self.result_image.getvalue()).decode("utf-8"),
+                src_base64=encode_preview(self.result_image, 300, 300),
                 width=300,
                 height=300,
                 fit=ft.ImageFit.CONTAIN,
@@ -198,13 +190,13 @@ class PhotoOperatorsPage(UserControl):
             self.update()
 
     def download_result(self, e):
-        if self.result_image:
+        if self.result_image is not None:
             # Save the image to a file
             unique_id = uuid.uuid4().hex  # Generate a UUID and get its hexadecimal representation
             # Construct the file path with the UUID
             save_path = f"operated_image_{unique_id}.png"
             with open(save_path, "wb") as dst_file:
-                dst_file.write(self.result_image.getvalue())
+                dst_file.write(encode_png(self.result_image))
             
             # Trigger download
             self.page.launch_url(save_path)
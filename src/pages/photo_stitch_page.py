@@ -16,12 +16,11 @@ from flet import (
     colors,
     animation,
 )
-import base64
-import io
 from PIL import Image as PILImage
 import cv2
 import numpy as np
 import uuid
+from libs.preview_encoder import encode_png, encode_preview
 
 class PhotoStitchPage(UserControl):
     def __init__(self, page, on_back):
@@ -117,19 +116,12 @@ class PhotoStitchPage(UserControl):
         if status != cv2.STITCHER_OK:
             self.page.show_snack_bar(ft.SnackBar(content=Text("Stitching unsuccessful")))
         else:
-            # Convert the output image to PIL Image
-            output_rgb = cv2.cvtColor(output, cv2.COLOR_BGR2RGB)
+            # Keep the full resolution result; it is only encoded losslessly
+            # on download
+            self.result_image = cv2.cvtColor(output, cv2.COLOR_BGR2RGB)
 
-            output_pil = PILImage.fromarray(output_rgb)
-            # Save the stitched image
-
-            # Save the image to an in-memory buffer
-            self.result_image = io.BytesIO()
-            output_pil.save(self.result_image, format="PNG")
-            self.result_image.seek(0)
-            
             result = Image(
-                src_base64= base64.b64encode(self.result_image.getvalue()).decode("utf-8"),
+                src_base64=encode_preview(self.result_image, 760, 260),
                 width=760,
                 height=260,
                 fit=ft.ImageFit.CONTAIN,
@@ -138,13 +130,13 @@ class PhotoStitchPage(UserControl):
             self.update()
 
     def download_result(self, e):
-        if self.result_image:
+        if self.result_image is not None:
             # Save the image to a file
             unique_id = uuid.uuid4().hex  # Generate a UUID and get its hexadecimal representation
             # Construct the file path with the UUID
             save_path = f"stitched_image_{unique_id}.png"
             with open(save_path, "wb") as dst_file:
-                dst_file.write(self.result_image.getvalue())
+                dst_file.write(encode_png(self.result_image))
             
             # Trigger download
             self.page.launch_url(save_path)